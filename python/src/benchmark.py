@@ -0,0 +1,1066 @@
+#!/usr/bin/env python
+'''
+Timing harness for the geobox encoders.  Run it from python/src:
+
+    python benchmark.py             # every section
+    python benchmark.py encode      # only the named sections
+
+The sections compare an old code path with its replacement.  The suite
+times the public encoders and queries across precisions and batch sizes,
+and keeps the results to catch regressions:
+
+    python benchmark.py --suite                         # print the timings
+    python benchmark.py --suite --json baseline.json    # save them
+    python benchmark.py --compare baseline.json         # exit 1 on a regression
+
+--only keeps the suite benchmarks whose name contains the given text, and
+--threshold sets the slowdown reported as a regression, 0.25 (25%) by
+default.  Timings are only comparable on the same machine and interpreter.
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import platform
+import random
+import sys
+import types
+from collections import OrderedDict
+from timeit import default_timer
+
+from geobox import (
+    CellPyramid, GeoBoxEncoder, GeofenceEngine, GeoIndex, GeoPoint, GeoPointArray, PolygonIndex, geometry,
+    spatial_join)
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def timed(func, number, repeat=3):
+    '''
+    Return the best time per call, in micro seconds, of calling func() number times
+    '''
+    best = None
+    for _ in range(repeat):
+        start = default_timer()
+        for _ in range(number):
+            func()
+        elapsed = default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1e6 / number
+
+
+def allocations(func):
+    '''
+    Return (blocks, bytes) still allocated by what func() returns.  Without
+    tracemalloc (Python 2) they are estimated by reachable_size.
+    '''
+    if tracemalloc is None:
+        return reachable_size(func())
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = func()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    del result
+    return sum(s.count_diff for s in stats), sum(s.size_diff for s in stats)
+
+
+def reachable_size(obj):
+    '''
+    Return (objects, bytes) of the objects reachable from obj, measured with
+    sys.getsizeof, which counts the buffer of a NumPy array in the array
+    owning it.  Unlike tracemalloc, objects shared with the inputs count too.
+    '''
+    seen = set()
+    stack = [obj]
+    objects = size = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, (type, types.ModuleType, types.FunctionType)):
+            continue
+        seen.add(id(item))
+        objects += 1
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, '__array_interface__'):
+            # A view holds the array owning its buffer
+            if item.base is not None:
+                stack.append(item.base)
+        else:
+            stack.extend(getattr(item, '__dict__', {}).values())
+            for cls in type(item).__mro__:
+                for slot in getattr(cls, '__slots__', ()):
+                    if hasattr(item, slot):
+                        stack.append(getattr(item, slot))
+    return objects, size
+
+
+def report(name, baseline, current):
+    print("  {0:36} {1:10.2f} us {2:10.2f} us   x{3:.1f}".format(name, baseline, current, baseline / current))
+
+
+def random_points(count, seed=2013):
+    rnd = random.Random(seed)
+    return [(rnd.uniform(-90, 90), rnd.uniform(-180, 180)) for _ in range(count)]
+
+
+def bench_encode():
+    print("encode/decode: bisection vs integer engine (per call)")
+    points = random_points(1000)
+    for precision in (GeoBoxEncoder.DEFAULT_PRECISION, GeoBoxEncoder.MAX_PRECISION):
+        ids = [GeoBoxEncoder.encode(lat, lng, precision) for lat, lng in points]
+
+        def encode_bisect():
+            for lat, lng in points:
+                GeoBoxEncoder._encode_bisect(lat, lng, precision)
+
+        def encode_int():
+            for lat, lng in points:
+                GeoBoxEncoder.encode(lat, lng, precision)
+
+        def decode_bisect():
+            for geobox_id in ids:
+                GeoBoxEncoder._decode_bisect(geobox_id)
+
+        def decode_int():
+            for geobox_id in ids:
+                GeoBoxEncoder.decode(geobox_id)
+
+        count = len(points)
+        report("encode precision=%d" % precision,
+               timed(encode_bisect, 10) / count, timed(encode_int, 10) / count)
+        report("decode precision=%d" % precision,
+               timed(decode_bisect, 10) / count, timed(decode_int, 10) / count)
+
+
+def bench_batch():
+    try:
+        import numpy as np
+    except ImportError:
+        print("batch: skipped, numpy not installed")
+        return
+
+    print("encode_many/decode_many: scalar loop vs NumPy (per point)")
+    points = random_points(100000)
+    lats = np.array([p[0] for p in points])
+    lngs = np.array([p[1] for p in points])
+    precision = GeoBoxEncoder.DEFAULT_PRECISION
+    ids = GeoBoxEncoder.encode_many(lats, lngs, precision)
+    str_ids = [GeoBoxEncoder.encode(lat, lng, precision) for lat, lng in points]
+
+    def encode_loop():
+        for lat, lng in points:
+            GeoBoxEncoder.encode(lat, lng, precision)
+
+    def decode_loop():
+        for geobox_id in str_ids:
+            GeoBoxEncoder.decode(geobox_id)
+
+    count = len(points)
+    report("encode_many n=%d" % count, timed(encode_loop, 1) / count,
+           timed(lambda: GeoBoxEncoder.encode_many(lats, lngs, precision), 3) / count)
+    report("encode_many codes n=%d" % count, timed(encode_loop, 1) / count,
+           timed(lambda: GeoBoxEncoder.encode_many(lats, lngs, precision, codes=True), 3) / count)
+    report("decode_many n=%d" % count, timed(decode_loop, 1) / count,
+           timed(lambda: GeoBoxEncoder.decode_many(ids), 3) / count)
+
+
+def bench_distance():
+    try:
+        import numpy as np
+    except ImportError:
+        print("distance: skipped, numpy not installed")
+        return
+
+    print("haversine: per pair loop vs shared kernel on arrays (per pair)")
+    points = random_points(100000)
+    lats = np.array([p[0] for p in points])
+    lngs = np.array([p[1] for p in points])
+    origin = (41.87643118161227, 12.481563961993402)
+
+    def pair_loop():
+        for latLng in points:
+            GeoBoxEncoder.haversine(origin, latLng)
+
+    count = len(points)
+    baseline = timed(pair_loop, 1) / count
+    report("haversine_many n=%d" % count, baseline,
+           timed(lambda: GeoBoxEncoder.haversine_many(origin, lats, lngs), 3) / count)
+    report("haversine_matrix 300x%d" % count, baseline,
+           timed(lambda: GeoBoxEncoder.haversine_matrix(lats[:300], lngs[:300], lats, lngs), 1) / count / 300)
+    report("within_distance 50km prefilter", baseline,
+           timed(lambda: GeoBoxEncoder.within_distance(origin, lats, lngs, 50000), 3) / count)
+    report("within_distance 50km no prefilter", baseline,
+           timed(lambda: GeoBoxEncoder.within_distance(origin, lats, lngs, 50000, prefilter=False), 3) / count)
+
+
+def bench_geopoint():
+    print("GeoPoint: box built at construction vs on first access (per point)")
+    points = random_points(2000)
+
+    def eager():
+        return [GeoPoint(latitude=lat, longitude=lng).box for lat, lng in points]
+
+    def lazy():
+        return [GeoPoint(latitude=lat, longitude=lng) for lat, lng in points]
+
+    count = len(points)
+    report("GeoPoint(lat, lng)", timed(eager, 5) / count, timed(lazy, 5) / count)
+
+    eager_allocs, lazy_allocs = allocations(eager), allocations(lazy)
+    print("  {0:36} {1:10.1f} blk {2:9.1f} blk".format(
+        "allocations per point", eager_allocs[0] / float(count), lazy_allocs[0] / float(count)))
+    print("  {0:36} {1:10.0f} B   {2:9.0f} B".format(
+        "memory per point", eager_allocs[1] / float(count), lazy_allocs[1] / float(count)))
+
+
+def bench_neighbors():
+    print("neighbors: re-encoding offset centers vs cell arithmetic (per call)")
+    points = random_points(1000)
+    ids = [GeoBoxEncoder.encode(lat, lng) for lat, lng in points]
+
+    def reencode():
+        for geobox_id in ids:
+            precision = len(geobox_id)
+            spacing = 180 / (2.0 ** (precision - 1))
+            lat, lng = GeoBoxEncoder.decode(geobox_id)
+            for _, direction_lat, direction_long in GeoBoxEncoder.NEIGHBORS:
+                GeoBoxEncoder.encode(lat + direction_lat * spacing, lng + direction_long * spacing, precision)
+
+    def arithmetic():
+        for geobox_id in ids:
+            GeoBoxEncoder.neighbors(geobox_id)
+
+    count = len(ids)
+    baseline = timed(reencode, 5) / count
+    report("neighbors", baseline, timed(arithmetic, 5) / count)
+    try:
+        import numpy as np
+    except ImportError:
+        return
+    array = np.array(ids)
+    report("neighbors_many n=%d" % count, baseline, timed(lambda: GeoBoxEncoder.neighbors_many(array), 5) / count)
+
+
+def bench_geocode():
+    from gbox import Geocode
+
+    print("gbox.Geocode: bisection vs quantize and interleave (per point)")
+    points = [(lng, lat) for lat, lng in random_points(1000)]
+
+    def bisect():
+        # Halve the bounds of both axes once per bit, as Geocode used to
+        for x, y in points:
+            (x_lbound, x_ubound), (y_lbound, y_ubound) = Geocode.LON_BOUND, Geocode.LAT_BOUND
+            code = 0
+            for _ in range(32):
+                x_mid = (x_lbound + x_ubound) / 2.0
+                y_mid = (y_lbound + y_ubound) / 2.0
+                x_bit, y_bit = x > x_mid, y > y_mid
+                x_lbound, x_ubound = (x_mid, x_ubound) if x_bit else (x_lbound, x_mid)
+                y_lbound, y_ubound = (y_mid, y_ubound) if y_bit else (y_lbound, y_mid)
+                code = (code << 2) | (x_bit << 1) | y_bit
+
+    def interleaved():
+        for lon, lat in points:
+            Geocode(lon, lat)
+
+    count = len(points)
+    baseline = timed(bisect, 10) / count
+    report("Geocode(lon, lat)", baseline, timed(interleaved, 10) / count)
+    codes = [Geocode(lon, lat).gcode() for lon, lat in points]
+    report("Geocode.from_code", baseline, timed(lambda: [Geocode.from_code(c) for c in codes], 10) / count)
+    try:
+        import numpy as np
+    except ImportError:
+        return
+    lons = np.array([p[0] for p in points] * 100)
+    lats = np.array([p[1] for p in points] * 100)
+    report("Geocode.encode_many n=%d" % lons.size, baseline,
+           timed(lambda: Geocode.encode_many(lons, lats), 3) / lons.size)
+    array = Geocode.encode_many(lons, lats)
+    report("Geocode.decode_many n=%d" % lons.size, baseline,
+           timed(lambda: Geocode.decode_many(array), 3) / lons.size)
+
+
+def clustered_points(size, seed=2013):
+    '''
+    Points around a few hundred "cities" of various sizes over a uniform
+    background, closer to real data than a uniform spread
+    '''
+    import numpy as np
+    rnd = np.random.RandomState(seed)
+    cities = 300
+    centers_lon = rnd.uniform(-130, 150, cities)
+    centers_lat = np.degrees(np.arcsin(rnd.uniform(-0.8, 0.9, cities)))
+    weights = rnd.pareto(1.2, cities) + 1
+    city = rnd.choice(cities, size, p=weights / weights.sum())
+    spread = rnd.uniform(0.02, 0.5, cities)[city]
+    lons = centers_lon[city] + rnd.normal(0, 1, size) * spread
+    lats = np.clip(centers_lat[city] + rnd.normal(0, 1, size) * spread, -90, 90)
+    background = rnd.rand(size) < 0.1
+    lons[background] = rnd.uniform(-180, 180, background.sum())
+    lats[background] = rnd.uniform(-90, 90, background.sum())
+    return (lons + 180) % 360 - 180, lats
+
+
+def bench_ranges():
+    try:
+        import numpy as np
+    except ImportError:
+        print("ranges: skipped, numpy not installed")
+        return
+    from gbox import Geocode
+
+    print("Geocode key ranges: full column scan vs BETWEEN scans on a sorted column (per query)")
+    lons, lats = clustered_points(10 ** 6)
+    rnd = np.random.RandomState(7)
+    queries = rnd.choice(lons.size, 20, replace=False)
+    for radius in (1000, 10000, 50000):
+        def brute():
+            for i in queries:
+                GeoBoxEncoder.haversine_many((lats[i], lons[i]), lats, lons) <= radius
+        baseline = timed(brute, 1) / len(queries)
+        matched = sum(int((GeoBoxEncoder.haversine_many((lats[i], lons[i]), lats, lons) <= radius).sum())
+                      for i in queries) / float(len(queries))
+
+        for max_ranges in (4, 16, 64):
+            counts = []
+            for curve in Geocode.CURVES:
+                keys = np.sort(Geocode.encode_many(lons, lats, curve=curve))
+
+                def query():
+                    ranges_count = scanned = 0
+                    for i in queries:
+                        ranges = Geocode.ranges_circle(lons[i], lats[i], radius, max_ranges, curve=curve)
+                        lo = np.array([r[0] for r in ranges], dtype=np.int64)
+                        hi = np.array([r[1] for r in ranges], dtype=np.int64)
+                        scanned += int((np.searchsorted(keys, hi, 'right') - np.searchsorted(keys, lo, 'left')).sum())
+                        ranges_count += len(ranges)
+                    return ranges_count, scanned
+
+                report("radius=%dm max_ranges=%d %s" % (radius, max_ranges, curve), baseline,
+                       timed(query, 1) / len(queries))
+                counts.append((curve,) + tuple(c / float(len(queries)) for c in query()))
+            print("  {0:36} matched={1:.0f} ".format("", matched) + " ".join(
+                "{0}: ranges={1:.1f} scanned={2:.0f}".format(*c) for c in counts))
+
+INDEX_SIZES = (10 ** 5, 10 ** 6, 10 ** 7)
+
+
+def bench_index():
+    try:
+        import numpy as np
+    except ImportError:
+        print("index: skipped, numpy not installed")
+        return
+
+    print("GeoIndex: brute force haversine scan vs index (per query)")
+    rnd = np.random.RandomState(2013)
+    queries = [(rnd.uniform(-60, 60), rnd.uniform(-180, 180)) for _ in range(20)]
+    for size in INDEX_SIZES:
+        lats = rnd.uniform(-90, 90, size)
+        lngs = rnd.uniform(-180, 180, size)
+        start = default_timer()
+        index = GeoIndex(lats, lngs)
+        print("  {0:36} {1:10.2f} s".format("bulk load n=%d" % size, default_timer() - start))
+
+        def brute_radius():
+            for latLng in queries:
+                distances = GeoBoxEncoder.haversine_many(latLng, lats, lngs)
+                np.flatnonzero(distances <= 50000)
+
+        def index_radius():
+            for lat, lng in queries:
+                index.within_radius(lat, lng, 50000)
+
+        def brute_knn():
+            for latLng in queries:
+                distances = GeoBoxEncoder.haversine_many(latLng, lats, lngs)
+                np.argpartition(distances, 10)[:10]
+
+        def index_knn():
+            for lat, lng in queries:
+                index.k_nearest(lat, lng, 10)
+
+        count = len(queries)
+        report("within_radius 50km n=%d" % size, timed(brute_radius, 1) / count, timed(index_radius, 1) / count)
+        report("k_nearest k=10 n=%d" % size, timed(brute_knn, 1) / count, timed(index_knn, 1) / count)
+        index = lats = lngs = None
+
+
+def bench_points():
+    try:
+        import numpy as np
+    except ImportError:
+        print("points: skipped, numpy not installed")
+        return
+
+    print("GeoPointArray: list of GeoPoint vs columns (per point)")
+    size = 20000
+    rnd = np.random.RandomState(2013)
+    lats = rnd.uniform(-90, 90, size)
+    lngs = rnd.uniform(-180, 180, size)
+    pairs = list(zip(lats.tolist(), lngs.tolist()))
+    origin = GeoPoint(45.46, 9.19)
+
+    def objects():
+        return [GeoPoint(latitude=lat, longitude=lng) for lat, lng in pairs]
+
+    def columns():
+        return GeoPointArray.from_coordinates(lats, lngs)
+
+    points, array = objects(), columns()
+    report("construct", timed(objects, 1) / size, timed(columns, 3) / size)
+    report("gcode", timed(lambda: [p.gcode for p in points], 3) / size, timed(array.gcode, 3) / size)
+    report("distance_from", timed(lambda: [origin.distance_from(p) for p in points], 1) / size,
+           timed(lambda: array.distance_from(origin), 3) / size)
+    # GeoPoint keeps its neighbors: time fresh points, their construction included
+    sample = pairs[:1000]
+    report("neighbors", timed(lambda: [GeoPoint(lat, lng).neighbors() for lat, lng in sample], 1) / len(sample),
+           timed(array[:1000].neighbors, 3) / len(sample))
+    report("sort by code", timed(lambda: sorted(points, key=lambda p: p.gcode), 1) / size,
+           timed(lambda: array.argsort(), 3) / size)
+
+    object_allocs = allocations(objects)
+    box_allocs = allocations(lambda: [p.box for p in objects()])
+    array_allocs = allocations(columns)
+    print("  {0:36} {1:10.0f} B   {2:9.0f} B".format(
+        "memory per point", object_allocs[1] / float(size), array_allocs[1] / float(size)))
+    print("  {0:36} {1:10.0f} B   {2:9.0f} B".format(
+        "memory per point, box built", box_allocs[1] / float(size), array_allocs[1] / float(size)))
+    print("  {0:36} {1:10.0f} B".format("GeoPointArray columns per point", array.nbytes / float(size)))
+
+
+def bench_serialize():
+    try:
+        import numpy as np
+    except ImportError:
+        print("serialize: skipped, numpy not installed")
+        return
+    from geobox import GeoPointEncoder, serialize
+
+    print("serialize: json with GeoPointEncoder vs geobox.serialize (per point)")
+    size = 50000
+    rnd = np.random.RandomState(2013)
+    array = GeoPointArray.from_coordinates(rnd.uniform(-90, 90, size), rnd.uniform(-180, 180, size))
+    points = list(array)
+    encoder = GeoPointEncoder()
+
+    def json_ndjson():
+        return ''.join(encoder.encode(p) + '\n' for p in points)
+
+    text = json_ndjson()
+    report("ndjson, GeoPoint list", timed(json_ndjson, 1) / size, timed(lambda: serialize.dumps(points), 1) / size)
+    report("ndjson, GeoPointArray", timed(json_ndjson, 1) / size, timed(lambda: serialize.dumps(array), 3) / size)
+    report("json array, GeoPointArray", timed(lambda: json.dumps(points, cls=GeoPointEncoder), 1) / size,
+           timed(lambda: serialize.dumps(array, ndjson=False), 3) / size)
+    report("ndjson with box, GeoPointArray", timed(lambda: serialize.dumps(points, box=True), 1) / size,
+           timed(lambda: serialize.dumps(array, box=True), 3) / size)
+    report("load ndjson", timed(lambda: [json.loads(line) for line in text.splitlines()], 1) / size,
+           timed(lambda: serialize.load(text), 3) / size)
+
+
+JOIN_SIZES = (200000, 20000)
+
+
+def bench_join():
+    try:
+        import numpy as np
+    except ImportError:
+        print("join: skipped, numpy not installed")
+        return
+    import multiprocessing
+
+    radius = 1000.0
+    rnd = np.random.RandomState(2013)
+    # Clustered around a few cities, as check-ins and venues are
+    city_lats, city_lngs = rnd.uniform(-60, 60, 50), rnd.uniform(-180, 180, 50)
+
+    def points(size):
+        city = rnd.randint(0, 50, size)
+        return city_lats[city] + rnd.normal(0, 0.2, size), city_lngs[city] + rnd.normal(0, 0.2, size)
+
+    def run(left, right, processes):
+        return sum(c[2].size for c in spatial_join(left[0], left[1], right[0], right[1], radius, processes))
+
+    print("spatial join: GeoPoint neighbors and distance_from vs spatial_join (per left point)")
+    left, right = points(500), points(2000)
+
+    def geopoints():
+        by_box = {}
+        for i, (lat, lng) in enumerate(zip(*right)):
+            by_box.setdefault(GeoBoxEncoder.encode(lat, lng, 15), []).append((i, GeoPoint(lat, lng, precision=15)))
+        pairs = 0
+        for lat, lng in zip(*left):
+            point = GeoPoint(lat, lng, precision=15)
+            for geobox_id in list(point.neighbors()) + [point.gcode]:
+                pairs += sum(1 for _, other in by_box.get(geobox_id, ()) if point.distance_from(other) <= radius)
+        return pairs
+
+    report("radius 1km, %d x %d" % (left[0].size, right[0].size),
+           timed(geopoints, 1) / left[0].size, timed(lambda: run(left, right, 1), 3) / left[0].size)
+
+    left, right = points(JOIN_SIZES[0]), points(JOIN_SIZES[1])
+    print("spatial join: %d x %d points, radius 1km, by processes (%d CPUs)" % (
+        JOIN_SIZES[0], JOIN_SIZES[1], multiprocessing.cpu_count()))
+    single = None
+    for processes in sorted(set((1, 2, 4, multiprocessing.cpu_count()))):
+        start = default_timer()
+        pairs = run(left, right, processes)
+        elapsed = default_timer() - start
+        single = single or elapsed
+        print("  {0:36} {1:10.2f} s  {2:10d} pairs   x{3:.1f}".format(
+            "processes=%d" % processes, elapsed, pairs, single / elapsed))
+
+
+def bench_pyramid():
+    try:
+        import numpy as np
+    except ImportError:
+        print("pyramid: skipped, numpy not installed")
+        return
+
+    precisions = (4, 8, 12, 16)
+    size = 1000000
+    print("pyramid: counts at precisions %s, encode per precision vs CellPyramid (per point)" % (precisions,))
+    rnd = np.random.RandomState(2013)
+    lats, lngs = rnd.normal(45.46, 2, size), rnd.normal(9.19, 2, size)
+
+    def per_precision():
+        return [np.unique(GeoBoxEncoder.encode_many(lats, lngs, p), return_counts=True) for p in precisions]
+
+    def pyramid():
+        cells = CellPyramid(precisions)
+        cells.add(lats, lngs)
+        return cells
+
+    def batches():
+        cells = CellPyramid(precisions)
+        for start in range(0, size, 100000):
+            cells.add(lats[start:start + 100000], lngs[start:start + 100000])
+        return cells
+
+    def capped():
+        cells = CellPyramid(precisions, max_cells=10000, exact_precision=8)
+        for start in range(0, size, 100000):
+            cells.add(lats[start:start + 100000], lngs[start:start + 100000])
+        return cells
+
+    baseline = timed(per_precision, 1) / size
+    report("n=%d, one batch" % size, baseline, timed(pyramid, 1) / size)
+    report("n=%d, batches of 100000" % size, baseline, timed(batches, 1) / size)
+    report("n=%d, capped to 10000 boxes" % size, baseline, timed(capped, 1) / size)
+    for name, cells in (("boxes kept, exact", pyramid()), ("boxes kept, capped", capped())):
+        print("  {0:36} {1}".format(name, [cells.level(p).codes.size for p in precisions]))
+
+
+def bench_polygon():
+    import math
+
+    print("polygon: ray casting vs PolygonIndex (per point)")
+    rnd = random.Random(2013)
+    points = [(rnd.uniform(44.5, 46.5), rnd.uniform(8.1, 10.3)) for _ in range(2000)]
+    for count in (100, 1000, 10000):
+        polygon = []
+        for i in range(count):
+            angle = 2 * math.pi * i / count
+            radius = 0.5 + 0.3 * math.sin(7 * angle) + 0.02 * rnd.random()
+            polygon.append((45.46 + radius * math.sin(angle), 9.19 + radius * math.cos(angle)))
+        edges = geometry.polygon_edges(polygon)
+
+        start = default_timer()
+        index = PolygonIndex(polygon, max_cells=512)
+        print("  {0:36} {1:10.3f} s   {2} interior, {3} boundary boxes".format(
+            "index build, %d vertices" % count, default_timer() - start, len(index.interior), len(index.boundary)))
+        baseline = timed(lambda: [geometry.contains(edges, lat, lng) for lat, lng in points], 1) / len(points)
+        report("contains, %d vertices" % count, baseline,
+               timed(lambda: [index.contains(lat, lng) for lat, lng in points], 3) / len(points))
+        try:
+            import numpy as np
+        except ImportError:
+            continue
+        lats, lngs = np.array(points).T
+        report("contains_many, %d vertices" % count, baseline,
+               timed(lambda: index.contains_many(lats, lngs), 3) / len(points))
+
+
+def trajectories(vehicles, steps, interval, seed=2013):
+    '''
+    Yield (vehicle_ids, latitudes, longitudes, timestamps) batches of
+    vehicles driving around northern Italy every interval seconds, a third
+    of them parked and the others at 5 to 15 m/s, turning now and then,
+    with a few meters of GPS noise
+    '''
+    import numpy as np
+    rnd = np.random.RandomState(seed)
+    lats, lngs = rnd.normal(45.46, 0.5, vehicles), rnd.normal(9.19, 0.7, vehicles)
+    speed = np.where(rnd.random_sample(vehicles) < 1 / 3.0, 0.0, rnd.uniform(5, 15, vehicles))
+    heading = rnd.uniform(0, 2 * np.pi, vehicles)
+    ids = list(range(vehicles))
+    for step in range(steps):
+        heading += rnd.normal(0, 0.3, vehicles)
+        meters = speed * interval + rnd.normal(0, 5, vehicles)
+        lats = lats + np.degrees(meters * np.cos(heading) / GeoBoxEncoder.EARTH_RADIUS)
+        lngs = lngs + np.degrees(meters * np.sin(heading) / GeoBoxEncoder.EARTH_RADIUS) / np.cos(np.radians(lats))
+        yield ids, lats, lngs, np.full(vehicles, step * interval)
+
+
+def bench_geofence():
+    try:
+        import numpy as np
+    except ImportError:
+        print("geofence: skipped, numpy not installed")
+        return
+
+    fences, vehicles, steps = 20000, 20000, 20
+    print("geofence: %d fences, %d vehicles x %d updates, brute force vs GeofenceEngine (per update)" % (
+        fences, vehicles, steps))
+    rnd = np.random.RandomState(2014)
+    lats, lngs = rnd.normal(45.46, 0.5, fences), rnd.normal(9.19, 0.7, fences)
+    circle = rnd.random_sample(fences) < 0.5
+    radius = rnd.uniform(50, 500, fences)
+    size = rnd.uniform(0.001, 0.005, fences)
+
+    start = default_timer()
+    engine = GeofenceEngine(precision=16, dwell=60)
+    for i in range(fences):
+        if circle[i]:
+            engine.add_circle(i, lats[i], lngs[i], radius[i])
+        else:
+            engine.add_rectangle(i, (lats[i], lngs[i]), (lats[i] + size[i], lngs[i] + size[i]))
+    print("  {0:36} {1:10.3f} s".format("index build", default_timer() - start))
+
+    batches = list(trajectories(vehicles, steps, 5.0))
+    _, sample_lats, sample_lngs, _ = batches[-1]
+
+    def brute_force():
+        for lat, lng in zip(sample_lats[:200], sample_lngs[:200]):
+            distances = GeoBoxEncoder.haversine_many((lat, lng), lats, lngs)
+            np.flatnonzero(np.where(circle, distances <= radius,
+                                    (lats <= lat) & (lat <= lats + size) & (lngs <= lng) & (lng <= lngs + size)))
+
+    baseline = timed(brute_force, 1) / 200
+    start = default_timer()
+    events = list(engine.process(batches))
+    report("replay, batches of %d" % vehicles, baseline, (default_timer() - start) * 1e6 / (vehicles * steps))
+    kinds = dict((kind, sum(e.kind == kind for e in events)) for kind in ('enter', 'exit', 'dwell'))
+    print("  {0:36} {1} skipped, {2} evaluated, events {3}".format(
+        "updates", engine.skipped, engine.evaluated, kinds))
+
+
+def bench_storage():
+    try:
+        import numpy as np
+    except ImportError:
+        print("storage: skipped, numpy not installed")
+        return
+    import os
+    import shutil
+    import tempfile
+    from geobox import storage
+
+    print("index file: rebuilding a GeoIndex vs opening a memory mapped file")
+    rnd = np.random.RandomState(2013)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for size in INDEX_SIZES[:2]:
+            lats = rnd.uniform(-90, 90, size)
+            lngs = rnd.uniform(-180, 180, size)
+            path = os.path.join(tmpdir, 'index%d' % size)
+            storage.write_index(path, lats, lngs)
+
+            def rebuild():
+                GeoIndex(lats, lngs)
+
+            def open_file():
+                storage.GeoIndexFile(path).close()
+
+            report("startup n=%d" % size, timed(rebuild, 1), timed(open_file, 10))
+            with storage.GeoIndexFile(path) as index:
+                queries = [(rnd.uniform(-60, 60), rnd.uniform(-180, 180)) for _ in range(20)]
+
+                def query_file():
+                    for lat, lng in queries:
+                        index.within_radius(lat, lng, 50000)
+
+                memory = GeoIndex(lats, lngs)
+
+                def query_memory():
+                    for lat, lng in queries:
+                        memory.within_radius(lat, lng, 50000)
+
+                report("within_radius 50km n=%d" % size, timed(query_memory, 1) / len(queries),
+                       timed(query_file, 1) / len(queries))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bench_cache():
+    import geobox
+
+    print("skewed GeoPoint(geobox_id) + neighbors() traffic: no cache vs LRU cache (per request)")
+    rnd = random.Random(2013)
+    venues = [GeoBoxEncoder.encode(lat, lng) for lat, lng in random_points(5000)]
+    # Zipf like popularity: a few venues get most of the requests
+    requests = [venues[min(int(rnd.paretovariate(1.2)) - 1, len(venues) - 1)] for _ in range(20000)]
+
+    def serve():
+        for geobox_id in requests:
+            GeoPoint(geobox_id=geobox_id).neighbors()
+
+    baseline = timed(serve, 1) / len(requests)
+    cache = geobox.enable_cache(1000)
+    try:
+        current = timed(serve, 1) / len(requests)
+        stats = cache.stats()
+    finally:
+        geobox.disable_cache()
+    report("maxsize=1000", baseline, current)
+    print("  {0:36} hits={1[hits]} misses={1[misses]} evictions={1[evictions]}".format("", stats))
+
+
+def bench_geohash():
+    from geohash import Geohash, Geostring
+
+    print("geohash: bit by bit vs integer engine, re-encoding vs lookup tables, scalar vs batch (per point)")
+    points = [(lng, lat) for lat, lng in random_points(1000)]
+    hashes = [Geohash(point) for point in points]
+    bits = [Geostring.bitstring(point) for point in points]
+
+    def decode_bits():
+        for hash, plain in zip(hashes, bits):
+            hash._bits_bbox(plain)
+
+    def decode_int():
+        for hash in hashes:
+            hash.bbox()
+
+    report("Geohash.bbox", timed(decode_bits, 3) / len(points), timed(decode_int, 3) / len(points))
+
+    cells = [Geohash(str(hash)[:9]) for hash in hashes[:200]]
+
+    def neighbors_encode():
+        # Encode the center of each surrounding cell
+        for cell in cells:
+            x, y = cell.point()
+            minx, miny, maxx, maxy = cell.bbox()
+            for dx, dy in ((0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)):
+                Geohash((x + dx * (maxx - minx), y + dy * (maxy - miny)))
+
+    def neighbors_table():
+        for cell in cells:
+            cell.neighbors()
+
+    report("Geohash.neighbors", timed(neighbors_encode, 3) / len(cells), timed(neighbors_table, 3) / len(cells))
+
+    try:
+        import numpy as np
+    except ImportError:
+        print("  batch: skipped, numpy not installed")
+        return
+    xs = np.array([p[0] for p in points])
+    ys = np.array([p[1] for p in points])
+    codes = Geohash.bitstring_many(xs, ys, depth=30)
+
+    def encode_scalar():
+        for point in points:
+            Geohash.bitstring(point, depth=30)
+
+    report("Geohash.bitstring_many", timed(encode_scalar, 3) / len(points),
+           timed(lambda: Geohash.bitstring_many(xs, ys, depth=30), 10) / len(points))
+    report("Geohash.bbox_many", timed(decode_int, 3) / len(points),
+           timed(lambda: Geohash.bbox_many(codes), 10) / len(points))
+
+
+def bench_transcode():
+    from geobox import transcode
+    from geohash import Geohash
+
+    print("geobox_id -> geohash: decode and re-encode vs bit level transcoding (per id)")
+    points = random_points(2000)
+    ids = [GeoBoxEncoder.encode(lat, lng, 32) for lat, lng in points]
+
+    def float_round_trip():
+        for geobox_id in ids:
+            lat, lng = GeoBoxEncoder.decode(geobox_id)
+            str(Geohash((lng, lat)))[:12]
+
+    def transcoded():
+        for geobox_id in ids:
+            transcode.to_geohash(transcode.from_geobox(geobox_id))
+
+    report("scalar", timed(float_round_trip, 1) / len(ids), timed(transcoded, 3) / len(ids))
+
+    try:
+        import numpy as np
+    except ImportError:
+        print("  batch: skipped, numpy not installed")
+        return
+    array = np.array(ids, dtype='S32')
+
+    def float_round_trip_many():
+        lats, lngs = GeoBoxEncoder.decode_many(array)
+        Geohash.bitstring_many(lngs, lats, depth=30)
+
+    report("batch", timed(float_round_trip_many, 10) / len(ids),
+           timed(lambda: transcode.to_geohash_many(transcode.from_geobox_many(array)), 10) / len(ids))
+
+
+def bench_metrics():
+    import geobox
+
+    print("metrics: public calls before enable_metrics vs after disable_metrics, then on (per call)")
+    points = random_points(1000)
+    ids = [GeoBoxEncoder.encode(lat, lng) for lat, lng in points]
+    pairs = list(zip(points, points[1:]))
+    cases = [
+        ("encode", lambda: [GeoBoxEncoder.encode(lat, lng) for lat, lng in points]),
+        ("decode", lambda: [GeoBoxEncoder.decode(i) for i in ids]),
+        ("neighbors", lambda: [GeoBoxEncoder.neighbors(i) for i in ids]),
+        ("haversine", lambda: [GeoBoxEncoder.haversine(a, b) for a, b in pairs]),
+    ]
+    for name, public in cases:
+        baseline = timed(public, 5) / len(points)
+        geobox.enable_metrics()
+        try:
+            on = timed(public, 5) / len(points)
+        finally:
+            geobox.disable_metrics()
+        report(name + " metrics off", baseline, timed(public, 5) / len(points))
+        report(name + " metrics on", baseline, on)
+
+
+SECTIONS = OrderedDict([
+    ('encode', bench_encode),
+    ('batch', bench_batch),
+    ('distance', bench_distance),
+    ('geopoint', bench_geopoint),
+    ('neighbors', bench_neighbors),
+    ('geocode', bench_geocode),
+    ('ranges', bench_ranges),
+    ('index', bench_index),
+    ('points', bench_points),
+    ('serialize', bench_serialize),
+    ('join', bench_join),
+    ('pyramid', bench_pyramid),
+    ('polygon', bench_polygon),
+    ('geofence', bench_geofence),
+    ('storage', bench_storage),
+    ('cache', bench_cache),
+    ('geohash', bench_geohash),
+    ('transcode', bench_transcode),
+    ('metrics', bench_metrics),
+])
+
+
+# -----------------------------------------------------------------
+# Suite
+
+# Minimum time spent in each timing, in seconds
+SUITE_MIN_TIME = 0.1
+SUITE_PRECISIONS = (4, 12, 20, 32)
+SUITE_BATCH_SIZES = (1000, 100000)
+SUITE_VERSION = 1
+
+
+def suite_cases():
+    '''
+    Yield the (name, params, func, ops) of every suite benchmark, where one
+    call to func() runs ops operations
+    '''
+    from gbox import Geocode
+    from geohash import Geohash, Geostring
+
+    points = random_points(1000)
+    count = len(points)
+
+    for precision in SUITE_PRECISIONS:
+        ids = [GeoBoxEncoder.encode(lat, lng, precision) for lat, lng in points]
+        yield ('GeoBoxEncoder.encode', {'precision': precision},
+               lambda precision=precision: [GeoBoxEncoder.encode(lat, lng, precision) for lat, lng in points], count)
+        yield ('GeoBoxEncoder.decode', {'precision': precision},
+               lambda ids=ids: [GeoBoxEncoder.decode(i) for i in ids], count)
+        yield ('GeoBoxEncoder.neighbors', {'precision': precision},
+               lambda ids=ids: [GeoBoxEncoder.neighbors(i) for i in ids], count)
+        for build_box in (True, False):
+            yield ('GeoPoint', {'precision': precision, 'build_box': build_box},
+                   lambda precision=precision, build_box=build_box: [
+                       GeoPoint(lat, lng, precision=precision, build_box=build_box) for lat, lng in points], count)
+
+    pairs = list(zip(points, points[1:]))
+    yield ('GeoBoxEncoder.haversine', {}, lambda: [GeoBoxEncoder.haversine(a, b) for a, b in pairs], len(pairs))
+
+    for depth in (16, 32):
+        codes = [Geocode(lng, lat, depth).gcode() for lat, lng in points]
+        yield ('Geocode', {'depth': depth}, lambda depth=depth: [Geocode(lng, lat, depth) for lat, lng in points], count)
+        yield ('Geocode.from_code', {'depth': depth},
+               lambda codes=codes, depth=depth: [Geocode.from_code(c, depth) for c in codes], count)
+
+    for depth in (15, 32):
+        hashes = [Geohash((lng, lat), depth=depth) for lat, lng in points]
+        yield ('Geohash', {'depth': depth}, lambda depth=depth: [str(Geohash((lng, lat), depth=depth)) for lat, lng in points], count)
+        yield ('Geohash.bbox', {'depth': depth}, lambda hashes=hashes: [h.bbox() for h in hashes], count)
+        yield ('Geostring', {'depth': depth},
+               lambda depth=depth: [str(Geostring((lng, lat), depth=depth)) for lat, lng in points], count)
+
+    try:
+        import numpy as np
+    except ImportError:
+        return
+    for size in SUITE_BATCH_SIZES:
+        rnd = np.random.RandomState(2013)
+        lats = rnd.uniform(-90, 90, size)
+        lngs = rnd.uniform(-180, 180, size)
+        ids = GeoBoxEncoder.encode_many(lats, lngs, 12)
+        codes = Geocode.encode_many(lngs, lats)
+        hashes = Geohash.bitstring_many(lngs, lats, depth=30)
+        yield ('GeoBoxEncoder.encode_many', {'precision': 12, 'size': size},
+               lambda lats=lats, lngs=lngs: GeoBoxEncoder.encode_many(lats, lngs, 12), size)
+        yield ('GeoBoxEncoder.decode_many', {'precision': 12, 'size': size},
+               lambda ids=ids: GeoBoxEncoder.decode_many(ids), size)
+        yield ('GeoBoxEncoder.neighbors_many', {'precision': 12, 'size': size},
+               lambda ids=ids: GeoBoxEncoder.neighbors_many(ids), size)
+        yield ('GeoBoxEncoder.haversine_many', {'size': size},
+               lambda lats=lats, lngs=lngs: GeoBoxEncoder.haversine_many((10.0, 20.0), lats, lngs), size)
+        yield ('Geocode.encode_many', {'size': size}, lambda lats=lats, lngs=lngs: Geocode.encode_many(lngs, lats), size)
+        yield ('Geocode.decode_many', {'size': size}, lambda codes=codes: Geocode.decode_many(codes), size)
+        yield ('Geohash.bitstring_many', {'size': size},
+               lambda lats=lats, lngs=lngs: Geohash.bitstring_many(lngs, lats, depth=30), size)
+        yield ('Geohash.bbox_many', {'size': size}, lambda hashes=hashes: Geohash.bbox_many(hashes), size)
+
+
+def suite_key(name, params):
+    '''
+    Identity of a benchmark across runs, such as 'GeoPoint[build_box=True,precision=12]'
+    '''
+    if not params:
+        return name
+    return '%s[%s]' % (name, ','.join('%s=%s' % item for item in sorted(params.items())))
+
+
+def measure(func, ops, repeat=5):
+    '''
+    Best time in micro seconds per operation, calling func() enough times
+    to run for SUITE_MIN_TIME
+    '''
+    start = default_timer()
+    func()
+    elapsed = default_timer() - start
+    number = max(1, int(SUITE_MIN_TIME / max(elapsed, 1e-9)))
+    return timed(func, number, repeat) / ops
+
+
+def run_suite(only=None):
+    '''
+    Time the suite benchmarks whose name contains only, printing each result
+    as it comes, and return the results as a JSON serializable dict
+    '''
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    results = []
+    for name, params, func, ops in suite_cases():
+        key = suite_key(name, params)
+        if only and only not in key:
+            continue
+        us_per_op = measure(func, ops)
+        print("  {0:60} {1:12.3f} us/op".format(key, us_per_op))
+        sys.stdout.flush()
+        results.append({'key': key, 'name': name, 'params': params, 'ops': ops, 'us_per_op': us_per_op})
+    return {
+        'version': SUITE_VERSION,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'numpy': numpy_version,
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold):
+    '''
+    Print the ratio of each current timing to its baseline and return the
+    number of regressions: timings slower than the baseline by more than
+    threshold
+    '''
+    for field in ('python', 'implementation', 'machine', 'numpy'):
+        if current.get(field) != baseline.get(field):
+            print("warning: baseline %s is %s, now %s" % (field, baseline.get(field), current.get(field)),
+                  file=sys.stderr)
+    before = dict((r['key'], r['us_per_op']) for r in baseline['results'])
+    regressions = 0
+    print("  {0:60} {1:>12} {2:>12}".format('', 'baseline', 'current'))
+    for result in current['results']:
+        key = result['key']
+        if key not in before:
+            print("  {0:60} {1:>12} {2:9.3f} us   new".format(key, '-', result['us_per_op']))
+            continue
+        ratio = result['us_per_op'] / before[key]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressions += 1
+        elif ratio < 1 / (1 + threshold):
+            flag = 'faster'
+        print("  {0:60} {1:9.3f} us {2:9.3f} us   x{3:.2f} {4}".format(key, before[key], result['us_per_op'], ratio, flag))
+    print("%d regression(s) over %d%%" % (regressions, threshold * 100))
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Time the geobox encoders, see the module docstring")
+    parser.add_argument('sections', nargs='*', help="sections to run: %s" % ', '.join(SECTIONS))
+    parser.add_argument('--suite', action='store_true', help="run the suite instead of the sections")
+    parser.add_argument('--json', metavar='PATH', help="write the suite results to PATH")
+    parser.add_argument('--compare', metavar='BASELINE', help="compare the suite results to a saved --json file")
+    parser.add_argument('--threshold', type=float, default=0.25, help="slowdown reported as a regression")
+    parser.add_argument('--only', metavar='TEXT', help="only run the suite benchmarks whose name contains TEXT")
+    args = parser.parse_args(argv)
+    for name in args.sections:
+        if name not in SECTIONS:
+            parser.error("Unknown section '%s', expected one of: %s" % (name, ', '.join(SECTIONS)))
+    if args.json or args.compare or args.only:
+        args.suite = True
+    if args.suite and args.sections:
+        parser.error("Sections and the suite cannot run together")
+    return args
+
+
+def main(argv):
+    args = parse_args(argv[1:])
+    if args.suite:
+        baseline = None
+        if args.compare:
+            # Read first: a bad baseline should not wait for the whole suite
+            with open(args.compare) as fh:
+                baseline = json.load(fh)
+        current = run_suite(args.only)
+        if args.json:
+            with open(args.json, 'w') as fh:
+                json.dump(current, fh, indent=2, sort_keys=True)
+        if baseline is not None and compare(current, baseline, args.threshold):
+            return 1
+        return 0
+
+    print("  {0:36} {1:>13} {2:>13}".format('', 'baseline', 'current'))
+    for name in args.sections or list(SECTIONS):
+        SECTIONS[name]()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
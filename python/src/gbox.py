@@ -1,66 +1,120 @@
-import struct
+import heapq
+
+from geobox import GeoBoxEncoder
+from geobox.curve import (
+    deinterleave,
+    deinterleave_many,
+    hilbert_decode,
+    hilbert_decode_many,
+    hilbert_encode,
+    hilbert_encode_many,
+    interleave,
+    interleave_many,
+    np,
+    quantize,
+    quantize_many,
+    require_numpy,
+)
+
 
 class Geocode(object):
     LON_BOUND = (-180, 180)
     LAT_BOUND = (-90, 90)
     SIZE = (LON_BOUND[1]-LON_BOUND[0], LAT_BOUND[1]-LAT_BOUND[0])
+    # The code of a depth is depth * 2 bits, read back as a signed 64 bit integer
+    MAX_DEPTH = 32
+    # Bound of the boxes examined per range by the range decomposition
+    CELLS_PER_RANGE = 8
+    # Orders of the boxes: 'morton' interleaves the bits of lon and lat
+    # (Z-order), 'hilbert' walks the same boxes along a Hilbert curve whose
+    # consecutive codes are always neighbor boxes
+    CURVES = ('morton', 'hilbert')
 
-    def __init__(self, lon, lat, depth=32):
+    def __init__(self, lon, lat, depth=32, curve='morton'):
         self.depth = depth
+        self.curve = curve
         self._gpoint = (lon, lat)
         self._gbox = None
-        self._gcode, self._gbox_coord = self._calcGeocode(self._gpoint, self.depth)
+        self._gcode, self._gbox_coord = self._calcGeocode(self._gpoint, self.depth, curve)
 
-    def _findPosition(self, position, lbound, ubound):
+    @classmethod
+    def from_code(cls, code, depth=32, curve='morton'):
         '''
-        For given position, compare it to the mid point between lower bound (lbound) and
-        upper bound (ubound).  If after mid point, return 1 and set new lower bound as
-        mid point.  Otherwise return 0 and set upper bound as mid point.
+        Create the Geocode of a code returned by gcode().  The point of the
+        result is the center of the box, the only position the code knows about.
         '''
-        mid = (lbound + ubound) / 2.0
-        if position > mid:
-            bit = 1
-            lres = mid
-            ures = ubound
-        else:
-            bit = 0
-            lres = lbound
-            ures = mid
+        x_lbound, y_lbound, x_ubound, y_ubound = cls._codeBounds(code, depth, curve)
+        geocode = cls.__new__(cls)
+        geocode.depth = depth
+        geocode.curve = curve
+        geocode._gpoint = ((x_lbound + x_ubound) / 2.0, (y_lbound + y_ubound) / 2.0)
+        geocode._gbox = None
+        geocode._gcode = code
+        geocode._gbox_coord = (x_lbound, y_lbound, x_ubound, y_ubound)
+        return geocode
 
-        return bit, lres, ures
+    @classmethod
+    def _checkDepth(cls, depth):
+        if not 0 <= depth <= cls.MAX_DEPTH:
+            raise ValueError("depth must be between 0 and %d, got %s" % (cls.MAX_DEPTH, depth))
 
-    def _calcGeocode(self, loc, depth):
+    @classmethod
+    def _checkCurve(cls, curve):
+        if curve not in cls.CURVES:
+            raise ValueError("Unknown curve '%s', expected one of: %s" % (curve, ', '.join(cls.CURVES)))
+
+    @classmethod
+    def _calcGeocode(cls, loc, depth, curve='morton'):
         '''
-        Find the postion (both lon and lat) if above or below mid point of the bound,
-        per _findPosition function.  Repeat for number of depth provided, producing
-        an integer with the size of depth * 2.
+        Quantize lon and lat into the index of their cell once the bounds are
+        bisected depth times, then interleave both indices into an integer
+        with the size of depth * 2: lon on the odd bits, lat on the even bits.
+        The 'hilbert' curve numbers the cells along a Hilbert curve instead.
         '''
+        cls._checkDepth(depth)
         x, y = loc
-        x_lbound, x_ubound = self.LON_BOUND
-        y_lbound, y_ubound = self.LAT_BOUND
-
-        result = 0L
-        for l in xrange(depth):
-            x_bit, x_lbound, x_ubound = self._findPosition(x, x_lbound, x_ubound)
-            y_bit, y_lbound, y_ubound = self._findPosition(y, y_lbound, y_ubound)
-
-            # Reverse the index
-            i = depth - l - 1
-
-            # Calculate the interleave value
-            result_index = i * 2
-            
-            if x_bit:
-                result += 1 << (result_index+1)
-            
-            if y_bit:
-                result += 1 << result_index
-        
+        x_index = quantize(x, cls.LON_BOUND[0], cls.SIZE[0], depth)
+        y_index = quantize(y, cls.LAT_BOUND[0], cls.SIZE[1], depth)
+
+        result = cls._cellCode(x_index, y_index, depth, curve)
         # Convert unsigned 64bit long into a signed version
-        u64int = struct.pack("Q", result)
-        s64int = struct.unpack("q", u64int)[0]
+        if result >= 1 << 63:
+            result -= 1 << 64
+
+        return result, cls._cellBounds(x_index, y_index, depth)
 
-        return s64int, (x_lbound, y_lbound, x_ubound, y_ubound)
+    @classmethod
+    def _cellBounds(cls, x_index, y_index, depth):
+        # Cell edges are exact in floating point: the sizes are small
+        # integers divided by a power of 2
+        x_unit = cls.SIZE[0] / float(1 << depth)
+        y_unit = cls.SIZE[1] / float(1 << depth)
+        x_lbound = cls.LON_BOUND[0] + x_index * x_unit
+        y_lbound = cls.LAT_BOUND[0] + y_index * y_unit
+        return x_lbound, y_lbound, x_lbound + x_unit, y_lbound + y_unit
+
+    @classmethod
+    def _cellCode(cls, x_index, y_index, depth, curve):
+        if curve == 'hilbert':
+            return hilbert_encode(x_index, y_index, depth)
+        cls._checkCurve(curve)
+        return interleave(x_index, y_index)
+
+    @classmethod
+    def _cellIndices(cls, code, depth, curve):
+        '''
+        Inverse of _cellCode for an unsigned code
+        '''
+        if curve == 'hilbert':
+            return hilbert_decode(code, depth)
+        cls._checkCurve(curve)
+        return deinterleave(code)
+
+    @classmethod
+    def _codeBounds(cls, code, depth, curve='morton'):
+        cls._checkDepth(depth)
+        x_index, y_index = cls._cellIndices(code & ((1 << (2 * depth)) - 1), depth, curve)
+        return cls._cellBounds(x_index, y_index, depth)
 
     def gpoint(self):
         return self._gpoint
@@ -74,8 +128,204 @@ class Geocode(object):
             self._gbox = {
                 'NW': (x_lbound, y_ubound),
                 'NE': (x_ubound, y_ubound),
-                'SW': (x_lbound, y_ubound),
-                'SE': (x_lbound, y_lbound)
+                'SW': (x_lbound, y_lbound),
+                'SE': (x_ubound, y_lbound)
             }
 
         return self._gbox
+
+    # -----------------------------------------------------------------
+    # Range decomposition
+
+    @classmethod
+    def ranges_bbox(cls, lon_min, lat_min, lon_max, lat_max, max_ranges=16, depth=32, curve='morton'):
+        '''
+        Return the sorted list of inclusive (lo, hi) gcode() ranges whose union
+        holds the code of every point of the rectangle, in at most max_ranges
+        ranges: a rectangle query on a column of codes becomes a handful of
+        "BETWEEN lo AND hi" scans.  A rectangle crossing the 180 meridian has
+        lon_min greater than lon_max.  The codes are those of the given curve,
+        along which 'hilbert' needs fewer ranges for the same area.
+        '''
+        if lon_min <= lon_max:
+            lon_ranges = [(lon_min, lon_max)]
+        else:
+            lon_ranges = [(lon_min, cls.LON_BOUND[1]), (cls.LON_BOUND[0], lon_max)]
+
+        def intersects(x_lbound, y_lbound, x_ubound, y_ubound):
+            # A box holds the points above its lower bounds and up to its
+            # upper bounds, the first box of each axis also holds its lower bound
+            if lat_min > y_ubound or not (lat_max > y_lbound or (y_lbound == cls.LAT_BOUND[0] and lat_max >= y_lbound)):
+                return False
+            for west, east in lon_ranges:
+                if west <= x_ubound and (east > x_lbound or (x_lbound == cls.LON_BOUND[0] and east >= x_lbound)):
+                    return True
+            return False
+
+        def contains(x_lbound, y_lbound, x_ubound, y_ubound):
+            if y_lbound < lat_min or y_ubound > lat_max:
+                return False
+            return any(west <= x_lbound and x_ubound <= east for west, east in lon_ranges)
+
+        if lat_min > lat_max:
+            return []
+        return cls._ranges(intersects, contains, max_ranges, depth, curve)
+
+    @classmethod
+    def ranges_circle(cls, lon, lat, radius, max_ranges=16, depth=32, curve='morton'):
+        '''
+        Return the sorted list of inclusive (lo, hi) gcode() ranges covering the
+        circle of radius meter around lon/lat, see ranges_bbox
+        '''
+        latLng = (lat, lon)
+
+        def intersects(x_lbound, y_lbound, x_ubound, y_ubound):
+            return GeoBoxEncoder.box_distance(latLng, (y_lbound, x_lbound), (y_ubound, x_ubound)) <= radius
+
+        def contains(x_lbound, y_lbound, x_ubound, y_ubound):
+            corners = ((y_lbound, x_lbound), (y_lbound, x_ubound), (y_ubound, x_lbound), (y_ubound, x_ubound))
+            return all(GeoBoxEncoder.haversine(latLng, corner) <= radius for corner in corners)
+
+        return cls._ranges(intersects, contains, max_ranges, depth, curve)
+
+    @classmethod
+    def _ranges(cls, intersects, contains, max_ranges, depth, curve='morton'):
+        '''
+        Shared decomposition of ranges_bbox and ranges_circle.  Starting from
+        the whole world, the largest boxes crossing the region edge are split
+        into their intersecting quadrants as long as the merged ranges fit in
+        max_ranges.  A box is (level, code), code being the unsigned gcode()
+        of depth level of its points.  On both curves, the 4 quadrants of a
+        box have the 4 consecutive codes following code << 2.
+        '''
+        cls._checkDepth(depth)
+        cls._checkCurve(curve)
+        if max_ranges < 1:
+            raise ValueError("max_ranges must be at least 1, got %s" % max_ranges)
+        if not intersects(*cls._cellBounds(0, 0, 0)):
+            return []
+
+        # Codes next to each other in signed order: 1 << 63 starts the negative
+        # values, and -1 (the largest unsigned code) is followed by 0
+        top = (1 << (2 * depth)) - 1
+        signed = depth == cls.MAX_DEPTH
+
+        def previous(lo):
+            if signed and lo == 1 << 63:
+                return None
+            if lo == 0:
+                return top if signed else None
+            return lo - 1
+
+        def following(hi):
+            if signed and hi == (1 << 63) - 1:
+                return None
+            if hi == top:
+                return 0 if signed else None
+            return hi + 1
+
+        # Boxes by lowest code, highest codes of the boxes, merged range count
+        cells = {0: (0, 0)}
+        highest = set([top])
+        count = 1
+        heap = [(0, 0)]
+        while heap:
+            level, code = heapq.heappop(heap)
+            if level >= depth or contains(*cls._cellBounds(*cls._cellIndices(code, level, curve) + (level,))):
+                continue
+            shift = 2 * (depth - level - 1)
+            children = []
+            for child in range(code << 2, (code << 2) + 4):
+                if intersects(*cls._cellBounds(*cls._cellIndices(child, level + 1, curve) + (level + 1,))):
+                    children.append((level + 1, child))
+
+            lo, hi = code << (shift + 2), ((code + 1) << (shift + 2)) - 1
+            if level == 0:
+                split_count = len(cls._mergeRanges(children, depth))
+            else:
+                # The box was one run with the ranges touching it, count the
+                # runs of its quadrants and of those ranges once split
+                present = set(child & 3 for _, child in children)
+                flags = [previous(lo) in highest] + [q in present for q in range(4)] + [following(hi) in cells]
+                runs = sum(1 for i, flag in enumerate(flags) if flag and (i == 0 or not flags[i - 1]))
+                split_count = count - 1 + runs
+            # Splits not adding ranges still shrink the area scanned, but stop
+            # them once the boxes are much finer than the ranges
+            if split_count > max_ranges or len(cells) + len(children) > cls.CELLS_PER_RANGE * max_ranges:
+                continue
+
+            del cells[lo]
+            highest.discard(hi)
+            for child in children:
+                cells[child[1] << shift] = child
+                highest.add(((child[1] + 1) << shift) - 1)
+                heapq.heappush(heap, child)
+            count = split_count
+
+        return cls._mergeRanges(cells.values(), depth)
+
+    @classmethod
+    def _mergeRanges(cls, cells, depth):
+        '''
+        Sorted and merged signed code ranges of a set of (level, code) boxes
+        '''
+        spans = []
+        for level, code in cells:
+            shift = 2 * (depth - level)
+            lo, hi = code << shift, ((code + 1) << shift) - 1
+            # Codes from 1 << 63 on are read back as negative values: a range
+            # crossing it is split, the upper part moving before 0
+            if hi >= 1 << 63:
+                if lo < 1 << 63:
+                    spans.append((lo, (1 << 63) - 1))
+                    lo = 1 << 63
+                lo, hi = lo - (1 << 64), hi - (1 << 64)
+            spans.append((lo, hi))
+        spans.sort()
+
+        ranges = []
+        for lo, hi in spans:
+            if ranges and lo <= ranges[-1][1] + 1:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], hi))
+            else:
+                ranges.append((lo, hi))
+        return ranges
+
+    # -----------------------------------------------------------------
+    # NumPy batch mode
+
+    @classmethod
+    def encode_many(cls, lons, lats, depth=32, curve='morton'):
+        '''
+        Vectorized gcode() of arrays of lon and lat, returning int64 codes
+        '''
+        require_numpy()
+        cls._checkDepth(depth)
+        cls._checkCurve(curve)
+        x_index = quantize_many(lons, cls.LON_BOUND[0], cls.SIZE[0], depth)
+        y_index = quantize_many(lats, cls.LAT_BOUND[0], cls.SIZE[1], depth)
+        if curve == 'hilbert':
+            return hilbert_encode_many(x_index, y_index, depth).view(np.int64)
+        return interleave_many(x_index, y_index).view(np.int64)
+
+    @classmethod
+    def decode_many(cls, codes, depth=32, box=False, curve='morton'):
+        '''
+        Vectorized from_code of an array of codes.  Return the (lons, lats)
+        arrays of the box centers, followed by the (x_lbound, y_lbound) and
+        (x_ubound, y_ubound) arrays when box is True.
+        '''
+        require_numpy()
+        cls._checkDepth(depth)
+        cls._checkCurve(curve)
+        # int64 codes wrap around to their unsigned 64 bit value
+        codes = np.asarray(codes).astype(np.uint64) & np.uint64((1 << (2 * depth)) - 1)
+        if curve == 'hilbert':
+            x_index, y_index = hilbert_decode_many(codes, depth)
+        else:
+            x_index, y_index = deinterleave_many(codes)
+        x_lbound, y_lbound, x_ubound, y_ubound = cls._cellBounds(x_index, y_index, depth)
+        center = ((x_lbound + x_ubound) / 2, (y_lbound + y_ubound) / 2)
+        if box:
+            return center, (x_lbound, y_lbound), (x_ubound, y_ubound)
+        return center
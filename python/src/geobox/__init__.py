@@ -12,6 +12,7 @@ Inpired by GeoPrint
   should convert the ID from DNA to an Integer
 
 '''
+import heapq
 import json
 from collections import namedtuple
 from operator import neg, mod
@@ -27,15 +28,101 @@ from math import (
     sqrt,
 )
 
+from .cache import LRUCache
+from .metrics import Metrics
+from . import geometry
+from .curve import (
+    deinterleave,
+    deinterleave_many,
+    hilbert_decode,
+    hilbert_decode_many,
+    hilbert_encode,
+    hilbert_encode_many,
+    interleave,
+    interleave_many,
+    np,
+    quantize,
+    quantize_many,
+    require_numpy,
+)
+
 interval = namedtuple("interval", "min max")
 
 alphabet = 'gatc'
 decodemap = dict((k, i) for (i, k) in enumerate(alphabet))
 
+# The 'w'/'e' prefix is the top bit of the integer code
+hemispheres = {'w': 0, 'e': 1}
+
+# Lookup tables between 8 bits of integer code and 4 geobox characters.
+# Shorter keys in quadmap take care of an id not ending on a 4 char boundary.
+quads = [''.join(alphabet[(b >> s) & 3] for s in (6, 4, 2, 0)) for b in range(256)]
+quadmap = dict((quads[b][4 - size:], b) for size in (1, 2, 3, 4) for b in range(1 << (2 * size)))
+
+# Byte tables for the batch functions: alphabet index to character, and
+# character to alphabet index or hemisphere bit (0xFF for anything else)
+if np is not None:
+    _alphabet_bytes = np.frombuffer(alphabet.encode('ascii'), dtype=np.uint8)
+    _char_values = np.full(256, 0xFF, dtype=np.uint8)
+    _char_values[[ord(c) for c in alphabet]] = [decodemap[c] for c in alphabet]
+    _prefix_values = np.full(256, 0xFF, dtype=np.uint8)
+    _prefix_values[[ord(c) for c in hemispheres]] = [hemispheres[c] for c in hemispheres]
+    _numpy_trig = dict(sin=np.sin, cos=np.cos, asin=np.arcsin, sqrt=np.sqrt)
+
+
+def central_angle(lat1, lng1, lat2, lng2, sin=sin, cos=cos, asin=asin, sqrt=sqrt):
+    '''
+    Haversine kernel: central angle between two points given in radians.
+
+    The trigonometric functions default to the math module ones; the batch
+    functions run the same formula on arrays by passing the NumPy ufuncs.
+    '''
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return 2 * asin(sqrt(a))
+
+
+def _metered(name, method):
+    '''
+    Class method recording the calls of the plain function method under
+    name in the metrics of the class, see GeoBoxEncoder.enable_metrics
+    '''
+    def metered(cls, *args, **kwargs):
+        metrics = cls.metrics
+        if metrics is None:
+            return method(cls, *args, **kwargs)
+        return metrics.call(name, lambda: method(cls, *args, **kwargs))
+    metered.__name__, metered.__doc__ = method.__name__, method.__doc__
+    metered.plain = method
+    return classmethod(metered)
+
 
 class GeoBoxEncoder(object):
     EARTH_RADIUS = 6378100
     DEFAULT_PRECISION = 18
+    # Longest geobox_id whose integer code fits in 64 bits: 1 + 2 * 31 bits
+    MAX_PRECISION = 32
+    # Marks a missing neighbor in integer results, larger than any code
+    NO_CODE = 0xFFFFFFFFFFFFFFFF
+    # Optional LRUCache of decode and neighbors results, see enable_cache
+    cache = None
+    # Optional Metrics of the hot paths, see enable_metrics
+    metrics = None
+    # Methods timed by enable_metrics, and their operation names
+    METERED = (('encode', 'encode'), ('decode', 'decode'), ('neighbors', 'neighbors'), ('haversine', 'distance'))
+    # Orders of the integer codes: 'morton' is the Z-order of the geobox_id
+    # characters, 'hilbert' walks the same boxes along a Hilbert curve
+    CURVES = ('morton', 'hilbert')
+    # Bearing and (latitude, longitude) box offset of each neighbor
+    NEIGHBORS = (
+        ('N', 1, 0),
+        ('NE', 1, 1),
+        ('E', 0, 1),
+        ('SE', -1, 1),
+        ('S', -1, 0),
+        ('SW', -1, -1),
+        ('W', 0, -1),
+        ('NW', 1, -1),
+    )
 
     @classmethod
     def encode(cls, latitude, longitude, precision=None, box=False):
@@ -57,7 +144,414 @@ class GeoBoxEncoder(object):
         """
         if precision is None:
             precision = cls.DEFAULT_PRECISION
+        if precision > cls.MAX_PRECISION:
+            return cls._encode_bisect(latitude, longitude, precision, box)
+
+        code = cls.encode_int(latitude, longitude, precision)
+        result = cls.code_to_id(code, precision)
+        if box:
+            latLng_SW, latLng_NE = cls.code_bounds(code, precision)
+            return (result, latLng_SW, latLng_NE)
+        return result
+
+    @classmethod
+    def decode(cls, geobox_id, box=False):
+        """Decode a geobox_id, returning the latitude and longitude.  These
+        coordinates should approximate the input coordinates within a
+        degree of error returned by 'error()'
+
+        >>> c = (7.0625, -95.677068)
+        >>> h = encode(*c)
+        >>> c2 = decode(h)
+        >>> e = error(h)
+        >>> abs(c[0] - c2[0]) <= e
+        True
+        >>> abs(c[1] - c2[1]) <= e
+        True
+
+        If radians is True, results are in radians instead of degrees.
+
+        >>> c2 = decode(h, radians=True)
+        >>> e = error(h, radians=True)
+        >>> abs(rads(c[0]) - c2[0]) <= e
+        True
+        >>> abs(rads(c[1]) - c2[1]) <= e
+        True
+        """
+        if cls.cache is not None:
+            return cls.cache.get_or_compute(('decode', geobox_id, box), lambda: cls._decode(geobox_id, box))
+        return cls._decode(geobox_id, box)
+
+    @classmethod
+    def _decode(cls, geobox_id, box):
+        precision = len(geobox_id)
+        if precision > cls.MAX_PRECISION:
+            return cls._decode_bisect(geobox_id, box)
+
+        latLng_SW, latLng_NE = cls.code_bounds(cls.id_to_code(geobox_id), precision)
+        lat = (latLng_SW[0] + latLng_NE[0]) / 2
+        lon = (latLng_SW[1] + latLng_NE[1]) / 2
+
+        if box:
+            return ((lat, lon), latLng_SW, latLng_NE)
+        return lat, lon
+
+    @classmethod
+    def enable_cache(cls, maxsize=4096):
+        '''
+        Cache decode, neighbors and GeoPoint boxes of this encoder class, and
+        of its subclasses without a cache of their own
+        '''
+        cls.cache = LRUCache(maxsize)
+        return cls.cache
+
+    @classmethod
+    def disable_cache(cls):
+        cls.cache = None
+
+    @classmethod
+    def enable_metrics(cls, sink=None):
+        '''
+        Record the calls of this encoder class, and of its subclasses without
+        metrics of their own, see geobox.metrics.  The METERED methods are
+        replaced by timed versions, which disable_metrics takes back, so
+        that the calls cost nothing more while metrics are off.
+        '''
+        cls.metrics = Metrics(sink)
+        for method, name in cls.METERED:
+            plain = getattr(cls, method).__func__
+            setattr(cls, method, _metered(name, getattr(plain, 'plain', plain)))
+        return cls.metrics
+
+    @classmethod
+    def disable_metrics(cls):
+        cls.metrics = None
+        for method, _ in cls.METERED:
+            function = getattr(cls, method).__func__
+            if hasattr(function, 'plain'):
+                setattr(cls, method, classmethod(function.plain))
+
+    @classmethod
+    def encode_int(cls, latitude, longitude, precision=None, curve='morton'):
+        '''
+        Encode latitude and longitude into the integer form of a geobox_id.
+
+        The code holds the 'w'/'e' prefix as its top bit, followed by one pair
+        of bits per character with the same meaning as the alphabet index:
+        longitude on the high bit, latitude on the low bit.  With the
+        'hilbert' curve, the bits after the prefix are the Hilbert code of the
+        box instead, see to_curve.
+        '''
+        if precision is None:
+            precision = cls.DEFAULT_PRECISION
+        bits = max(precision - 1, 0)
+
+        if longitude < 0:
+            hemisphere = 0
+            lng_lower = -180.0
+        else:
+            hemisphere = 1
+            lng_lower = 0.0
+
+        lng_index = quantize(longitude, lng_lower, 180.0, bits)
+        lat_index = quantize(latitude, -90.0, 180.0, bits)
+        if curve == 'hilbert':
+            return (hemisphere << (2 * bits)) | hilbert_encode(lng_index, lat_index, bits)
+        cls._check_curve(curve)
+        return (hemisphere << (2 * bits)) | interleave(lng_index, lat_index)
+
+    @classmethod
+    def _check_curve(cls, curve):
+        if curve not in cls.CURVES:
+            raise ValueError("Unknown curve '%s', expected one of: %s" % (curve, ', '.join(cls.CURVES)))
+
+    @classmethod
+    def to_curve(cls, code, precision, curve='hilbert'):
+        '''
+        Convert the Z-order integer code of a box, as returned by encode_int,
+        into its code on the given curve.  The 'w'/'e' top bit is kept: each
+        hemisphere is a square grid of boxes walked by the curve.
+        '''
+        cls._check_curve(curve)
+        if curve == 'morton':
+            return code
+        bits = max(precision - 1, 0)
+        lng_index, lat_index = deinterleave(code & ((1 << (2 * bits)) - 1))
+        return ((code >> (2 * bits)) << (2 * bits)) | hilbert_encode(lng_index, lat_index, bits)
+
+    @classmethod
+    def from_curve(cls, code, precision, curve='hilbert'):
+        '''
+        Inverse of to_curve: return the Z-order code of a box
+        '''
+        cls._check_curve(curve)
+        if curve == 'morton':
+            return code
+        bits = max(precision - 1, 0)
+        lng_index, lat_index = hilbert_decode(code & ((1 << (2 * bits)) - 1), bits)
+        return ((code >> (2 * bits)) << (2 * bits)) | interleave(lng_index, lat_index)
+
+    @classmethod
+    def code_to_id(cls, code, precision):
+        '''
+        Convert an integer code of the given precision into a geobox_id
+        '''
+        bits = max(precision - 1, 0)
+        pad = -bits % 4
+        body = code << (2 * pad)
+        chars = [quads[(body >> shift) & 0xFF] for shift in range(2 * (bits + pad) - 8, -8, -8)]
+        prefix = 'e' if code >> (2 * bits) else 'w'
+        return prefix + ''.join(chars)[:bits]
+
+    @classmethod
+    def id_to_code(cls, geobox_id):
+        '''
+        Convert a geobox_id into its integer code.  The precision of the code
+        is the length of the geobox_id.
+        '''
+        try:
+            code = hemispheres[geobox_id[0]]
+        except (KeyError, IndexError):
+            raise ValueError("Invalid geobox_id '%s': must start with 'w' or 'e'" % geobox_id)
+
+        for i in range(1, len(geobox_id), 4):
+            chunk = geobox_id[i:i + 4]
+            code = (code << (2 * len(chunk))) | quadmap[chunk]
+        return code
+
+    @classmethod
+    def code_bounds(cls, code, precision, curve='morton'):
+        '''
+        Return the SW and NE (lat, lng) corners of the box of an integer code
+        '''
+        if curve != 'morton':
+            code = cls.from_curve(code, precision, curve)
+        bits = max(precision - 1, 0)
+        lng_index, lat_index = deinterleave(code & ((1 << (2 * bits)) - 1))
+        unit = 180.0 / (1 << bits)
+
+        lng_min = (0.0 if code >> (2 * bits) else -180.0) + lng_index * unit
+        lat_min = -90.0 + lat_index * unit
+        return (lat_min, lng_min), (lat_min + unit, lng_min + unit)
+
+    @classmethod
+    def cell_indices(cls, code, precision):
+        '''
+        Return the (longitude, latitude) indices of the box of code in the grid
+        of its precision.  The longitude index runs west to east over both
+        hemispheres, so it has one more bit than the latitude index.
+        '''
+        bits = max(precision - 1, 0)
+        lng_index, lat_index = deinterleave(code & ((1 << (2 * bits)) - 1))
+        return ((code >> (2 * bits)) << bits) | lng_index, lat_index
+
+    @classmethod
+    def cell_code(cls, lng_cell, lat_cell, precision):
+        '''
+        Inverse of cell_indices
+        '''
+        bits = max(precision - 1, 0)
+        return ((lng_cell >> bits) << (2 * bits)) | interleave(lng_cell & ((1 << bits) - 1), lat_cell)
+
+    @classmethod
+    def bounds_code(cls, latLng_SW, latLng_NE, precision):
+        '''
+        Return the code of the box with the given SW/NE bounds, or None when the
+        bounds are not those of a box of that precision.
+        '''
+        if precision > cls.MAX_PRECISION:
+            return None
+        bits = max(precision - 1, 0)
+        unit = 180.0 / (1 << bits)
+        if latLng_NE[0] - latLng_SW[0] != unit or latLng_NE[1] - latLng_SW[1] != unit:
+            return None
+        lng_cell = int(round((latLng_SW[1] + 180.0) / unit))
+        lat_cell = int(round((latLng_SW[0] + 90.0) / unit))
+        return cls.cell_code(lng_cell, lat_cell, precision)
+
+    @classmethod
+    def corner_codes(cls, code, precision):
+        '''
+        Return a dictionary with the codes that encode() gives for the SW, NE,
+        SE and NW corners of the box of code, derived from its cell indices.
+
+        A corner sits on the edges of the box, and the '<=' rule sends a value
+        on an edge to the box below it.  The only exceptions are the -180 and
+        +180 edges (nothing below/above), the south pole, and the 0 meridian
+        which is always part of the 'e' hemisphere.
+        '''
+        lng_cell, lat_cell = cls.cell_indices(code, precision)
+        half = 1 << max(precision - 1, 0)
+
+        south = max(lat_cell - 1, 0)
+        north = lat_cell
+        west = lng_cell if lng_cell in (0, half) else lng_cell - 1
+        east = lng_cell + 1 if lng_cell == half - 1 else lng_cell
+
+        return {
+            'SW': cls.cell_code(west, south, precision),
+            'NE': cls.cell_code(east, north, precision),
+            'SE': cls.cell_code(east, south, precision),
+            'NW': cls.cell_code(west, north, precision),
+        }
+
+    @classmethod
+    def encode_many(cls, latitudes, longitudes, precision=None, codes=False, curve='morton'):
+        '''
+        Vectorized encode of NumPy arrays of latitudes and longitudes.
+
+        Return a fixed width 'S<precision>' array of geobox_ids, or the uint64
+        integer codes on the given curve when codes is True.  Results are
+        identical to calling encode, or encode_int, for each point.
+        '''
+        require_numpy()
+        if precision is None:
+            precision = cls.DEFAULT_PRECISION
+        if precision > cls.MAX_PRECISION:
+            raise ValueError("Batch encoding supports a precision up to %d" % cls.MAX_PRECISION)
+        bits = max(precision - 1, 0)
+
+        latitudes, longitudes = np.broadcast_arrays(
+            np.asarray(latitudes, dtype=np.float64),
+            np.asarray(longitudes, dtype=np.float64))
+        # Same test as encode: only a negative longitude is west, NaN is east
+        with np.errstate(invalid='ignore'):
+            east = ~(longitudes < 0)
 
+        lng_index = quantize_many(longitudes, np.where(east, 0.0, -180.0), 180.0, bits)
+        lat_index = quantize_many(latitudes, -90.0, 180.0, bits)
+        if curve == 'hilbert':
+            if not codes:
+                raise ValueError("geobox_ids follow the 'morton' curve, use codes=True for '%s' codes" % curve)
+            return (east.astype(np.uint64) << np.uint64(2 * bits)) | hilbert_encode_many(lng_index, lat_index, bits)
+        cls._check_curve(curve)
+        result = (east.astype(np.uint64) << np.uint64(2 * bits)) | interleave_many(lng_index, lat_index)
+        if codes:
+            return result
+        return cls.codes_to_ids(result, precision)
+
+    @classmethod
+    def decode_many(cls, geobox_ids, precision=None, box=False, curve='morton'):
+        '''
+        Vectorized decode of an array of geobox_ids, or of integer codes on
+        the given curve in which case precision must be given.  Return the
+        (latitudes, longitudes) arrays, followed by the SW and NE corners when
+        box is True.
+        '''
+        require_numpy()
+        geobox_ids = np.asarray(geobox_ids)
+        if geobox_ids.dtype.kind in 'iu':
+            if precision is None:
+                raise ValueError("precision is required to decode integer codes")
+            codes = cls.from_curve_many(geobox_ids.astype(np.uint64), precision, curve)
+        else:
+            if geobox_ids.dtype.kind == 'U':
+                geobox_ids = geobox_ids.astype('S')
+            codes = cls.ids_to_codes(geobox_ids)
+            precision = geobox_ids.dtype.itemsize
+
+        latLng_SW, latLng_NE = cls.codes_bounds(codes, precision)
+        lat = (latLng_SW[0] + latLng_NE[0]) / 2
+        lng = (latLng_SW[1] + latLng_NE[1]) / 2
+
+        if box:
+            return ((lat, lng), latLng_SW, latLng_NE)
+        return lat, lng
+
+    @classmethod
+    def codes_to_ids(cls, codes, precision):
+        '''
+        Vectorized code_to_id, returning a fixed width 'S<precision>' array
+        '''
+        require_numpy()
+        codes = np.asarray(codes).astype(np.uint64)
+        bits = max(precision - 1, 0)
+
+        chars = np.empty(codes.shape + (bits + 1,), dtype=np.uint8)
+        chars[..., 0] = np.where(codes >> np.uint64(2 * bits), ord('e'), ord('w'))
+        for i in range(bits):
+            pair = (codes >> np.uint64(2 * (bits - 1 - i))) & np.uint64(3)
+            chars[..., i + 1] = _alphabet_bytes[pair.astype(np.intp)]
+        return chars.view('S%d' % (bits + 1)).reshape(codes.shape)
+
+    @classmethod
+    def ids_to_codes(cls, geobox_ids):
+        '''
+        Vectorized id_to_code.  All the geobox_ids must share the same length.
+        '''
+        require_numpy()
+        geobox_ids = np.asarray(geobox_ids)
+        if geobox_ids.dtype.kind == 'U':
+            geobox_ids = geobox_ids.astype('S')
+        if geobox_ids.dtype.kind != 'S':
+            raise ValueError("Expected an array of geobox_ids, got dtype %s" % geobox_ids.dtype)
+        precision = geobox_ids.dtype.itemsize
+
+        chars = np.ascontiguousarray(geobox_ids).view(np.uint8).reshape(geobox_ids.shape + (precision,))
+        if (chars[..., -1] == 0).any():
+            # Shorter ids are null padded by NumPy
+            raise ValueError("All the geobox_ids of an array must have the same precision")
+        prefix = _prefix_values[chars[..., 0]]
+        values = _char_values[chars[..., 1:]]
+        if (prefix == 0xFF).any() or (values == 0xFF).any():
+            raise ValueError("Invalid geobox_id in array: expect a 'w'/'e' prefix followed by '%s'" % alphabet)
+
+        codes = prefix.astype(np.uint64)
+        for i in range(precision - 1):
+            codes = (codes << np.uint64(2)) | values[..., i]
+        return codes
+
+    @classmethod
+    def to_curve_many(cls, codes, precision, curve='hilbert'):
+        '''
+        Vectorized to_curve
+        '''
+        require_numpy()
+        cls._check_curve(curve)
+        codes = np.asarray(codes).astype(np.uint64)
+        if curve == 'morton':
+            return codes
+        bits = max(precision - 1, 0)
+        lng_index, lat_index = deinterleave_many(codes & np.uint64((1 << (2 * bits)) - 1))
+        hemisphere = (codes >> np.uint64(2 * bits)) << np.uint64(2 * bits)
+        return hemisphere | hilbert_encode_many(lng_index, lat_index, bits)
+
+    @classmethod
+    def from_curve_many(cls, codes, precision, curve='hilbert'):
+        '''
+        Vectorized from_curve
+        '''
+        require_numpy()
+        cls._check_curve(curve)
+        codes = np.asarray(codes).astype(np.uint64)
+        if curve == 'morton':
+            return codes
+        bits = max(precision - 1, 0)
+        lng_index, lat_index = hilbert_decode_many(codes & np.uint64((1 << (2 * bits)) - 1), bits)
+        hemisphere = (codes >> np.uint64(2 * bits)) << np.uint64(2 * bits)
+        return hemisphere | interleave_many(lng_index, lat_index)
+
+    @classmethod
+    def codes_bounds(cls, codes, precision, curve='morton'):
+        '''
+        Vectorized code_bounds, returning ((lat_min, lng_min), (lat_max, lng_max)) arrays
+        '''
+        require_numpy()
+        codes = cls.from_curve_many(codes, precision, curve)
+        bits = max(precision - 1, 0)
+        lng_index, lat_index = deinterleave_many(codes & np.uint64((1 << (2 * bits)) - 1))
+        unit = 180.0 / (1 << bits)
+
+        lng_min = np.where(codes >> np.uint64(2 * bits), 0.0, -180.0) + lng_index * unit
+        lat_min = -90.0 + lat_index * unit
+        return (lat_min, lng_min), (lat_min + unit, lng_min + unit)
+
+    @classmethod
+    def _encode_bisect(cls, latitude, longitude, precision, box=False):
+        '''
+        Float bisection used for precisions beyond MAX_PRECISION, where the
+        integer code no longer fits in 64 bits.
+        '''
         if longitude < 0:
             geobox_id = ['w']
             loni = interval(-180.0, 0.0)
@@ -90,29 +584,10 @@ class GeoBoxEncoder(object):
         return result
 
     @classmethod
-    def decode(cls, geobox_id, box=False):
-        """Decode a geobox_id, returning the latitude and longitude.  These
-        coordinates should approximate the input coordinates within a
-        degree of error returned by 'error()'
-
-        >>> c = (7.0625, -95.677068)
-        >>> h = encode(*c)
-        >>> c2 = decode(h)
-        >>> e = error(h)
-        >>> abs(c[0] - c2[0]) <= e
-        True
-        >>> abs(c[1] - c2[1]) <= e
-        True
-
-        If radians is True, results are in radians instead of degrees.
-
-        >>> c2 = decode(h, radians=True)
-        >>> e = error(h, radians=True)
-        >>> abs(rads(c[0]) - c2[0]) <= e
-        True
-        >>> abs(rads(c[1]) - c2[1]) <= e
-        True
-        """
+    def _decode_bisect(cls, geobox_id, box=False):
+        '''
+        Float bisection counterpart of _encode_bisect
+        '''
         lati = interval(-90.0, 90.0)
         first = geobox_id[0]
         if first == 'w':
@@ -140,29 +615,113 @@ class GeoBoxEncoder(object):
         return lat, lon
 
     @classmethod
-    def neighbors(cls, geobox_id, bearing=True, box=False):
+    def _neighbors_bisect(cls, geobox_id, bearing=True, box=False):
         '''
-        Return the surrounding
+        Neighbors for precisions beyond MAX_PRECISION, encoding the center of
+        each surrounding box
         '''
         results = set()
         precision = len(geobox_id)
         spacing = 180 / (2.0 ** (precision - 1))
         ctr = cls.decode(geobox_id)
-        dirs = ['N', 'S', 'E', 'NE', 'SE', 'W', 'NW', 'SW']
-        i = 0
-        for direction_lat in (0, 1, -1):
-            for direction_long in (0, 1, -1):
-                if direction_lat == 0 and direction_long == 0:
-                    continue
-                lat = ctr[0] + (direction_lat * spacing)
-                lon = ctr[1] + (direction_long * spacing)
-                h = cls.encode(lat, lon, precision=precision, box=box)
-                if bearing:
-                    h = (dirs[i], h)
-                results.add(h)
-                i += 1
+        for direction, direction_lat, direction_long in cls.NEIGHBORS:
+            lat = ctr[0] + (direction_lat * spacing)
+            if not -90 < lat < 90:
+                continue
+            lon = (ctr[1] + (direction_long * spacing) + 180) % 360 - 180
+            h = cls.encode(lat, lon, precision=precision, box=box)
+            if bearing:
+                h = (direction, h)
+            results.add(h)
         return results
 
+    @classmethod
+    def neighbors(cls, geobox_id, bearing=True, box=False):
+        '''
+        Return the surrounding boxes as a set of geobox_id, or of (bearing, geobox_id)
+        when bearing is True.  With box, each geobox_id is replaced by the
+        (geobox_id, latLng_SW, latLng_NE) tuple returned by encode.
+
+        Neighbors are found by moving one box in the longitude/latitude grid of
+        the geobox_id: the E/W neighbors wrap around the 180 meridian and there
+        are no N (S) neighbors for a box touching the north (south) pole.
+        '''
+        if cls.cache is not None:
+            # Copy, the caller may change the set
+            return set(cls.cache.get_or_compute(
+                ('neighbors', geobox_id, bearing, box), lambda: cls._neighbors(geobox_id, bearing, box)))
+        return cls._neighbors(geobox_id, bearing, box)
+
+    @classmethod
+    def _neighbors(cls, geobox_id, bearing, box):
+        precision = len(geobox_id)
+        if precision > cls.MAX_PRECISION:
+            return cls._neighbors_bisect(geobox_id, bearing, box)
+
+        results = set()
+        lng_cell, lat_cell = cls.cell_indices(cls.id_to_code(geobox_id), precision)
+        lng_cells, lat_cells = cls.grid_size(precision)
+        for direction, direction_lat, direction_long in cls.NEIGHBORS:
+            lat = lat_cell + direction_lat
+            if not 0 <= lat < lat_cells:
+                continue
+            code = cls.cell_code((lng_cell + direction_long) % lng_cells, lat, precision)
+            h = cls.code_to_id(code, precision)
+            if box:
+                h = (h,) + cls.code_bounds(code, precision)
+            if bearing:
+                h = (direction, h)
+            results.add(h)
+        return results
+
+    @classmethod
+    def neighbors_many(cls, geobox_ids, precision=None, codes=False):
+        '''
+        Vectorized neighbors of an array of geobox_ids, or of integer codes in
+        which case precision must be given.
+
+        Return an array with one more dimension of size 8, holding the
+        neighbors in the order of NEIGHBORS.  Neighbors beyond a pole are
+        empty strings, or NO_CODE when codes is True.
+        '''
+        require_numpy()
+        geobox_ids = np.asarray(geobox_ids)
+        if geobox_ids.dtype.kind in 'iu':
+            if precision is None:
+                raise ValueError("precision is required for integer codes")
+            source = geobox_ids.astype(np.uint64)
+        else:
+            if geobox_ids.dtype.kind == 'U':
+                geobox_ids = geobox_ids.astype('S')
+            source = cls.ids_to_codes(geobox_ids)
+            precision = geobox_ids.dtype.itemsize
+
+        bits = max(precision - 1, 0)
+        lng_cells, lat_cells = cls.grid_size(precision)
+        lng_index, lat_index = deinterleave_many(source & np.uint64((1 << (2 * bits)) - 1))
+        lng_cell = (((source >> np.uint64(2 * bits)) << np.uint64(bits)) | lng_index).astype(np.int64)
+        lat_cell = lat_index.astype(np.int64)
+
+        offsets = np.array([(lat, lng) for _, lat, lng in cls.NEIGHBORS], dtype=np.int64)
+        lat = lat_cell[..., np.newaxis] + offsets[:, 0]
+        lng = (lng_cell[..., np.newaxis] + offsets[:, 1]) % lng_cells
+        valid = (lat >= 0) & (lat < lat_cells)
+        lat = np.clip(lat, 0, lat_cells - 1).astype(np.uint64)
+        lng = lng.astype(np.uint64)
+
+        result = ((lng >> np.uint64(bits)) << np.uint64(2 * bits)) | interleave_many(lng & np.uint64((1 << bits) - 1), lat)
+        if codes:
+            return np.where(valid, result, np.uint64(cls.NO_CODE))
+        return np.where(valid, cls.codes_to_ids(result, precision), b'')
+
+    @classmethod
+    def grid_size(cls, precision):
+        '''
+        Number of boxes of the given precision along the longitude and latitude
+        '''
+        bits = max(precision - 1, 0)
+        return 2 << bits, 1 << bits
+
     @classmethod
     def haversine(cls, latLngA, latLngB):
         """
@@ -171,27 +730,383 @@ class GeoBoxEncoder(object):
         """
         lat1, lon1 = latLngA
         lat2, lon2 = latLngB
-
-        # convert decimal degrees to radians
-        lon1, lat1, lon2, lat2 = map(rads, [lon1, lat1, lon2, lat2])
-        # haversine formula
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a))
         # Return distance in meter
-        return cls.EARTH_RADIUS * c
+        return cls.EARTH_RADIUS * central_angle(rads(lat1), rads(lon1), rads(lat2), rads(lon2))
+
+    @classmethod
+    def haversine_many(cls, latLng, latitudes, longitudes):
+        '''
+        Distance in meter from latLng to every point of the latitudes and
+        longitudes arrays
+        '''
+        require_numpy()
+        lat, lng = latLng
+        return cls.EARTH_RADIUS * central_angle(
+            rads(lat), rads(lng), np.radians(latitudes), np.radians(longitudes), **_numpy_trig)
+
+    @classmethod
+    def iter_haversine_matrix(cls, latitudesA, longitudesA, latitudesB, longitudesB, chunk_size=1 << 20):
+        '''
+        Yield (row, block) pairs covering the distance matrix between the points
+        A and B, where block holds the distances from the points A starting at
+        row to every point B.  Each block has at most chunk_size entries.
+        '''
+        require_numpy()
+        latA, lngA = np.radians(latitudesA), np.radians(longitudesA)
+        latB, lngB = np.radians(latitudesB)[np.newaxis, :], np.radians(longitudesB)[np.newaxis, :]
+        rows = max(chunk_size // max(latB.size, 1), 1)
+        for start in range(0, latA.size, rows):
+            stop = start + rows
+            block = central_angle(latA[start:stop, np.newaxis], lngA[start:stop, np.newaxis], latB, lngB, **_numpy_trig)
+            block *= cls.EARTH_RADIUS
+            yield start, block
+
+    @classmethod
+    def haversine_matrix(cls, latitudesA, longitudesA, latitudesB, longitudesB, chunk_size=1 << 20):
+        '''
+        Distance in meter between every point A (rows) and every point B
+        (columns), computed chunk_size entries at a time
+        '''
+        require_numpy()
+        result = np.empty((np.size(latitudesA), np.size(latitudesB)))
+        for start, block in cls.iter_haversine_matrix(latitudesA, longitudesA, latitudesB, longitudesB, chunk_size):
+            result[start:start + len(block)] = block
+        return result
+
+    @classmethod
+    def equirectangular_many(cls, latLng, latitudes, longitudes):
+        '''
+        Cheap approximation of haversine_many, good for ranking points that are
+        close to each other.  The error grows with the distance and near the poles.
+        '''
+        require_numpy()
+        lat, lng = latLng
+        latitudes = np.radians(latitudes)
+        dlng = np.radians((np.asarray(longitudes) - lng + 180.0) % 360.0 - 180.0)
+        x = dlng * np.cos((latitudes + rads(lat)) / 2)
+        y = latitudes - rads(lat)
+        return cls.EARTH_RADIUS * np.sqrt(x * x + y * y)
+
+    @classmethod
+    def within_distance(cls, latLng, latitudes, longitudes, distance, prefilter=True):
+        '''
+        Return (indices, distances) of the points within distance meter of latLng.
+
+        With prefilter, points outside of the bounding rectangle of the circle
+        in the equirectangular projection are discarded first, using only
+        comparisons, and haversine runs on the remaining candidates.
+        '''
+        require_numpy()
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if prefilter:
+            candidates = np.flatnonzero(cls._circle_rectangle_mask(latLng, latitudes, longitudes, distance))
+            latitudes = latitudes[candidates]
+            longitudes = longitudes[candidates]
+        else:
+            candidates = np.arange(latitudes.size)
+
+        distances = cls.haversine_many(latLng, latitudes, longitudes)
+        keep = distances <= distance
+        return candidates[keep], distances[keep]
+
+    @classmethod
+    def _circle_rectangle_mask(cls, latLng, latitudes, longitudes, distance):
+        '''
+        Mask of the points inside the lat/lng rectangle that bounds the circle
+        of given radius around latLng.  See "Finding Points Within a Distance
+        of a Latitude/Longitude Using Bounding Coordinates" by J. Matuschek.
+        '''
+        lat, lng = latLng
+        # Widen by a hair so rounding never drops a point sitting on the circle
+        angle = float(distance) / cls.EARTH_RADIUS * (1 + 1e-9)
+        lat_delta = degrees(angle)
+        mask = np.abs(latitudes - lat) <= lat_delta
+        if abs(lat) + lat_delta < 90.0:
+            # Otherwise the circle contains a pole and spans every longitude
+            lng_delta = degrees(asin(min(sin(angle) / cos(rads(lat)), 1.0)))
+            mask &= np.abs((longitudes - lng + 180.0) % 360.0 - 180.0) <= lng_delta
+        return mask
+
+    @classmethod
+    def box_distance(cls, latLng, latLng_SW, latLng_NE):
+        '''
+        Great circle distance in meter from latLng to the nearest point of the
+        box with the given SW and NE corners, 0 when latLng is in the box
+        '''
+        lat, lng = latLng
+        lat_min, lng_min = latLng_SW
+        lat_max, lng_max = latLng_NE
+
+        # Longitude east of the west edge, in [0, 360)
+        offset = (lng - lng_min) % 360.0
+        width = lng_max - lng_min
+        if offset <= width:
+            return cls.EARTH_RADIUS * rads(max(lat_min - lat, lat - lat_max, 0.0))
+
+        if offset - width <= 360.0 - offset:
+            edge, delta = lng_max, offset - width
+        else:
+            edge, delta = lng_min, 360.0 - offset
+        # Nearest point of the edge meridian, clamped to the box latitudes
+        nearest = degrees(atan2(sin(rads(lat)), cos(rads(lat)) * cos(rads(delta))))
+        return cls.haversine(latLng, (min(max(nearest, lat_min), lat_max), edge))
+
+    @classmethod
+    def cover_circle(cls, latitude, longitude, radius, max_cells=16, max_precision=None):
+        '''
+        Return the sorted list of geobox_id prefixes whose boxes cover the circle
+        of radius meter around latitude/longitude.
+
+        The search starts with the box containing the center, at the finest
+        precision whose boxes are larger than the radius, and its neighbors.
+        Boxes crossing the circle are then split while the result stays within
+        max_cells, so the prefixes can mix precisions.  Every point of the
+        circle has a geobox_id starting with one of the prefixes, so a radius
+        search becomes one range scan per prefix on a sorted index.
+
+        No box spans both the 'w' and the 'e' hemisphere, so a circle across
+        the 0 or 180 meridian takes at least one prefix per hemisphere: the
+        result can then hold 2 prefixes even with max_cells=1.
+        '''
+        latLng = (latitude, longitude)
+        angle = float(radius) / cls.EARTH_RADIUS
+        lat_delta = degrees(angle)
+        if abs(latitude) + lat_delta < 90.0:
+            lng_delta = degrees(asin(min(sin(angle) / cos(rads(latitude)), 1.0)))
+        else:
+            lng_delta = 180.0
+
+        def intersects(latLng_SW, latLng_NE):
+            return cls.box_distance(latLng, latLng_SW, latLng_NE) <= radius
+
+        def contains(latLng_SW, latLng_NE):
+            corners = (latLng_SW, latLng_NE, (latLng_SW[0], latLng_NE[1]), (latLng_NE[0], latLng_SW[1]))
+            return all(cls.haversine(latLng, corner) <= radius for corner in corners)
+
+        return cls._cover(latLng, lat_delta, lng_delta, intersects, contains, max_cells, max_precision)
+
+    @classmethod
+    def cover_bbox(cls, latLng_SW, latLng_NE, max_cells=16, max_precision=None):
+        '''
+        Return the sorted list of geobox_id prefixes whose boxes cover the
+        rectangle from latLng_SW to latLng_NE, see cover_circle.  A rectangle
+        crossing the 180 meridian has a SW longitude greater than the NE one.
+        Like a circle, a rectangle touching both hemispheres takes at least
+        one prefix in each, even with max_cells=1.
+        '''
+        lat_min, lng_min = latLng_SW
+        lat_max, lng_max = latLng_NE
+        width = (lng_max - lng_min) % 360.0 or (360.0 if lng_max != lng_min else 0.0)
+        center = ((lat_min + lat_max) / 2, (lng_min + width / 2 + 180.0) % 360.0 - 180.0)
+
+        def lng_ranges(west, east):
+            if west <= east:
+                return [(west, east)]
+            return [(west, 180.0), (-180.0, east)]
+
+        def intersects(box_SW, box_NE):
+            # A box holds the points above its SW edges and up to its NE
+            # edges, except on the -90, -180 and 0 edges, see encode
+            south, west_edge = box_SW
+            north, east_edge = box_NE
+            if not (lat_max > south or south == -90.0) or lat_min > north:
+                return False
+            for west, east in lng_ranges(lng_min, lng_max):
+                if not (east > west_edge or (west_edge in (-180.0, 0.0) and east == west_edge)):
+                    continue
+                if west < east_edge or (west == east_edge and not (east_edge == 0.0 and west_edge < 0.0)):
+                    return True
+            return False
+
+        def contains(box_SW, box_NE):
+            if box_SW[0] < lat_min or box_NE[0] > lat_max:
+                return False
+            return any(west <= box_SW[1] and box_NE[1] <= east for west, east in lng_ranges(lng_min, lng_max))
+
+        return cls._cover(center, (lat_max - lat_min) / 2, width / 2, intersects, contains, max_cells, max_precision)
+
+    @classmethod
+    def cover_polygon(cls, polygon, max_precision=None, max_cells=256, holes=()):
+        '''
+        Return (interior, boundary), the sorted lists of geobox_id prefixes
+        whose boxes cover a polygon given as (latitude, longitude) vertices,
+        with optional holes, see geobox.geometry.
+
+        Interior boxes are within the polygon.  Boundary boxes are crossed by
+        its edges and are split, coarsest first, while the two lists stay
+        within max_cells and max_precision.
+        '''
+        interior, boundary = cls._cover_polygon(geometry.polygon_edges(polygon, holes), max_precision, max_cells)
+        return sorted(interior), sorted(boundary)
+
+    @classmethod
+    def _cover_polygon(cls, edges, max_precision, max_cells):
+        '''
+        Return the set of interior prefixes and a dict of the boundary ones
+        to (edges crossing the box, whether the box center is inside).
+
+        Only the first boxes are tested against every edge: the edges of a
+        child box are among those of its parent, and whether its center is
+        inside follows from the edges crossed on the way from the parent center.
+        '''
+        if max_precision is None:
+            max_precision = cls.MAX_PRECISION
+        lats = [e[0] for e in edges]
+        lngs = [e[1] for e in edges]
+        start = cls.cover_bbox((min(lats), min(lngs)), (max(lats), max(lngs)), min(16, max_cells), max_precision)
+
+        interior, boundary = set(), {}
+        for cell in start:
+            latLng_SW, latLng_NE = cls.decode(cell, box=True)[1:]
+            center = ((latLng_SW[0] + latLng_NE[0]) / 2, (latLng_SW[1] + latLng_NE[1]) / 2)
+            crossing = [e for e in edges if geometry.edge_in_box(e, latLng_SW, latLng_NE)]
+            inside = geometry.contains(edges, *center)
+            if crossing:
+                boundary[cell] = (crossing, inside)
+            elif inside:
+                interior.add(cell)
+
+        # Split the largest boundary boxes while the budget allows
+        heap = [(len(c), c) for c in boundary]
+        heapq.heapify(heap)
+        while heap:
+            _, cell = heapq.heappop(heap)
+            if len(cell) >= max_precision:
+                continue
+            crossing, inside = boundary[cell]
+            latLng_SW, latLng_NE = cls.decode(cell, box=True)[1:]
+            center = ((latLng_SW[0] + latLng_NE[0]) / 2, (latLng_SW[1] + latLng_NE[1]) / 2)
+            children = []
+            for c in alphabet:
+                child = cell + c
+                child_SW, child_NE = cls.decode(child, box=True)[1:]
+                child_center = ((child_SW[0] + child_NE[0]) / 2, (child_SW[1] + child_NE[1]) / 2)
+                child_inside = inside != (geometry.crossings(crossing, center, child_center) % 2 == 1)
+                child_crossing = [e for e in crossing if geometry.edge_in_box(e, child_SW, child_NE)]
+                if child_crossing or child_inside:
+                    children.append((child, child_crossing, child_inside))
+            if len(interior) + len(boundary) - 1 + len(children) > max_cells:
+                continue
+            del boundary[cell]
+            for child, child_crossing, child_inside in children:
+                if child_crossing:
+                    boundary[child] = (child_crossing, child_inside)
+                    heapq.heappush(heap, (len(child), child))
+                else:
+                    interior.add(child)
+
+        return cls._merge_cells(interior), boundary
+
+    @classmethod
+    def cover_precision(cls, lat_delta, lng_delta):
+        '''
+        Finest precision whose boxes are at least lat_delta by lng_delta degrees:
+        an area that far from a point is within the 3x3 boxes around it.
+        '''
+        precision = 1
+        while precision < cls.MAX_PRECISION:
+            spacing = 180 / (2.0 ** precision)
+            if spacing < lat_delta or spacing < lng_delta:
+                break
+            precision += 1
+        return precision
+
+    @classmethod
+    def _cover(cls, latLng, lat_delta, lng_delta, intersects, contains, max_cells, max_precision):
+        '''
+        Shared covering logic of cover_circle and cover_bbox
+        '''
+        if max_precision is None:
+            max_precision = cls.MAX_PRECISION
+        precision = min(cls.cover_precision(lat_delta, lng_delta), max_precision)
+        center = cls.encode(latLng[0], latLng[1], precision)
+        start = set([center]) | cls.neighbors(center, bearing=False)
+        cells = set(c for c in start if intersects(*cls.decode(c, box=True)[1:]))
+
+        # Too many cells for the budget: merge them into their parents
+        while len(cells) > max_cells and precision > 1:
+            precision -= 1
+            cells = set(c[:precision] for c in cells)
+
+        # Split the largest boxes crossing the area edge while the budget allows
+        heap = [(len(c), c) for c in cells]
+        heapq.heapify(heap)
+        while heap:
+            _, cell = heapq.heappop(heap)
+            if len(cell) >= max_precision:
+                continue
+            latLng_SW, latLng_NE = cls.decode(cell, box=True)[1:]
+            if contains(latLng_SW, latLng_NE):
+                continue
+            children = []
+            for c in alphabet:
+                child = cell + c
+                if intersects(*cls.decode(child, box=True)[1:]):
+                    children.append(child)
+            if len(cells) - 1 + len(children) > max_cells:
+                continue
+            cells.remove(cell)
+            for child in children:
+                cells.add(child)
+                heapq.heappush(heap, (len(child), child))
+
+        return sorted(cls._merge_cells(cells))
+
+    @classmethod
+    def _merge_cells(cls, cells):
+        '''
+        Replace the 4 children of a box by the box itself, as long as possible
+        '''
+        cells = set(cells)
+        merged = True
+        while merged:
+            merged = False
+            for parent in set(c[:-1] for c in cells if len(c) > 1):
+                children = [parent + c for c in alphabet]
+                if all(child in cells for child in children):
+                    cells.difference_update(children)
+                    cells.add(parent)
+                    merged = True
+        return cells
+
+    @classmethod
+    def prefix_range(cls, prefix, precision=None, curve='morton'):
+        '''
+        Return the (lowest, highest) integer codes on the given curve and of
+        the given precision, MAX_PRECISION by default, of the geobox_ids
+        starting with prefix.  Both curves keep the codes of a box contiguous.
+        '''
+        if precision is None:
+            precision = cls.MAX_PRECISION
+        shift = 2 * (precision - len(prefix))
+        code = cls.to_curve(cls.id_to_code(prefix), len(prefix), curve)
+        return code << shift, ((code + 1) << shift) - 1
+
+    @classmethod
+    def prefix_ranges(cls, prefixes, precision=None, curve='morton'):
+        '''
+        Return the sorted list of merged (lowest, highest) integer code ranges
+        holding the codes of all the prefixes, such as those of cover_circle,
+        so that a query becomes one range scan per range on a sorted index
+        '''
+        ranges = []
+        for lowest, highest in sorted(cls.prefix_range(p, precision, curve) for p in prefixes):
+            if ranges and lowest <= ranges[-1][1] + 1:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], highest))
+            else:
+                ranges.append((lowest, highest))
+        return ranges
 
 
 class GeoPoint(object):
     '''
     Used to represent a point
     '''
-    _lat = None
-    _lng = None
-    _geobox_id = None
-    _box = None
-    _precision = None
+    # The SW/NE bounds are kept so that the box of 4 corner GeoPoints and the
+    # neighbors are only built when asked for
+    __slots__ = ('_lat', '_lng', '_geobox_id', '_precision', '_latLng_SW', '_latLng_NE',
+                 '_build', '_box', '_neighbors')
 
     @classmethod
     def encode_geobox_id(cls, latitude, longitude, precision=None, box=False):
@@ -216,10 +1131,10 @@ class GeoPoint(object):
             geobox = self.encode_geobox_id(latitude, longitude, self._precision, box=True)
 
             self._geobox_id = geobox[0]
-            latLng_SW = geobox[1]
-            latLng_NE = geobox[2]
+            self._latLng_SW = geobox[1]
+            self._latLng_NE = geobox[2]
         else:
-            latlng, latLng_SW, latLng_NE = GeoBoxEncoder.decode(geobox_id, box=True)
+            latlng, self._latLng_SW, self._latLng_NE = GeoBoxEncoder.decode(geobox_id, box=True)
             self._geobox_id = geobox_id
             self._lat = latlng[0]
             self._lng = latlng[1]
@@ -228,9 +1143,32 @@ class GeoPoint(object):
             else:
                 self._precision = precision
 
-        # Create box if needed
-        if build_box:
-            self._box = self._build_box(latLng_SW=latLng_SW, latLng_NE=latLng_NE, precision=precision)
+        # The box is created on first access when needed
+        self._build = build_box
+        self._box = None
+        self._neighbors = None
+
+    @classmethod
+    def _from_code(cls, latitude, longitude, code, precision, build_box=False):
+        '''
+        Create a GeoPoint, without a box unless build_box is True, for a
+        location whose integer code is already known
+        '''
+        point = cls.__new__(cls)
+        point._lat = latitude
+        point._lng = longitude
+        point._geobox_id = GeoBoxEncoder.code_to_id(code, precision)
+        point._precision = precision
+        point._latLng_SW, point._latLng_NE = GeoBoxEncoder.code_bounds(code, precision)
+        point._build = build_box
+        point._box = None
+        point._neighbors = None
+        return point
+
+    def __reduce__(self):
+        # Classes with __slots__ do not pickle under the Python 2 default
+        # protocol: rebuild the point from its location instead
+        return (self.__class__, (self._lat, self._lng, None, self._precision, self._build))
 
     # Private methods
     def _build_box(self, latLng_SW, latLng_NE, precision=None):
@@ -238,6 +1176,12 @@ class GeoPoint(object):
         Based on latLng of SW and NE points returned from the GeoBoxEncoder, create
         a box that is represented by a dictionary of 4 GeoPoints: NW, NE, SE, SW
         '''
+        metrics = GeoBoxEncoder.metrics
+        if metrics is not None:
+            return metrics.call('build_box', self._make_box, latLng_SW, latLng_NE, precision)
+        return self._make_box(latLng_SW, latLng_NE, precision)
+
+    def _make_box(self, latLng_SW, latLng_NE, precision):
         if precision is None:
             precision = self._precision
 
@@ -246,13 +1190,33 @@ class GeoPoint(object):
 
         # Build the result
         box = dict()
-        box['SW'] = self.__class__(latitude=latLng_SW[0], longitude=latLng_SW[1], precision=precision, build_box=False)
-        box['NE'] = self.__class__(latitude=latLng_NE[0], longitude=latLng_NE[1], precision=precision, build_box=False)
-        box['SE'] = self.__class__(latitude=latLng_SE[0], longitude=latLng_SE[1], precision=precision, build_box=False)
-        box['NW'] = self.__class__(latitude=latLng_NW[0], longitude=latLng_NW[1], precision=precision, build_box=False)
+        code = GeoBoxEncoder.bounds_code(latLng_SW, latLng_NE, precision)
+        if code is None:
+            # Bounds of another precision, or beyond MAX_PRECISION: encode each corner
+            box['SW'] = self.__class__(latitude=latLng_SW[0], longitude=latLng_SW[1], precision=precision, build_box=False)
+            box['NE'] = self.__class__(latitude=latLng_NE[0], longitude=latLng_NE[1], precision=precision, build_box=False)
+            box['SE'] = self.__class__(latitude=latLng_SE[0], longitude=latLng_SE[1], precision=precision, build_box=False)
+            box['NW'] = self.__class__(latitude=latLng_NW[0], longitude=latLng_NW[1], precision=precision, build_box=False)
+        else:
+            corners = GeoBoxEncoder.corner_codes(code, precision)
+            box['SW'] = self._from_code(latLng_SW[0], latLng_SW[1], corners['SW'], precision)
+            box['NE'] = self._from_code(latLng_NE[0], latLng_NE[1], corners['NE'], precision)
+            box['SE'] = self._from_code(latLng_SE[0], latLng_SE[1], corners['SE'], precision)
+            box['NW'] = self._from_code(latLng_NW[0], latLng_NW[1], corners['NW'], precision)
 
         return box
 
+    def _cached_box(self, geobox_id, latLng_SW, latLng_NE):
+        '''
+        _build_box through the encoder cache when enabled.  Corners only depend
+        on the box, not on the point within it, so the geobox_id is the key.
+        '''
+        cache = GeoBoxEncoder.cache
+        if cache is None:
+            return self._build_box(latLng_SW, latLng_NE)
+        key = ('box', self.__class__, geobox_id, self._precision)
+        return dict(cache.get_or_compute(key, lambda: self._build_box(latLng_SW, latLng_NE)))
+
     # Define Properties
     @property
     def latitude(self):
@@ -276,24 +1240,29 @@ class GeoPoint(object):
 
     @property
     def box(self):
+        if self._box is None and self._build:
+            self._box = self._cached_box(self._geobox_id, self._latLng_SW, self._latLng_NE)
         return self._box
 
     @property
     def hypotenuse(self):
-        box = self._box
+        box = self.box
         return self.distance(box['NE'], box['SW'])
 
     # Methods
     def neighbors(self):
         '''
-        Create a dictionary with 8 entries, representing the boxes surronding the current one.
+        Create a dictionary with 8 entries (less at the poles), representing the boxes
+        surronding the current one.
         '''
-        nb = {}
-        for geobox in GeoBoxEncoder.neighbors(self._geobox_id, box=True):
-            # Ignoring the heading contained in geobox[0]
-            geobox_id, latLng_SW, latLng_NE = geobox[1]
-            nb[geobox_id] = self._build_box(latLng_SW, latLng_NE)
-        return nb
+        if self._neighbors is None:
+            nb = {}
+            for geobox in GeoBoxEncoder.neighbors(self._geobox_id, box=True):
+                # Ignoring the heading contained in geobox[0]
+                geobox_id, latLng_SW, latLng_NE = geobox[1]
+                nb[geobox_id] = self._cached_box(geobox_id, latLng_SW, latLng_NE)
+            self._neighbors = nb
+        return self._neighbors
 
     def distance_from(self, geopoint):
         return self.distance(self, geopoint)
@@ -304,30 +1273,50 @@ class GeoPoint(object):
         Calculate the great circle distance between two points
         using haversine
         '''
-        lat1, lon1 = geopointA.latlng
-        lat2, lon2 = geopointB.latlng
-
-        # convert decimal degrees to radians
-        lon1, lat1, lon2, lat2 = map(rads, [lon1, lat1, lon2, lat2])
-        # haversine formula
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * asin(sqrt(a))
-        # Return distance in meter
-        return GeoBoxEncoder.EARTH_RADIUS * c
+        return GeoBoxEncoder.haversine(geopointA.latlng, geopointB.latlng)
 
 
 class GeoPointEncoder(json.JSONEncoder):
     '''
-    Basic Encoder designed to convert datetime object into ISODATE
+    JSONEncoder writing a GeoPoint as its geobox_id, latitude and longitude.
+    See geobox.serialize to write many points.
     '''
     def default(self, obj):
         if isinstance(obj, GeoPoint):
             return {
-                    'geobox_id': obj.geobox_id,
+                    'geobox_id': obj.gcode,
                     'latitude': obj.latitude,
                     'longitude': obj.longitude
                     }
         else:
             return super(GeoPointEncoder, self).default(obj)
+
+
+from .index import GeoIndex
+from .points import GeoPointArray
+from .join import spatial_join
+from .pyramid import CellPyramid
+from .polygon import PolygonIndex
+from .geofence import GeofenceEngine
+
+
+def enable_cache(maxsize=4096):
+    '''
+    Turn on the result cache for every encoder, see geobox.cache
+    '''
+    return GeoBoxEncoder.enable_cache(maxsize)
+
+
+def disable_cache():
+    GeoBoxEncoder.disable_cache()
+
+
+def enable_metrics(sink=None):
+    '''
+    Turn on the hot path metrics for every encoder, see geobox.metrics
+    '''
+    return GeoBoxEncoder.enable_metrics(sink)
+
+
+def disable_metrics():
+    GeoBoxEncoder.disable_metrics()
@@ -0,0 +1,93 @@
+'''
+Bounded LRU cache for geobox results.
+
+Popular geobox_ids are decoded, expanded into neighbors and turned into
+boxes over and over.  GeoBoxEncoder and GeoPoint look those results up in
+GeoBoxEncoder.cache when it is set, which is off by default:
+
+    >>> from geobox import GeoBoxEncoder, enable_cache
+    >>> cache = enable_cache(10000)             # every encoder
+    >>> cache.stats()['hits']
+    0
+
+A subclass of GeoBoxEncoder can get its own cache with
+MyEncoder.enable_cache(maxsize), or opt out with MyEncoder.disable_cache().
+'''
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    '''
+    Thread safe least recently used cache with hit, miss and eviction counters
+    '''
+    def __init__(self, maxsize=4096):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1, got %s" % maxsize)
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                # Re-insert to mark as most recently used
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        '''
+        Return the cached value of key, calling compute() to create it on a miss.
+        compute runs outside of the lock, so two threads missing the same key
+        at the same time may both compute it.
+        '''
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        '''
+        Snapshot of the counters, ready to be exported
+        '''
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+            }
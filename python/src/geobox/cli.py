@@ -0,0 +1,339 @@
+'''
+Command line bulk encoder.
+
+Streams latitude/longitude rows from CSV or NDJSON and writes every row back
+with its code appended, as a geobox_id, an integer gbox.Geocode code or a
+geohash string.  Rows are encoded in fixed size chunks through the NumPy
+batch encoders, so memory stays constant whatever the size of the input:
+
+    python -m geobox points.csv > encoded.csv
+    cat points.ndjson | python -m geobox --input ndjson --output geohash -p 9
+    python -m geobox --workers 4 --chunk-size 100000 big.csv -o encoded.csv
+
+CSV input must start with a header row.  The coordinate columns (or NDJSON
+keys) are found by name, see LAT_FIELDS and LNG_FIELDS, unless given with
+--lat and --lng.  Rows with a missing or invalid coordinate get an empty
+code (null in NDJSON).
+'''
+from __future__ import print_function
+
+import argparse
+import csv
+import json
+import multiprocessing
+import sys
+from collections import deque, namedtuple
+from itertools import chain, islice
+from timeit import default_timer
+
+from geohash import Geohash
+
+from . import GeoBoxEncoder
+from .curve import np, require_numpy
+from .storage import geocode_keys, signed_geocodes
+
+OUTPUTS = ('geobox', 'geocode', 'geohash')
+DEFAULT_PRECISION = {'geobox': GeoBoxEncoder.DEFAULT_PRECISION, 'geocode': 32, 'geohash': 12}
+MAX_PRECISION = {'geobox': GeoBoxEncoder.MAX_PRECISION, 'geocode': 32, 'geohash': 12}
+LAT_FIELDS = ('lat', 'latitude')
+LNG_FIELDS = ('lng', 'lon', 'long', 'longitude')
+CHUNK_SIZE = 65536
+
+# What a worker needs to know to encode a chunk
+Settings = namedtuple('Settings', 'input output precision lat lng field')
+
+
+# -----------------------------------------------------------------
+# Vectorized encoders
+
+def geocode_many(latitudes, longitudes, depth=32):
+    '''
+    Vectorized gbox.Geocode: return the int64 codes of Geocode(lng, lat, depth).gcode()
+    '''
+    require_numpy()
+    # Geocode reads its unsigned 64 bit code back as a signed one
+    return signed_geocodes(geocode_keys(latitudes, longitudes, depth))
+
+
+def geohash_many(latitudes, longitudes, length=12):
+    '''
+    Vectorized geohash.Geohash: return a fixed width 'S<length>' array of the
+    first length characters of str(Geohash((lng, lat))).  Rows whose
+    coordinates are not finite get a meaningless hash.
+    '''
+    require_numpy()
+    if not 0 < length <= MAX_PRECISION['geohash']:
+        raise ValueError("geohash length must be between 1 and %d, got %s" % (MAX_PRECISION['geohash'], length))
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    valid = np.isfinite(latitudes) & np.isfinite(longitudes)
+    hashes = Geohash.bitstring_many(np.where(valid, longitudes, 0.0), np.where(valid, latitudes, 0.0))
+    return hashes.astype('S%d' % length)
+
+
+def encode_chunk(latitudes, longitudes, output, precision):
+    '''
+    Encode arrays of coordinates, returning a list of codes with None for the
+    rows whose coordinates are not finite
+    '''
+    if output == 'geobox':
+        codes = GeoBoxEncoder.encode_many(latitudes, longitudes, precision).astype(str)
+    elif output == 'geocode':
+        codes = geocode_many(latitudes, longitudes, precision)
+    elif output == 'geohash':
+        codes = geohash_many(latitudes, longitudes, precision).astype(str)
+    else:
+        raise ValueError("Unknown output '%s', expected one of: %s" % (output, ', '.join(OUTPUTS)))
+
+    codes = codes.tolist()
+    valid = np.isfinite(latitudes) & np.isfinite(longitudes)
+    if not valid.all():
+        for i in np.flatnonzero(~valid):
+            codes[i] = None
+    return codes
+
+
+def _coordinates(values):
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        pass
+    result = np.empty(len(values))
+    for i, value in enumerate(values):
+        try:
+            result[i] = float(value)
+        except (TypeError, ValueError):
+            result[i] = np.nan
+    return result
+
+
+# -----------------------------------------------------------------
+# Chunk processing, run in the worker processes
+
+class _Lines(list):
+    '''
+    Minimal file object collecting what csv.writer writes
+    '''
+    write = list.append
+
+
+def _column(rows, index):
+    return [row[index] if index < len(row) else None for row in rows]
+
+
+def process_chunk(settings, lines):
+    '''
+    Encode a chunk of input lines and return (output text, row count).
+    Parsing happens here rather than in the reading process, which only has
+    to pass strings around.
+    '''
+    if settings.input == 'csv':
+        rows = list(csv.reader(lines))
+        codes = encode_chunk(
+            _coordinates(_column(rows, settings.lat)),
+            _coordinates(_column(rows, settings.lng)),
+            settings.output, settings.precision)
+        codes = ['' if code is None else str(code) for code in codes]
+        if len(rows) == len(lines):
+            # One line per row: append the code to the line as it is
+            text = ''.join(line.rstrip('\r\n') + ',' + code + '\n' for line, code in zip(lines, codes))
+        else:
+            out = _Lines()
+            writer = csv.writer(out, lineterminator='\n')
+            for row, code in zip(rows, codes):
+                row.append(code)
+                writer.writerow(row)
+            text = ''.join(out)
+        return text, len(rows)
+
+    records = [json.loads(line) for line in lines if line.strip()]
+    codes = encode_chunk(
+        _coordinates([r.get(settings.lat) for r in records]),
+        _coordinates([r.get(settings.lng) for r in records]),
+        settings.output, settings.precision)
+    for record, code in zip(records, codes):
+        record[settings.field] = code
+    return ''.join(json.dumps(record) + '\n' for record in records), len(records)
+
+
+def _process(job):
+    return process_chunk(*job)
+
+
+# -----------------------------------------------------------------
+# Input
+
+def chunks(lines, size, quoted=False):
+    '''
+    Split an iterator of lines into lists of size lines.  When quoted is
+    True, lines are CSV and a chunk only ends between two records: while it
+    holds an odd number of quotes, its last line ends inside of a quoted
+    field and the chunk takes the next line as well.
+    '''
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, size))
+        if not chunk:
+            return
+        if quoted:
+            quotes = ''.join(chunk).count('"')
+            while quotes % 2:
+                line = next(lines, None)
+                if line is None:
+                    break
+                chunk.append(line)
+                quotes += line.count('"')
+        yield chunk
+
+
+def _find_field(names, given, candidates, what):
+    if given is not None:
+        if given not in names:
+            raise ValueError("No %s field '%s' in the input" % (what, given))
+        return given
+    lowered = dict((str(name).lower(), name) for name in names)
+    for candidate in candidates:
+        if candidate in lowered:
+            return lowered[candidate]
+    raise ValueError("Cannot find the %s field, expected one of: %s (or use --%s)" % (
+        what, ', '.join(candidates), 'lat' if what == 'latitude' else 'lng'))
+
+
+def read_csv(stream, field, lat=None, lng=None):
+    '''
+    Return (output header line, column indices of lat and lng, line
+    iterator) of a CSV stream, field being the name of the added column
+    '''
+    lines = iter(stream)
+    try:
+        header = next(csv.reader(lines))
+    except StopIteration:
+        return None, None, None, iter(())
+    lat_index = header.index(_find_field(header, lat, LAT_FIELDS, 'latitude'))
+    lng_index = header.index(_find_field(header, lng, LNG_FIELDS, 'longitude'))
+    out = _Lines()
+    csv.writer(out, lineterminator='\n').writerow(header + [field])
+    return ''.join(out), lat_index, lng_index, lines
+
+
+def read_ndjson(stream, lat=None, lng=None):
+    '''
+    Return (lat key, lng key, line iterator) of a NDJSON stream, the keys
+    being found in its first record
+    '''
+    lines = iter(stream)
+    for first in lines:
+        if first.strip():
+            break
+    else:
+        return None, None, iter(())
+    record = json.loads(first)
+    lat = _find_field(record, lat, LAT_FIELDS, 'latitude')
+    lng = _find_field(record, lng, LNG_FIELDS, 'longitude')
+    return lat, lng, chain((first,), lines)
+
+
+# -----------------------------------------------------------------
+# Driver
+
+def run(jobs, workers=1):
+    '''
+    Yield the output of process_chunk for every (settings, lines) job, in
+    order.  With more than one worker, jobs are spread over a process pool
+    with at most two jobs in flight per worker, so memory stays bounded when
+    the input is read faster than it is encoded.
+    '''
+    if workers <= 1:
+        for job in jobs:
+            yield _process(job)
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        pending = deque()
+        for job in jobs:
+            pending.append(pool.apply_async(_process, (job,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _open(path, mode):
+    if path == '-':
+        return sys.stdin if mode == 'r' else sys.stdout
+    if sys.version_info[0] < 3:
+        return open(path, mode + 'b')
+    return open(path, mode, newline='')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m geobox', description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('path', nargs='?', default='-', help="input file, '-' for stdin (default)")
+    parser.add_argument('-o', '--out', default='-', help="output file, '-' for stdout (default)")
+    parser.add_argument('-i', '--input', choices=('csv', 'ndjson'),
+                        help="input format, guessed from the file extension (default csv)")
+    parser.add_argument('-f', '--output', choices=OUTPUTS, default='geobox', help="code to write (default geobox)")
+    parser.add_argument('-p', '--precision', type=int,
+                        help="geobox precision, Geocode depth or geohash length (default %s)" % ', '.join(
+                            str(DEFAULT_PRECISION[o]) for o in OUTPUTS))
+    parser.add_argument('--lat', help="latitude column or key")
+    parser.add_argument('--lng', help="longitude column or key")
+    parser.add_argument('--field', help="name of the added column or key (default the output name)")
+    parser.add_argument('-w', '--workers', type=int, default=1, help="encoding processes (default 1)")
+    parser.add_argument('-c', '--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="input lines encoded at once (default %d)" % CHUNK_SIZE)
+    parser.add_argument('-q', '--quiet', action='store_true', help="do not print the throughput summary")
+    args = parser.parse_args(argv)
+
+    if args.input is None:
+        args.input = 'ndjson' if args.path.endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+    if args.precision is None:
+        args.precision = DEFAULT_PRECISION[args.output]
+    if not 0 < args.precision <= MAX_PRECISION[args.output]:
+        parser.error("%s precision must be between 1 and %d" % (args.output, MAX_PRECISION[args.output]))
+    if args.workers < 1 or args.chunk_size < 1:
+        parser.error("--workers and --chunk-size must be at least 1")
+    return args
+
+
+def main(argv=None):
+    require_numpy()
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    start = default_timer()
+    count = 0
+    source = _open(args.path, 'r')
+    target = _open(args.out, 'w')
+    try:
+        if args.input == 'csv':
+            header, lat, lng, lines = read_csv(source, args.field or args.output, args.lat, args.lng)
+            if header is not None:
+                target.write(header)
+        else:
+            lat, lng, lines = read_ndjson(source, args.lat, args.lng)
+        settings = Settings(args.input, args.output, args.precision, lat, lng, args.field or args.output)
+
+        jobs = ((settings, chunk) for chunk in chunks(lines, args.chunk_size, args.input == 'csv'))
+        for text, rows in run(jobs, args.workers):
+            target.write(text)
+            count += rows
+    except ValueError as e:
+        print("error: %s" % e, file=sys.stderr)
+        return 2
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+        else:
+            target.flush()
+
+    if not args.quiet:
+        elapsed = default_timer() - start
+        print("%s: %d rows in %.2f s (%.0f rows/s)" % (
+            args.output, count, elapsed, count / elapsed if elapsed else 0), file=sys.stderr)
+    return 0
@@ -0,0 +1,291 @@
+'''
+Integer primitives behind the geobox encoders.
+
+A geobox_id is a bisection of longitude and latitude.  Instead of bisecting
+floats one character at a time, the position is quantized once into integer
+cell indices and the bits of both indices are interleaved with the classic
+"magic number" spreading, giving the same layout that the bisection builds
+bit by bit (longitude on the odd bits, latitude on the even bits).
+'''
+from math import ceil
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_SPREAD_MASKS = (
+    (16, 0x0000FFFF0000FFFF),
+    (8, 0x00FF00FF00FF00FF),
+    (4, 0x0F0F0F0F0F0F0F0F),
+    (2, 0x3333333333333333),
+    (1, 0x5555555555555555),
+)
+_COMPACT_MASKS = (
+    (1, 0x3333333333333333),
+    (2, 0x0F0F0F0F0F0F0F0F),
+    (4, 0x00FF00FF00FF00FF),
+    (8, 0x0000FFFF0000FFFF),
+    (16, 0x00000000FFFFFFFF),
+)
+
+
+def _spread_masks(value):
+    value &= 0xFFFFFFFF
+    for shift, mask in _SPREAD_MASKS:
+        value = (value | (value << shift)) & mask
+    return value
+
+# Spread of every byte: four table lookups beat the five mask steps in Python
+_SPREAD_BYTES = [_spread_masks(i) for i in range(256)]
+
+
+def spread(value):
+    '''
+    Insert a 0 bit in front of each of the lower 32 bits of value:
+    abcd -> 0a0b0c0d
+    '''
+    return (_SPREAD_BYTES[value & 0xFF] |
+            _SPREAD_BYTES[(value >> 8) & 0xFF] << 16 |
+            _SPREAD_BYTES[(value >> 16) & 0xFF] << 32 |
+            _SPREAD_BYTES[(value >> 24) & 0xFF] << 48)
+
+
+def compact(value):
+    '''
+    Inverse of spread: keep the even bits of value and pack them together.
+    '''
+    value &= 0x5555555555555555
+    for shift, mask in _COMPACT_MASKS:
+        value = (value | (value >> shift)) & mask
+    return value
+
+
+def interleave(x, y):
+    '''
+    Interleave the bits of x (odd positions) and y (even positions)
+    '''
+    return (spread(x) << 1) | spread(y)
+
+
+def deinterleave(code):
+    '''
+    Split a code produced by interleave back into (x, y)
+    '''
+    return compact(code >> 1), compact(code)
+
+
+def quantize(value, lower, span, bits):
+    '''
+    Return the index of the cell that contains value once the interval
+    [lower, lower + span] has been bisected 'bits' times.
+
+    The bisection sends a value to the upper half only when it is strictly
+    greater than the mid point, so a value sitting on a cell edge belongs to
+    the cell below it.  Values outside of the interval are clamped.
+    '''
+    cells = 1 << bits
+    if not value > lower:
+        # Also catches NaN, which never passes a '>' test
+        return 0
+    if value >= lower + span:
+        return cells - 1
+
+    unit = span / float(cells)
+    index = int(ceil((value - lower) / unit)) - 1
+
+    # The division above can be off by one ulp around a cell edge.  Edges are
+    # exact in floating point (span is a small integer, cells a power of 2),
+    # so settle the index against them.
+    if index > 0 and not value > lower + index * unit:
+        index -= 1
+    elif index < cells - 1 and value > lower + (index + 1) * unit:
+        index += 1
+    return index
+
+
+# -----------------------------------------------------------------
+# Hilbert curve
+#
+# Same cells as the interleaved (Z-order or Morton) code, visited in Hilbert
+# order: consecutive codes are always neighbor cells, so an area breaks into
+# fewer runs of codes.  Like the interleaved code, each level adds 2 bits and
+# the code of a box is the prefix of the codes of the points within it.
+#
+# The curve is walked from the top level with a state machine.  A state is
+# (swap << 1) | flip: the x and y bits of the level are flipped when flip is
+# set, then exchanged when swap is set, giving the quadrant (3 * x) ^ y.  The
+# tables below handle 4 levels, a byte of code, per lookup.
+
+_FLIP = 1
+_SWAP = 2
+
+
+def _hilbert_level(state, x_bit, y_bit):
+    flip = state & _FLIP
+    x_bit, y_bit = x_bit ^ flip, y_bit ^ flip
+    if state & _SWAP:
+        x_bit, y_bit = y_bit, x_bit
+    digit = (3 * x_bit) ^ y_bit
+    if not y_bit:
+        state = (state ^ _SWAP) ^ (_FLIP if x_bit else 0)
+    return digit, state
+
+
+def _hilbert_tables():
+    digits = {}
+    for state in range(4):
+        for x_bit in (0, 1):
+            for y_bit in (0, 1):
+                digits[state, x_bit, y_bit] = _hilbert_level(state, x_bit, y_bit)
+
+    encode = [0] * 1024
+    decode = [0] * 1024
+    for start in range(4):
+        for x in range(16):
+            for y in range(16):
+                state, code = start, 0
+                for shift in (3, 2, 1, 0):
+                    digit, state = digits[state, (x >> shift) & 1, (y >> shift) & 1]
+                    code = (code << 2) | digit
+                encode[(start << 8) | (x << 4) | y] = (code << 2) | state
+                decode[(start << 8) | code] = (((x << 4) | y) << 2) | state
+    return encode, decode
+
+_HILBERT_ENCODE, _HILBERT_DECODE = _hilbert_tables()
+
+
+def _hilbert_start(bits):
+    '''
+    Levels walked, a multiple of 4, and the state to start with.  Missing top
+    levels are all 0 bits, each of which swaps x and y: start swapped when
+    their count is odd, so the real top level sees the initial state.
+    '''
+    pad = -bits % 4
+    return bits + pad, _SWAP if pad & 1 else 0
+
+
+def hilbert_encode(x, y, bits):
+    '''
+    Hilbert code, 2 * bits wide, of the cell (x, y) of a 2**bits square grid
+    '''
+    levels, state = _hilbert_start(bits)
+    code = 0
+    for shift in range(levels - 4, -4, -4):
+        entry = _HILBERT_ENCODE[(state << 8) | (((x >> shift) & 0xF) << 4) | ((y >> shift) & 0xF)]
+        code = (code << 8) | (entry >> 2)
+        state = entry & 3
+    return code
+
+
+def hilbert_decode(code, bits):
+    '''
+    Inverse of hilbert_encode: return the cell (x, y) of a code
+    '''
+    levels, state = _hilbert_start(bits)
+    x = y = 0
+    for shift in range(2 * levels - 8, -8, -8):
+        entry = _HILBERT_DECODE[(state << 8) | ((code >> shift) & 0xFF)]
+        x = (x << 4) | (entry >> 6)
+        y = (y << 4) | ((entry >> 2) & 0xF)
+        state = entry & 3
+    return x, y
+
+
+# -----------------------------------------------------------------
+# NumPy counterparts, working on whole uint64 arrays at once
+
+def require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for the batch geobox functions")
+
+
+def spread_many(values):
+    '''
+    Vectorized spread over an array of indices, returning uint64
+    '''
+    values = np.asarray(values).astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in _SPREAD_MASKS:
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def compact_many(values):
+    '''
+    Vectorized compact over an array of codes, returning uint64
+    '''
+    values = np.asarray(values).astype(np.uint64) & np.uint64(0x5555555555555555)
+    for shift, mask in _COMPACT_MASKS:
+        values = (values | (values >> np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def interleave_many(x, y):
+    return (spread_many(x) << np.uint64(1)) | spread_many(y)
+
+
+def deinterleave_many(codes):
+    codes = np.asarray(codes).astype(np.uint64)
+    return compact_many(codes >> np.uint64(1)), compact_many(codes)
+
+
+def quantize_many(values, lower, span, bits):
+    '''
+    Vectorized quantize.  lower can be a scalar or an array matching values.
+    Returns the cell indices as uint64.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    cells = 1 << bits
+    unit = span / float(cells)
+
+    with np.errstate(invalid='ignore'):
+        index = np.clip(np.ceil((values - lower) / unit) - 1, 0, cells - 1)
+        # Settle the index against the exact cell edges, see quantize
+        index = np.where((index > 0) & ~(values > lower + index * unit), index - 1, index)
+        index = np.where((index < cells - 1) & (values > lower + (index + 1) * unit), index + 1, index)
+
+        index = np.where(values > lower, index, 0)
+        index = np.where(values >= lower + span, cells - 1, index)
+    return index.astype(np.uint64)
+
+
+if np is not None:
+    _hilbert_encode_table = np.array(_HILBERT_ENCODE, dtype=np.uint64)
+    _hilbert_decode_table = np.array(_HILBERT_DECODE, dtype=np.uint64)
+
+
+def hilbert_encode_many(x, y, bits):
+    '''
+    Vectorized hilbert_encode, returning uint64
+    '''
+    x = np.asarray(x).astype(np.uint64)
+    y = np.asarray(y).astype(np.uint64)
+    levels, start = _hilbert_start(bits)
+    state = np.full(x.shape, start, dtype=np.uint64)
+    code = np.zeros(x.shape, dtype=np.uint64)
+    nibble = np.uint64(0xF)
+    for shift in range(levels - 4, -4, -4):
+        shift = np.uint64(shift)
+        index = (state << np.uint64(8)) | (((x >> shift) & nibble) << np.uint64(4)) | ((y >> shift) & nibble)
+        entry = _hilbert_encode_table[index.astype(np.intp)]
+        code = (code << np.uint64(8)) | (entry >> np.uint64(2))
+        state = entry & np.uint64(3)
+    return code
+
+
+def hilbert_decode_many(codes, bits):
+    '''
+    Vectorized hilbert_decode, returning the (x, y) uint64 arrays
+    '''
+    codes = np.asarray(codes).astype(np.uint64)
+    levels, start = _hilbert_start(bits)
+    state = np.full(codes.shape, start, dtype=np.uint64)
+    x = np.zeros(codes.shape, dtype=np.uint64)
+    y = np.zeros(codes.shape, dtype=np.uint64)
+    for shift in range(2 * levels - 8, -8, -8):
+        index = (state << np.uint64(8)) | ((codes >> np.uint64(shift)) & np.uint64(0xFF))
+        entry = _hilbert_decode_table[index.astype(np.intp)]
+        x = (x << np.uint64(4)) | (entry >> np.uint64(6))
+        y = (y << np.uint64(4)) | ((entry >> np.uint64(2)) & np.uint64(0xF))
+        state = entry & np.uint64(3)
+    return x, y
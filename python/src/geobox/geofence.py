@@ -0,0 +1,295 @@
+'''
+Streaming geofencing of moving points against circular and rectangular fences.
+
+Every fence is covered once with GeoBoxEncoder.cover_circle or cover_bbox,
+at most max_cells boxes no finer than the engine precision, and the boxes
+are kept in an inverted index from box code to fences.  Each box is either
+within its fence, or partial when the fence edge crosses it.
+
+Positions are encoded by batch at the engine precision.  The fences of the
+box of a vehicle come from the index entries of its prefixes, and those
+partial for their covering box are tested against the smaller box of the
+vehicle, once per box through a cache.  Fences containing the box hold the
+vehicle and only the ones still partial need a final check of its position:
+GeoBoxEncoder.haversine for circles, bounds for rectangles.  A vehicle
+reporting from the box of its last update, where no fence is partial, can
+not have entered or left any fence and is skipped.
+
+    >>> engine = GeofenceEngine(precision=16, dwell=300)
+    >>> engine.add_circle('depot', 45.46, 9.19, 500)
+    >>> events = engine.update(['truck'], [45.461], [9.191], [0.0])
+    >>> [(e.vehicle, e.fence, e.kind) for e in events]
+    [('truck', 'depot', 'enter')]
+
+An 'enter' or 'exit' event is emitted when an update finds a vehicle
+inside a fence it was not in, or the reverse, and a 'dwell' event, once per
+stay, at the first update dwell seconds or more after the 'enter' one.
+'''
+from collections import namedtuple
+
+from . import GeoBoxEncoder
+from .cache import LRUCache
+from .curve import np, require_numpy
+
+Event = namedtuple('Event', 'vehicle fence kind timestamp')
+
+CIRCLE, RECTANGLE = 'circle', 'rectangle'
+ENTER, EXIT, DWELL = 'enter', 'exit', 'dwell'
+
+
+def _in_lng_range(west, east, lng_min, lng_max):
+    # A rectangle crossing the 180 meridian has lng_min > lng_max
+    if lng_min <= lng_max:
+        return lng_min <= west and east <= lng_max
+    return lng_min <= west or east <= lng_max
+
+
+def _lng_overlaps(west, east, lng_min, lng_max):
+    if lng_min <= lng_max:
+        return lng_min <= east and west <= lng_max
+    return lng_min <= east or west <= lng_max
+
+
+class GeofenceEngine(object):
+    '''
+    Fences and the last box and fences of every vehicle, turning batches of
+    position updates into events, see the module documentation
+    '''
+    def __init__(self, precision=16, dwell=None, max_cells=16, cache_size=65536, encoder=GeoBoxEncoder):
+        require_numpy()
+        if not 1 <= precision <= encoder.MAX_PRECISION:
+            raise ValueError("precision must be between 1 and %d" % encoder.MAX_PRECISION)
+        self.precision = precision
+        self.dwell = dwell
+        self.max_cells = max_cells
+        self.encoder = encoder
+        # fence_id: (kind, parameters, index entries, contains(box), intersects(box))
+        self._fences = {}
+        # Inverted index by prefix length: {code: {fence_id: within}}
+        self._index = {}
+        self._lengths = []
+        # (within fences, partial fences) by box code of the engine precision
+        self._boxes = LRUCache(cache_size)
+
+        # Bumped by every fence change, which invalidates the vehicle boxes
+        self._version = 0
+
+        # Vehicle state by slot: last box, the fence version it was evaluated
+        # at, whether it has no partial fence, time of the next dwell event
+        # and {fence_id: [enter time, dwelled]}
+        self._slots = {}
+        self._vehicles = []
+        self._box = np.zeros(0, dtype=np.uint64)
+        self._checked = np.zeros(0, dtype=np.int64)
+        self._stable = np.zeros(0, dtype=bool)
+        self._due = np.zeros(0, dtype=np.float64)
+        self._inside = []
+        # Updates skipped in their box, and evaluated against the index
+        self.skipped = 0
+        self.evaluated = 0
+
+    # Fences
+    def add_circle(self, fence_id, latitude, longitude, radius):
+        '''
+        Add a fence of radius meter around latitude/longitude
+        '''
+        if radius <= 0:
+            raise ValueError("radius must be positive, got %s" % radius)
+        latitude, longitude, radius = float(latitude), float(longitude), float(radius)
+        latLng = (latitude, longitude)
+        haversine = self.encoder.haversine
+
+        def contains(latLng_SW, latLng_NE):
+            # The distance from the center along a box edge peaks at a corner
+            corners = (latLng_SW, latLng_NE, (latLng_SW[0], latLng_NE[1]), (latLng_NE[0], latLng_SW[1]))
+            return all(haversine(latLng, corner) <= radius for corner in corners)
+
+        def intersects(latLng_SW, latLng_NE):
+            return self.encoder.box_distance(latLng, latLng_SW, latLng_NE) <= radius
+
+        cells = self.encoder.cover_circle(latitude, longitude, radius, self.max_cells, self.precision)
+        self._add(fence_id, CIRCLE, (latitude, longitude, radius), cells, contains, intersects)
+
+    def add_rectangle(self, fence_id, latLng_SW, latLng_NE):
+        '''
+        Add a fence from its SW to its NE corner.  A rectangle crossing the
+        180 meridian has a SW longitude greater than the NE one.
+        '''
+        (lat_min, lng_min), (lat_max, lng_max) = latLng_SW, latLng_NE
+        if lat_min > lat_max:
+            raise ValueError("SW latitude must not be north of the NE one")
+        bounds = (float(lat_min), float(lng_min), float(lat_max), float(lng_max))
+        cells = self.encoder.cover_bbox(latLng_SW, latLng_NE, self.max_cells, self.precision)
+
+        def contains(box_SW, box_NE):
+            return (lat_min <= box_SW[0] and box_NE[0] <= lat_max and
+                    _in_lng_range(box_SW[1], box_NE[1], lng_min, lng_max))
+
+        def intersects(box_SW, box_NE):
+            return (lat_min <= box_NE[0] and box_SW[0] <= lat_max and
+                    _lng_overlaps(box_SW[1], box_NE[1], lng_min, lng_max))
+        self._add(fence_id, RECTANGLE, bounds, cells, contains, intersects)
+
+    def _add(self, fence_id, kind, parameters, cells, contains, intersects):
+        if fence_id in self._fences:
+            self.remove_fence(fence_id)
+        entries = []
+        for cell in cells:
+            within = contains(*self.encoder.decode(cell, box=True)[1:])
+            key = (len(cell), self.encoder.id_to_code(cell))
+            self._index.setdefault(key[0], {}).setdefault(key[1], {})[fence_id] = within
+            entries.append(key)
+        self._fences[fence_id] = (kind, parameters, entries, contains, intersects)
+        self._changed()
+
+    def remove_fence(self, fence_id):
+        '''
+        Remove a fence.  Vehicles inside it leave it without an event.
+        '''
+        entries = self._fences.pop(fence_id)[2]
+        for length, code in entries:
+            fences = self._index[length][code]
+            del fences[fence_id]
+            if not fences:
+                del self._index[length][code]
+        for inside in self._inside:
+            inside.pop(fence_id, None)
+        self._changed()
+
+    def _changed(self):
+        self._lengths = sorted(length for length in self._index if self._index[length])
+        self._boxes.clear()
+        self._version += 1
+
+    def _lookup(self, code):
+        '''
+        Return (within, partial), the fences containing and crossing the box
+        of a code at the engine precision, through the cache of the boxes
+        '''
+        def compute():
+            within, partial = [], []
+            box = None
+            for length in self._lengths:
+                fences = self._index[length].get(code >> (2 * (self.precision - length)))
+                if not fences:
+                    continue
+                for fence_id, inside in fences.items():
+                    if inside:
+                        within.append(fence_id)
+                        continue
+                    if box is None:
+                        box = self.encoder.code_bounds(code, self.precision)
+                    contains, intersects = self._fences[fence_id][3:]
+                    if contains(*box):
+                        within.append(fence_id)
+                    elif intersects(*box):
+                        partial.append(fence_id)
+            return tuple(within), tuple(partial)
+        return self._boxes.get_or_compute(code, compute)
+
+    def _contains(self, fence_id, latitude, longitude):
+        kind, parameters = self._fences[fence_id][:2]
+        if kind == CIRCLE:
+            lat, lng, radius = parameters
+            return self.encoder.haversine((latitude, longitude), (lat, lng)) <= radius
+        lat_min, lng_min, lat_max, lng_max = parameters
+        if not lat_min <= latitude <= lat_max:
+            return False
+        return _in_lng_range(longitude, longitude, lng_min, lng_max)
+
+    # Vehicles
+    def inside(self, vehicle_id):
+        '''
+        Return the set of the fences a vehicle was inside at its last update
+        '''
+        slot = self._slots.get(vehicle_id)
+        return set() if slot is None else set(self._inside[slot])
+
+    def __len__(self):
+        return len(self._vehicles)
+
+    def _slot(self, vehicle_id):
+        slot = self._slots.get(vehicle_id)
+        if slot is None:
+            slot = self._slots[vehicle_id] = len(self._vehicles)
+            self._vehicles.append(vehicle_id)
+            self._inside.append({})
+            if slot == self._box.size:
+                size = max(2 * slot, 1024)
+                self._box = np.resize(self._box, size)
+                self._checked = np.resize(self._checked, size)
+                self._stable = np.resize(self._stable, size)
+                self._due = np.resize(self._due, size)
+            self._stable[slot] = False
+            self._due[slot] = np.inf
+        return slot
+
+    def update(self, vehicle_ids, latitudes, longitudes, timestamps):
+        '''
+        Apply a batch of position updates, in order, and return the list of
+        the resulting events
+        '''
+        latitudes = np.asarray(latitudes, dtype=np.float64).ravel()
+        longitudes = np.asarray(longitudes, dtype=np.float64).ravel()
+        timestamps = np.asarray(timestamps, dtype=np.float64).ravel()
+        if not len(vehicle_ids) == latitudes.size == longitudes.size == timestamps.size:
+            raise ValueError("vehicle_ids, latitudes, longitudes and timestamps must have the same size")
+        if not latitudes.size:
+            return []
+        slots = np.array([self._slot(v) for v in vehicle_ids], dtype=np.intp)
+        codes = self.encoder.encode_many(latitudes, longitudes, self.precision, codes=True)
+
+        # Same box with no partial fence and no dwell event due: nothing to do.
+        # A vehicle updated more than once in the batch takes the slow path.
+        skip = (self._stable[slots] & (self._box[slots] == codes) & (self._checked[slots] == self._version) &
+                (timestamps < self._due[slots]))
+        _, repeats, counts = np.unique(slots, return_inverse=True, return_counts=True)
+        skip &= counts[repeats] == 1
+        rows = np.flatnonzero(~skip)
+        self.skipped += slots.size - rows.size
+        self.evaluated += rows.size
+
+        events = []
+        for row, slot, code, lat, lng, t in zip(
+                rows.tolist(), slots[rows].tolist(), codes[rows].tolist(),
+                latitudes[rows].tolist(), longitudes[rows].tolist(), timestamps[rows].tolist()):
+            vehicle = vehicle_ids[row]
+            within, partial = self._lookup(code)
+            current = set(within)
+            for fence_id in partial:
+                if self._contains(fence_id, lat, lng):
+                    current.add(fence_id)
+
+            inside = self._inside[slot]
+            for fence_id in [f for f in inside if f not in current]:
+                del inside[fence_id]
+                events.append(Event(vehicle, fence_id, EXIT, t))
+            for fence_id in current:
+                if fence_id not in inside:
+                    inside[fence_id] = [t, False]
+                    events.append(Event(vehicle, fence_id, ENTER, t))
+
+            due = np.inf
+            if self.dwell is not None:
+                for fence_id, stay in inside.items():
+                    if stay[1]:
+                        continue
+                    if t - stay[0] >= self.dwell:
+                        stay[1] = True
+                        events.append(Event(vehicle, fence_id, DWELL, t))
+                    else:
+                        due = min(due, stay[0] + self.dwell)
+            self._box[slot] = code
+            self._checked[slot] = self._version
+            self._stable[slot] = not partial
+            self._due[slot] = due
+        return events
+
+    def process(self, batches):
+        '''
+        Generate the events of an iterable of (vehicle_ids, latitudes,
+        longitudes, timestamps) batches
+        '''
+        for batch in batches:
+            for event in self.update(*batch):
+                yield event
@@ -0,0 +1,102 @@
+'''
+Planar polygon tests on latitude/longitude degrees.
+
+A polygon is a list of (latitude, longitude) vertices, the last one joined
+back to the first, with optional holes of the same form.  Edges are kept
+as (lat1, lng1, lat2, lng2) tuples and points are inside by the even-odd
+rule, so holes need no special handling.  Polygons must not cross the 180
+meridian.
+'''
+from .curve import np
+
+
+def polygon_edges(polygon, holes=()):
+    '''
+    Edges of the polygon and of its holes.  Raise ValueError for a ring of
+    less than 3 vertices.
+    '''
+    edges = []
+    for ring in [polygon] + list(holes):
+        ring = [(float(lat), float(lng)) for lat, lng in ring]
+        if len(ring) > 1 and ring[0] == ring[-1]:
+            ring.pop()
+        if len(ring) < 3:
+            raise ValueError("A polygon ring needs at least 3 vertices")
+        for (lat1, lng1), (lat2, lng2) in zip(ring, ring[1:] + ring[:1]):
+            edges.append((lat1, lng1, lat2, lng2))
+    return edges
+
+
+def contains(edges, latitude, longitude):
+    '''
+    Ray casting test of a point against the edges of a polygon
+    '''
+    inside = False
+    for lat1, lng1, lat2, lng2 in edges:
+        if (lat1 > latitude) != (lat2 > latitude):
+            if longitude < lng1 + (latitude - lat1) * (lng2 - lng1) / (lat2 - lat1):
+                inside = not inside
+    return inside
+
+
+def _orient(lat1, lng1, lat2, lng2, lat, lng):
+    return (lng2 - lng1) * (lat - lat1) - (lat2 - lat1) * (lng - lng1)
+
+
+def crossings(edges, latLngA, latLngB):
+    '''
+    Number of edges crossed by the segment from A to B.  Its parity tells
+    whether A and B are on different sides of the polygon boundary.
+    '''
+    (latA, lngA), (latB, lngB) = latLngA, latLngB
+    count = 0
+    for lat1, lng1, lat2, lng2 in edges:
+        # A vertex on the segment counts as left of it, so that crossing
+        # through a vertex counts once for its two edges
+        if (_orient(latA, lngA, latB, lngB, lat1, lng1) > 0) != (_orient(latA, lngA, latB, lngB, lat2, lng2) > 0):
+            if (_orient(lat1, lng1, lat2, lng2, latA, lngA) > 0) != (_orient(lat1, lng1, lat2, lng2, latB, lngB) > 0):
+                count += 1
+    return count
+
+
+def edge_in_box(edge, latLng_SW, latLng_NE):
+    '''
+    Whether an edge has a point in the closed box (Liang-Barsky clipping)
+    '''
+    lat1, lng1, lat2, lng2 = edge
+    low, high = 0.0, 1.0
+    for delta, start, lower, upper in ((lng2 - lng1, lng1, latLng_SW[1], latLng_NE[1]),
+                                       (lat2 - lat1, lat1, latLng_SW[0], latLng_NE[0])):
+        if delta == 0:
+            if start < lower or start > upper:
+                return False
+            continue
+        t1, t2 = (lower - start) / delta, (upper - start) / delta
+        if t1 > t2:
+            t1, t2 = t2, t1
+        low, high = max(low, t1), min(high, t2)
+        if low > high:
+            return False
+    return True
+
+
+def crossings_many(lat1, lng1, lat2, lng2, latA, lngA, latB, lngB):
+    '''
+    Vectorized test of the edges (lat1, lng1, lat2, lng2) against the
+    segments from A to B, all arrays of the same shape: True where the
+    segment crosses the edge, with the rule of crossings
+    '''
+    return (((_orient(latA, lngA, latB, lngB, lat1, lng1) > 0) != (_orient(latA, lngA, latB, lngB, lat2, lng2) > 0)) &
+            ((_orient(lat1, lng1, lat2, lng2, latA, lngA) > 0) != (_orient(lat1, lng1, lat2, lng2, latB, lngB) > 0)))
+
+
+def contains_many(edges, latitudes, longitudes):
+    '''
+    Vectorized contains of arrays of points
+    '''
+    inside = np.zeros(np.shape(latitudes), dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for lat1, lng1, lat2, lng2 in edges:
+            across = (lat1 > latitudes) != (lat2 > latitudes)
+            inside ^= across & (longitudes < lng1 + (latitudes - lat1) * (lng2 - lng1) / (lat2 - lat1))
+    return inside
@@ -0,0 +1,196 @@
+'''
+In memory spatial index of points keyed by geobox code.
+
+Points are kept as a sorted uint64 array of integer codes at MAX_PRECISION,
+with the latitude, longitude and id of each point in parallel arrays.  All
+the points of a geobox_id prefix are then a contiguous slice found with two
+binary searches, so a radius query is a handful of slices followed by a
+vectorized haversine on the candidates.
+'''
+from . import GeoBoxEncoder
+from .curve import np, require_numpy
+
+
+class GeoIndex(object):
+    '''
+    Sorted geobox code index supporting bulk load, insert, delete, radius and
+    k nearest neighbors queries.
+    '''
+    PRECISION = GeoBoxEncoder.MAX_PRECISION
+    # Rings of neighbor boxes searched by k_nearest before falling back to a
+    # radius query
+    MAX_RINGS = 3
+
+    def __init__(self, latitudes=None, longitudes=None, ids=None, encoder=GeoBoxEncoder):
+        require_numpy()
+        self.encoder = encoder
+        self._codes = np.empty(0, dtype=np.uint64)
+        self._lat = np.empty(0, dtype=np.float64)
+        self._lng = np.empty(0, dtype=np.float64)
+        self._ids = np.empty(0, dtype=np.int64)
+        # Single inserts are buffered and merged on the next query
+        self._pending = []
+
+        if latitudes is not None:
+            self.load(latitudes, longitudes, ids)
+
+    def __len__(self):
+        return self._codes.size + len(self._pending)
+
+    # Loading
+    def load(self, latitudes, longitudes, ids=None):
+        '''
+        Bulk add points.  ids defaults to the position of each point in the
+        index, counting the points already loaded.
+        '''
+        self._flush()
+        latitudes = np.asarray(latitudes, dtype=np.float64).ravel()
+        longitudes = np.asarray(longitudes, dtype=np.float64).ravel()
+        if ids is None:
+            ids = np.arange(self._codes.size, self._codes.size + latitudes.size, dtype=np.int64)
+        else:
+            ids = np.asarray(ids).ravel()
+        if not latitudes.size == longitudes.size == ids.size:
+            raise ValueError("latitudes, longitudes and ids must have the same size")
+
+        codes = self.encoder.encode_many(latitudes, longitudes, self.PRECISION, codes=True)
+        if self._codes.size:
+            codes = np.concatenate((self._codes, codes))
+            latitudes = np.concatenate((self._lat, latitudes))
+            longitudes = np.concatenate((self._lng, longitudes))
+            ids = np.concatenate((self._ids, ids))
+
+        order = np.argsort(codes, kind='mergesort')
+        self._codes = codes[order]
+        self._lat = latitudes[order]
+        self._lng = longitudes[order]
+        self._ids = ids[order]
+
+    def insert(self, latitude, longitude, id):
+        self._pending.append((latitude, longitude, id))
+
+    def delete(self, ids):
+        '''
+        Remove every point with one of the given ids, returning how many were removed
+        '''
+        self._flush()
+        keep = ~np.isin(self._ids, np.atleast_1d(np.asarray(ids)))
+        removed = self._codes.size - int(keep.sum())
+        if removed:
+            self._codes = self._codes[keep]
+            self._lat = self._lat[keep]
+            self._lng = self._lng[keep]
+            self._ids = self._ids[keep]
+        return removed
+
+    def _flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, []
+            latitudes, longitudes, ids = zip(*pending)
+            self.load(latitudes, longitudes, np.asarray(ids))
+
+    # Queries
+    def prefix_slice(self, prefix):
+        '''
+        Return the slice of the sorted columns holding the points whose
+        geobox_id starts with prefix
+        '''
+        self._flush()
+        lowest, highest = self.encoder.prefix_range(prefix, self.PRECISION)
+        return slice(
+            int(np.searchsorted(self._codes, np.uint64(lowest), 'left')),
+            int(np.searchsorted(self._codes, np.uint64(highest), 'right')))
+
+    def within_radius(self, latitude, longitude, radius, max_cells=16, sort=True):
+        '''
+        Return (ids, distances) of the points within radius meter, sorted by
+        distance unless sort is False
+        '''
+        self._flush()
+        prefixes = self.encoder.cover_circle(latitude, longitude, radius, max_cells, self.PRECISION)
+        candidates = self._candidates(prefixes)
+        distances = self.encoder.haversine_many(
+            (latitude, longitude), self._lat[candidates], self._lng[candidates])
+
+        keep = distances <= radius
+        candidates, distances = candidates[keep], distances[keep]
+        if sort:
+            order = np.argsort(distances, kind='mergesort')
+            candidates, distances = candidates[order], distances[order]
+        return self._ids[candidates], distances
+
+    def k_nearest(self, latitude, longitude, k):
+        '''
+        Return (ids, distances) of the k points nearest to latitude/longitude,
+        sorted by distance.
+
+        The search starts at the finest precision whose box around the point
+        holds at least k points and widens rings of neighbor boxes until no
+        box outside of the rings can be nearer than the k-th candidate.
+        '''
+        self._flush()
+        k = min(k, self._codes.size)
+        if k <= 0:
+            return self._ids[:0], np.empty(0)
+
+        encoder = self.encoder
+        code = encoder.encode_int(latitude, longitude, self.PRECISION)
+        precision = 1
+        while precision < self.PRECISION and self._count(code, precision + 1) >= k:
+            precision += 1
+
+        latLng = (latitude, longitude)
+        lng_cell, lat_cell = encoder.cell_indices(code >> (2 * (self.PRECISION - precision)), precision)
+        searched = set()
+        candidates = np.empty(0, dtype=np.intp)
+        for ring in range(1, self.MAX_RINGS + 1):
+            cells = self._block(lng_cell, lat_cell, ring, precision) - searched
+            searched |= cells
+            prefixes = [encoder.code_to_id(c, precision) for c in cells]
+            candidates = np.concatenate((candidates, self._candidates(prefixes)))
+
+            distances = encoder.haversine_many(latLng, self._lat[candidates], self._lng[candidates])
+            if distances.size < k:
+                continue
+            kth = np.partition(distances, k - 1)[k - 1]
+            outside = self._block(lng_cell, lat_cell, ring + 1, precision) - searched
+            if not outside or kth <= min(encoder.box_distance(latLng, *encoder.code_bounds(c, precision)) for c in outside):
+                return self._nearest(candidates, distances, k)
+
+        # Still possible to have nearer points outside of the rings: the k
+        # nearest are all within the k-th distance found so far
+        ids, distances = self.within_radius(latitude, longitude, kth)
+        return ids[:k], distances[:k]
+
+    def _count(self, code, precision):
+        shift = 2 * (self.PRECISION - precision)
+        lowest = (code >> shift) << shift
+        highest = lowest + (1 << shift) - 1
+        return int(np.searchsorted(self._codes, np.uint64(highest), 'right') -
+                   np.searchsorted(self._codes, np.uint64(lowest), 'left'))
+
+    def _block(self, lng_cell, lat_cell, ring, precision):
+        '''
+        Codes of the boxes at most ring boxes away from the given box
+        '''
+        lng_cells, lat_cells = self.encoder.grid_size(precision)
+        cells = set()
+        for lat in range(max(lat_cell - ring, 0), min(lat_cell + ring, lat_cells - 1) + 1):
+            for lng in range(lng_cell - ring, lng_cell + ring + 1):
+                cells.add(self.encoder.cell_code(lng % lng_cells, lat, precision))
+        return cells
+
+    def _candidates(self, prefixes):
+        '''
+        Positions in the sorted columns of the points matching any of the prefixes
+        '''
+        ranges = [self.encoder.prefix_range(p, self.PRECISION) for p in prefixes]
+        if not ranges:
+            return np.empty(0, dtype=np.intp)
+        starts = np.searchsorted(self._codes, np.array([r[0] for r in ranges], dtype=np.uint64), 'left')
+        stops = np.searchsorted(self._codes, np.array([r[1] for r in ranges], dtype=np.uint64), 'right')
+        return np.concatenate([np.arange(a, b, dtype=np.intp) for a, b in zip(starts, stops)])
+
+    def _nearest(self, candidates, distances, k):
+        order = np.argsort(distances, kind='mergesort')[:k]
+        return self._ids[candidates[order]], distances[order]
@@ -0,0 +1,233 @@
+'''
+Parallel radius join between two sets of points.
+
+Both sets are sorted by geobox code at a precision whose boxes are at least
+as tall as the radius.  Every box holding left points is paired with the
+halo of right boxes that can hold a point within the radius: its neighbors,
+widened in longitude towards the poles where boxes get narrow, and every
+box of the latitude band around a pole.  Each pair of boxes is a block of
+left rows against right rows, refined with a vectorized haversine.
+
+Runs of left boxes are the tasks of a process pool, each refining its blocks
+a bounded number of pairs at a time.  The sorted columns are put once in
+shared memory, so a task only sends the codes and row ranges of its boxes.
+'''
+import ctypes
+import multiprocessing
+from math import ceil, degrees, radians, sin
+from multiprocessing.sharedctypes import RawArray
+
+from . import GeoBoxEncoder, central_angle
+from .curve import deinterleave_many, interleave_many, np, require_numpy
+
+# Candidate pairs refined at once, which bounds the memory of a task
+MAX_PAIRS = 1 << 20
+# Left points of a task
+TASK_POINTS = 1 << 14
+
+# Sorted columns and options of the join of a pool worker
+_columns = {}
+
+_CTYPES = {'float64': ctypes.c_double, 'uint64': ctypes.c_uint64}
+
+
+def join_precision(radius, encoder=GeoBoxEncoder):
+    '''
+    Finest precision whose boxes are at least radius meter tall
+    '''
+    precision = 1
+    while precision < encoder.MAX_PRECISION and radians(180.0 / (1 << precision)) * encoder.EARTH_RADIUS >= radius:
+        precision += 1
+    return precision
+
+
+def _shared(values):
+    '''
+    Copy of an array in shared memory
+    '''
+    shared = RawArray(_CTYPES[values.dtype.name], max(values.size, 1))
+    np.frombuffer(shared, dtype=values.dtype)[:values.size] = values
+    return shared
+
+
+def _init_worker(shared, layout, options):
+    columns = dict((name, np.frombuffer(shared[name], dtype=dtype)[:size])
+                   for name, (dtype, size) in layout.items())
+    _columns.clear()
+    _columns.update(columns, **options)
+
+
+def _join_task(task, columns=None):
+    '''
+    Return (left rows, right rows, distances) of the pairs within the radius
+    of a run of left boxes, rows being positions in the sorted columns.
+    columns defaults to those of the pool worker.
+    '''
+    if columns is None:
+        columns = _columns
+    cells, left_start, left_count = task
+    radius, encoder = columns['radius'], columns['encoder']
+    right_codes = columns['right_codes']
+
+    # Pair every box with the right points of its halo
+    owners, halo = _halo(cells, radius, columns['precision'], encoder)
+    right_start = np.searchsorted(right_codes, halo, 'left')
+    right_count = np.searchsorted(right_codes, halo, 'right') - right_start
+    found = right_count > 0
+    owner = np.searchsorted(cells, owners[found])
+    blocks = (left_start[owner], left_count[owner], right_start[found], right_count[found])
+
+    results = []
+    for left_start, left_count, right_start, right_count in _split(blocks, columns['max_pairs']):
+        pairs = left_count * right_count
+        block = np.repeat(np.arange(pairs.size), pairs)
+        offset = np.arange(pairs.sum()) - np.repeat(np.cumsum(pairs) - pairs, pairs)
+        left = left_start[block] + offset // right_count[block]
+        right = right_start[block] + offset % right_count[block]
+
+        distances = central_angle(
+            columns['left_lat'][left], columns['left_lng'][left],
+            columns['right_lat'][right], columns['right_lng'][right],
+            sin=np.sin, cos=np.cos, asin=np.arcsin, sqrt=np.sqrt)
+        distances *= encoder.EARTH_RADIUS
+        keep = distances <= radius
+        results.append((left[keep], right[keep], distances[keep]))
+    if not results:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+    return tuple(np.concatenate(column) for column in zip(*results))
+
+
+def _halo(codes, radius, precision, encoder):
+    '''
+    Return (cells, halos): for every box code, the codes of the boxes that
+    may hold a point within radius of a point of the box
+    '''
+    bits = max(precision - 1, 0)
+    lng_cells, lat_cells = encoder.grid_size(precision)
+    unit = 180.0 / (1 << bits)
+    angle = radius / float(encoder.EARTH_RADIUS)
+    lat_rings = int(ceil(degrees(angle) / unit))
+
+    lng_index, lat_index = deinterleave_many(codes & np.uint64((1 << (2 * bits)) - 1))
+    lng_cell = (((codes >> np.uint64(2 * bits)) << np.uint64(bits)) | lng_index).astype(np.int64)
+    lat_cell = lat_index.astype(np.int64)
+
+    # Widest longitude span of a circle centered in the box, which depends
+    # on the box latitude nearest to a pole
+    latitude = np.maximum(np.abs(-90.0 + lat_cell * unit), np.abs(-90.0 + (lat_cell + 1) * unit))
+    lng_rings = np.full(codes.size, lng_cells, dtype=np.int64)
+    reach = np.radians(latitude) + angle < np.pi / 2
+    if reach.any():
+        span = np.degrees(np.arcsin(min(sin(angle), 1.0) / np.cos(np.radians(latitude[reach]))))
+        lng_rings[reach] = np.ceil(span / unit + 1e-9)
+
+    cells, halos = [], []
+    for rings in np.unique(lng_rings):
+        rows = lng_rings == rings
+        if 2 * rings + 1 >= lng_cells:
+            lng_offsets = np.arange(lng_cells)
+        else:
+            lng_offsets = np.arange(-rings, rings + 1)
+        lat_offsets = np.arange(-lat_rings, lat_rings + 1)
+        lat = (lat_cell[rows, np.newaxis, np.newaxis] + lat_offsets[:, np.newaxis]).repeat(lng_offsets.size, 2)
+        lng = (lng_cell[rows, np.newaxis, np.newaxis] + lng_offsets) % lng_cells
+        lng = np.broadcast_to(lng, lat.shape)
+        valid = (lat >= 0) & (lat < lat_cells)
+        lat, lng = lat[valid].astype(np.uint64), lng[valid].astype(np.uint64)
+        halo = ((lng >> np.uint64(bits)) << np.uint64(2 * bits)) | interleave_many(lng & np.uint64((1 << bits) - 1), lat)
+        cells.append(np.repeat(codes[rows], valid.reshape(valid.shape[0], -1).sum(axis=1)))
+        halos.append(halo)
+    return np.concatenate(cells), np.concatenate(halos)
+
+
+def _split(blocks, max_pairs):
+    '''
+    Split the (left start, left count, right start, right count) blocks into
+    runs of about max_pairs candidate pairs
+    '''
+    left_start, left_count, right_start, right_count = blocks
+    # Blocks too large for a task are cut into runs of left rows
+    rows = np.maximum(max_pairs // right_count, 1)
+    pieces = -(-left_count // rows)
+    if (pieces > 1).any():
+        block = np.repeat(np.arange(left_count.size), pieces)
+        piece = np.arange(block.size) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        start = piece * rows[block]
+        left_start = left_start[block] + start
+        left_count = np.minimum(left_count[block] - start, rows[block])
+        right_start, right_count = right_start[block], right_count[block]
+
+    total = np.cumsum(left_count * right_count)
+    bounds = np.searchsorted(total, np.arange(max_pairs, total[-1], max_pairs), 'right') if total.size else []
+    bounds = [0] + [int(b) for b in bounds] + [total.size]
+    for start, stop in zip(bounds, bounds[1:]):
+        if stop > start:
+            yield (left_start[start:stop], left_count[start:stop], right_start[start:stop], right_count[start:stop])
+
+
+def spatial_join(left_latitudes, left_longitudes, right_latitudes, right_longitudes, radius,
+                 processes=None, precision=None, max_pairs=MAX_PAIRS, encoder=GeoBoxEncoder):
+    '''
+    Yield (left_idx, right_idx, distance) array chunks of every pair of a
+    left and a right point at most radius meter apart.  Indices are the
+    positions in the input arrays.
+
+    processes defaults to the number of CPUs; with 1 the tasks are run in
+    this process.  precision defaults to join_precision(radius).
+    '''
+    require_numpy()
+    left_lat = np.asarray(left_latitudes, dtype=np.float64).ravel()
+    left_lng = np.asarray(left_longitudes, dtype=np.float64).ravel()
+    right_lat = np.asarray(right_latitudes, dtype=np.float64).ravel()
+    right_lng = np.asarray(right_longitudes, dtype=np.float64).ravel()
+    if left_lat.size != left_lng.size or right_lat.size != right_lng.size:
+        raise ValueError("latitudes and longitudes must have the same size")
+    if radius < 0:
+        raise ValueError("radius must be positive")
+    if not left_lat.size or not right_lat.size:
+        return
+    if precision is None:
+        precision = join_precision(radius, encoder)
+
+    left_codes = encoder.encode_many(left_lat, left_lng, precision, codes=True)
+    right_codes = encoder.encode_many(right_lat, right_lng, precision, codes=True)
+    left_order = np.argsort(left_codes, kind='mergesort')
+    right_order = np.argsort(right_codes, kind='mergesort')
+
+    # A task is a run of boxes of left points, cut at about TASK_POINTS
+    # points, or less to give every process a few tasks
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    cells, left_start, left_count = np.unique(left_codes[left_order], return_index=True, return_counts=True)
+    task_points = max(min(TASK_POINTS, left_lat.size // (4 * processes)), 1)
+    total = np.cumsum(left_count)
+    bounds = [0] + np.searchsorted(total, np.arange(task_points, total[-1], task_points), 'right').tolist()
+    bounds = sorted(set(bounds + [cells.size]))
+    tasks = [(cells[a:b], left_start[a:b], left_count[a:b]) for a, b in zip(bounds, bounds[1:])]
+
+    columns = {
+        'left_lat': np.radians(left_lat[left_order]), 'left_lng': np.radians(left_lng[left_order]),
+        'right_lat': np.radians(right_lat[right_order]), 'right_lng': np.radians(right_lng[right_order]),
+        'right_codes': right_codes[right_order],
+    }
+    options = {'radius': radius, 'precision': precision, 'max_pairs': max_pairs, 'encoder': encoder}
+    processes = min(processes, len(tasks))
+
+    if processes <= 1:
+        # Columns of this join only, another one may run in the same process
+        columns.update(options)
+        results = (_join_task(task, columns) for task in tasks)
+        pool = None
+    else:
+        shared = dict((name, _shared(values)) for name, values in columns.items())
+        layout = dict((name, (values.dtype.name, values.size)) for name, values in columns.items())
+        pool = multiprocessing.Pool(processes, _init_worker, (shared, layout, options))
+        results = pool.imap(_join_task, tasks)
+    try:
+        for left, right, distances in results:
+            if distances.size:
+                yield left_order[left], right_order[right], distances
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,111 @@
+'''
+Opt-in call counters and latency histograms for the geobox hot paths.
+
+GeoBoxEncoder.encode, decode, neighbors and haversine, and the box building
+of GeoPoint, report each call to GeoBoxEncoder.metrics when it is set.  It
+is off by default.  enable_metrics swaps timed versions of the encoder
+methods onto the class and disable_metrics puts the plain ones back, so
+they cost nothing while metrics are off; GeoPoint tests one attribute:
+
+    >>> from geobox import GeoBoxEncoder, enable_metrics, disable_metrics
+    >>> metrics = enable_metrics()
+    >>> geobox_id = GeoBoxEncoder.encode(51.48, 0.0)
+    >>> metrics.snapshot()['encode']['count']
+    1
+    >>> disable_metrics()
+
+The snapshot is a plain dict, ready to be logged or served as JSON.  To
+feed another metrics system, pass a sink: it is called with the operation
+name and its duration in seconds after every call.
+
+    def sink(name, seconds):
+        statsd.timing('geobox.' + name, seconds * 1000)
+
+    enable_metrics(sink)
+
+The operations are 'encode', 'decode', 'neighbors', 'distance' and
+'build_box'.  Nested calls are counted too: the distances computed by
+cover_circle show up under 'distance'.
+'''
+import threading
+from bisect import bisect_left
+from timeit import default_timer
+
+# Upper bounds, in micro seconds, of the histogram buckets.  A last bucket
+# holds the slower calls.
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 100000)
+
+
+class Metrics(object):
+    '''
+    Thread safe call counters and latency histograms by operation name
+    '''
+    def __init__(self, sink=None, buckets=BUCKETS):
+        self.sink = sink
+        self.buckets = tuple(buckets)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def call(self, name, func, *args):
+        '''
+        Return func(*args), recording its duration under name
+        '''
+        start = default_timer()
+        try:
+            return func(*args)
+        finally:
+            self.record(name, default_timer() - start)
+
+    def record(self, name, seconds):
+        bucket = bisect_left(self.buckets, seconds * 1e6)
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                # count, total, max, histogram
+                stats = self._stats[name] = [0, 0.0, 0.0, [0] * (len(self.buckets) + 1)]
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+            stats[3][bucket] += 1
+        if self.sink is not None:
+            self.sink(name, seconds)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def _quantile(self, count, histogram, q):
+        '''
+        Upper bound in micro seconds of the bucket holding the q quantile,
+        None when it is the last, unbounded, bucket
+        '''
+        rank = q * count
+        seen = 0
+        for bound, hits in zip(self.buckets, histogram):
+            seen += hits
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self):
+        '''
+        Dict of the statistics of each operation: count, total, mean and max
+        duration in seconds, p50 and p99 as histogram bucket bounds in micro
+        seconds, and the histogram as [upper bound, count] pairs, the last
+        bound being None
+        '''
+        with self._lock:
+            stats = dict((name, (s[0], s[1], s[2], list(s[3]))) for name, s in self._stats.items())
+        result = {}
+        for name, (count, total, slowest, histogram) in stats.items():
+            result[name] = {
+                'count': count,
+                'total': total,
+                'mean': total / count,
+                'max': slowest,
+                'p50': self._quantile(count, histogram, 0.5),
+                'p99': self._quantile(count, histogram, 0.99),
+                'histogram': [[bound, hits] for bound, hits in zip(self.buckets + (None,), histogram)],
+            }
+        return result
@@ -0,0 +1,217 @@
+'''
+Columnar storage of many points.
+
+A GeoPoint is a Python object of its own, with its geobox_id string and its
+box bounds, which adds up to a few hundred bytes per point.  GeoPointArray
+keeps the same information as four contiguous NumPy columns: latitude and
+longitude as float64, the uint64 integer code and the uint8 precision, that
+is 25 bytes per point.  GeoPoint objects are only created when a single row
+is read, and the geobox_ids, distances, neighbors and box bounds of all the
+points are computed at once by the vectorized encoder methods.
+'''
+from . import GeoBoxEncoder, GeoPoint
+from .curve import np, require_numpy
+
+
+class GeoPointArray(object):
+    '''
+    Array of points stored as latitude, longitude, code and precision columns.
+    Indexing with an integer returns a GeoPoint, indexing with a slice, a
+    boolean mask or an array of positions returns a GeoPointArray.
+    '''
+    def __init__(self, latitudes, longitudes, codes, precisions, encoder=GeoBoxEncoder):
+        require_numpy()
+        self.encoder = encoder
+        self._lat = np.asarray(latitudes, dtype=np.float64).ravel()
+        self._lng = np.asarray(longitudes, dtype=np.float64).ravel()
+        self._codes = np.asarray(codes, dtype=np.uint64).ravel()
+        self._precision = np.asarray(precisions, dtype=np.uint8).ravel()
+        if self._precision.size == 1 and self._lat.size != 1:
+            self._precision = np.full(self._lat.size, self._precision[0], dtype=np.uint8)
+        if not self._lat.size == self._lng.size == self._codes.size == self._precision.size:
+            raise ValueError("latitudes, longitudes, codes and precisions must have the same size")
+
+    # Construction
+    @classmethod
+    def from_coordinates(cls, latitudes, longitudes, precision=None, encoder=GeoBoxEncoder):
+        '''
+        Encode arrays of latitudes and longitudes at the given precision
+        '''
+        require_numpy()
+        if precision is None:
+            precision = encoder.DEFAULT_PRECISION
+        latitudes, longitudes = np.broadcast_arrays(
+            np.asarray(latitudes, dtype=np.float64).ravel(),
+            np.asarray(longitudes, dtype=np.float64).ravel())
+        codes = encoder.encode_many(latitudes, longitudes, precision, codes=True)
+        return cls(latitudes, longitudes, codes, precision, encoder)
+
+    @classmethod
+    def from_ids(cls, geobox_ids, precision=None, encoder=GeoBoxEncoder):
+        '''
+        Points at the center of an array of geobox_ids, which may have
+        different lengths, or of integer codes in which case precision must
+        be given
+        '''
+        require_numpy()
+        geobox_ids = np.asarray(geobox_ids).ravel()
+        if geobox_ids.dtype.kind in 'iu':
+            if precision is None:
+                raise ValueError("precision is required for integer codes")
+            codes = geobox_ids.astype(np.uint64)
+            latitudes, longitudes = encoder.decode_many(codes, precision)
+            return cls(latitudes, longitudes, codes, precision, encoder)
+
+        if geobox_ids.dtype.kind == 'U':
+            geobox_ids = geobox_ids.astype('S')
+        elif geobox_ids.dtype.kind == 'O':
+            geobox_ids = geobox_ids.astype('S') if geobox_ids.size else geobox_ids.astype('S1')
+        lengths = np.char.str_len(geobox_ids)
+        codes = np.empty(geobox_ids.size, dtype=np.uint64)
+        for length in np.unique(lengths):
+            if not length:
+                raise ValueError("geobox_ids can not be empty")
+            rows = lengths == length
+            codes[rows] = encoder.ids_to_codes(geobox_ids[rows].astype('S%d' % length))
+        array = cls(np.empty(codes.size), np.empty(codes.size), codes, lengths, encoder)
+        for precision, rows in array._groups():
+            array._lat[rows], array._lng[rows] = encoder.decode_many(codes[rows], precision)
+        return array
+
+    @classmethod
+    def concatenate(cls, arrays):
+        arrays = list(arrays)
+        if not arrays:
+            return cls(np.empty(0), np.empty(0), np.empty(0), np.empty(0))
+        return cls(
+            np.concatenate([a._lat for a in arrays]),
+            np.concatenate([a._lng for a in arrays]),
+            np.concatenate([a._codes for a in arrays]),
+            np.concatenate([a._precision for a in arrays]),
+            arrays[0].encoder)
+
+    # Rows
+    def __len__(self):
+        return self._codes.size
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            position = range(self._codes.size)[index]
+            return GeoPoint._from_code(
+                float(self._lat[position]), float(self._lng[position]),
+                int(self._codes[position]), int(self._precision[position]), build_box=True)
+        if isinstance(index, slice):
+            # Basic slicing: the result shares the columns
+            return self.__class__(
+                self._lat[index], self._lng[index], self._codes[index], self._precision[index], self.encoder)
+        index = np.asarray(index)
+        if index.dtype != bool and index.dtype.kind not in 'iu':
+            raise TypeError("GeoPointArray indices must be integers, slices, boolean masks or integer arrays")
+        return self.__class__(
+            self._lat[index], self._lng[index], self._codes[index], self._precision[index], self.encoder)
+
+    def __iter__(self):
+        for position in range(self._codes.size):
+            yield self[position]
+
+    def __repr__(self):
+        return '%s(%d points)' % (self.__class__.__name__, self._codes.size)
+
+    # Columns
+    @property
+    def latitudes(self):
+        return self._lat
+
+    @property
+    def longitudes(self):
+        return self._lng
+
+    @property
+    def codes(self):
+        return self._codes
+
+    @property
+    def precisions(self):
+        return self._precision
+
+    @property
+    def nbytes(self):
+        return self._lat.nbytes + self._lng.nbytes + self._codes.nbytes + self._precision.nbytes
+
+    def _groups(self):
+        '''
+        Yield (precision, rows) for every precision of the array, rows being a
+        slice of all the points when they share a single precision
+        '''
+        if not self._precision.size:
+            return
+        first = self._precision[0]
+        if (self._precision == first).all():
+            yield int(first), slice(None)
+            return
+        for precision in np.unique(self._precision):
+            yield int(precision), self._precision == precision
+
+    # Vectorized methods
+    def gcode(self):
+        '''
+        Fixed width 'S' array of the geobox_ids, shorter ids being null padded
+        '''
+        width = int(self._precision.max()) if self._precision.size else 1
+        result = np.zeros(self._codes.size, dtype='S%d' % width)
+        for precision, rows in self._groups():
+            result[rows] = self.encoder.codes_to_ids(self._codes[rows], precision)
+        return result
+
+    def distance_from(self, geopoint):
+        '''
+        Distance in meter from a GeoPoint, or a (latitude, longitude) pair, to
+        every point
+        '''
+        latLng = geopoint.latlng if isinstance(geopoint, GeoPoint) else geopoint
+        return self.encoder.haversine_many(latLng, self._lat, self._lng)
+
+    def neighbors(self, codes=False):
+        '''
+        (points, 8) array of the neighbor boxes of every point, in the order of
+        GeoBoxEncoder.NEIGHBORS.  Neighbors beyond a pole are empty strings, or
+        NO_CODE when codes is True.
+        '''
+        if codes:
+            result = np.empty((self._codes.size, 8), dtype=np.uint64)
+        else:
+            result = np.zeros((self._codes.size, 8), dtype=self.gcode().dtype)
+        for precision, rows in self._groups():
+            result[rows] = self.encoder.neighbors_many(self._codes[rows], precision, codes)
+        return result
+
+    def bounds(self):
+        '''
+        Return the ((lat_min, lng_min), (lat_max, lng_max)) arrays of the box of
+        every point
+        '''
+        lat_min, lng_min, lat_max, lng_max = (np.empty(self._codes.size) for _ in range(4))
+        for precision, rows in self._groups():
+            latLng_SW, latLng_NE = self.encoder.codes_bounds(self._codes[rows], precision)
+            lat_min[rows], lng_min[rows] = latLng_SW
+            lat_max[rows], lng_max[rows] = latLng_NE
+        return (lat_min, lng_min), (lat_max, lng_max)
+
+    # Ordering
+    def argsort(self):
+        '''
+        Positions ordering the points by code, so that a box is followed by
+        the boxes it contains.  Sorting is stable.
+        '''
+        shift = (2 * (self.encoder.MAX_PRECISION - self._precision.astype(np.int64))).astype(np.uint64)
+        return np.lexsort((self._precision, self._codes << shift))
+
+    def sort(self):
+        '''
+        Sort the points by code in place
+        '''
+        order = self.argsort()
+        self._lat = self._lat[order]
+        self._lng = self._lng[order]
+        self._codes = self._codes[order]
+        self._precision = self._precision[order]
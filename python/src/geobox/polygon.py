@@ -0,0 +1,119 @@
+'''
+Point in polygon tests through a geobox covering of the polygon.
+
+The polygon is covered once with GeoBoxEncoder.cover_polygon.  A point in
+an interior box is inside, a point in no box is outside, and only a point
+in a boundary box needs a geometric test.  That test only looks at the
+edges crossing its box: the point is inside when the segment to the box
+center, whose side is known, crosses an even number of them (odd when the
+center is outside).
+'''
+from bisect import bisect_right
+
+from . import GeoBoxEncoder, geometry
+from .curve import np, require_numpy
+
+INTERIOR, BOUNDARY = 0, 1
+
+
+class PolygonIndex(object):
+    '''
+    Polygon, with optional holes, answering point in polygon queries with a
+    lookup of the code of the point among the code ranges of its covering
+    '''
+    def __init__(self, polygon, holes=(), max_precision=None, max_cells=256, encoder=GeoBoxEncoder):
+        self.encoder = encoder
+        self.edges = geometry.polygon_edges(polygon, holes)
+        interior, boundary = encoder._cover_polygon(self.edges, max_precision, max_cells)
+        self.interior = sorted(interior)
+        self.boundary = sorted(boundary)
+        # Point codes are looked up at the precision of the finest box
+        self.precision = max(len(c) for c in self.interior + self.boundary) if boundary or interior else 1
+
+        ranges = [(encoder.prefix_range(c, self.precision), INTERIOR, None) for c in self.interior]
+        ranges += [(encoder.prefix_range(c, self.precision), BOUNDARY, c) for c in self.boundary]
+        ranges.sort()
+        self._starts = [r[0][0] for r in ranges]
+        self._stops = [r[0][1] for r in ranges]
+        self._kinds = [r[1] for r in ranges]
+        # Boundary boxes: edges crossing them, their center and its side
+        self._cells = {}
+        for cell in self.boundary:
+            crossing, inside = boundary[cell]
+            latLng_SW, latLng_NE = encoder.decode(cell, box=True)[1:]
+            center = ((latLng_SW[0] + latLng_NE[0]) / 2, (latLng_SW[1] + latLng_NE[1]) / 2)
+            self._cells[cell] = (crossing, center, inside)
+        self._boxes = [r[2] for r in ranges]
+        self._arrays = None
+
+    def __contains__(self, latLng):
+        return self.contains(*latLng)
+
+    def contains(self, latitude, longitude):
+        '''
+        Whether the point is inside the polygon and outside of its holes
+        '''
+        code = self.encoder.encode_int(latitude, longitude, self.precision)
+        position = bisect_right(self._starts, code) - 1
+        if position < 0 or code > self._stops[position]:
+            return False
+        if self._kinds[position] == INTERIOR:
+            return True
+        crossing, center, inside = self._cells[self._boxes[position]]
+        return inside != (geometry.crossings(crossing, (latitude, longitude), center) % 2 == 1)
+
+    def _batch_arrays(self):
+        '''
+        Ranges and boundary box edges as arrays for contains_many, built once
+        '''
+        if self._arrays is None:
+            cells = [self._cells[c] for c in self._boxes if c is not None]
+            counts = np.array([len(crossing) for crossing, _, _ in cells], dtype=np.intp)
+            edges = np.array([e for crossing, _, _ in cells for e in crossing], dtype=np.float64).reshape(-1, 4)
+            # Position of each range among the boundary boxes, -1 for interior ones
+            box = np.cumsum(np.array(self._kinds, dtype=np.intp)) - 1
+            self._arrays = {
+                'starts': np.array(self._starts, dtype=np.uint64),
+                'stops': np.array(self._stops, dtype=np.uint64),
+                'box': np.where(np.array(self._kinds) == BOUNDARY, box, -1),
+                'counts': counts,
+                'offsets': np.cumsum(counts) - counts,
+                'edges': edges,
+                'centers': np.array([center for _, center, _ in cells], dtype=np.float64).reshape(-1, 2),
+                'inside': np.array([inside for _, _, inside in cells], dtype=bool),
+            }
+        return self._arrays
+
+    def contains_many(self, latitudes, longitudes):
+        '''
+        Vectorized contains, returning a boolean array
+        '''
+        require_numpy()
+        latitudes, longitudes = np.broadcast_arrays(
+            np.asarray(latitudes, dtype=np.float64), np.asarray(longitudes, dtype=np.float64))
+        shape = latitudes.shape
+        latitudes, longitudes = latitudes.ravel(), longitudes.ravel()
+        result = np.zeros(latitudes.size, dtype=bool)
+        if not self._starts:
+            return result.reshape(shape)
+        a = self._batch_arrays()
+        codes = self.encoder.encode_many(latitudes, longitudes, self.precision, codes=True)
+        position = np.searchsorted(a['starts'], codes, 'right') - 1
+        found = (position >= 0) & (codes <= a['stops'][np.maximum(position, 0)])
+        box = np.where(found, a['box'][np.maximum(position, 0)], -1)
+        result[found & (box < 0)] = True
+
+        # Boundary points: each against the edges of its box
+        points = np.flatnonzero(box >= 0)
+        box = box[points]
+        counts = a['counts'][box]
+        point = np.repeat(np.arange(points.size), counts)
+        edge = np.repeat(a['offsets'][box], counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        lat, lng = latitudes[points][point], longitudes[points][point]
+        center = a['centers'][box][point]
+        edges = a['edges'][edge]
+        crossed = geometry.crossings_many(
+            edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3], lat, lng, center[:, 0], center[:, 1])
+        odd = np.bincount(point, weights=crossed, minlength=points.size).astype(np.intp) % 2 == 1
+        result[points] = a['inside'][box] != odd
+        return result.reshape(shape)
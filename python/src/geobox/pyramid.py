@@ -0,0 +1,200 @@
+'''
+Multi resolution aggregates of points by geobox.
+
+A geobox_id is a prefix of the geobox_ids of the same point at finer
+precisions, and the integer code of a box at precision p is the code at
+precision p + k shifted right by 2k bits.  CellPyramid encodes every point
+once, at its finest level, aggregates the batch there and rolls the
+aggregates up level by level: count, sum, min and max of a value per box.
+
+Each level is a table of sorted box codes with one column per aggregate.
+Batches are merged into the tables, and two pyramids built by parallel
+workers merge the same way.  Levels finer than exact_precision can be
+capped to their max_cells most populated boxes.  A cap adds the largest
+count it drops to the error of the level, which bounds the count a box is
+missing from the level over all the times it was dropped.  The error only
+grows, by at most the smallest count kept at each cap, and never beyond the
+number of points dropped by the caps.
+'''
+from collections import namedtuple
+
+from . import GeoBoxEncoder
+from .curve import np, require_numpy
+
+# Aggregates of the boxes of a level, sorted by code
+Level = namedtuple('Level', 'codes count sum min max')
+
+
+def _reduce(codes, count, total, low, high):
+    '''
+    Aggregate the rows sharing a code into a Level
+    '''
+    order = np.argsort(codes, kind='mergesort')
+    codes, count, total, low, high = codes[order], count[order], total[order], low[order], high[order]
+    if not codes.size:
+        return Level(codes, count, total, low, high)
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+    return Level(codes[starts], np.add.reduceat(count, starts), np.add.reduceat(total, starts),
+                 np.minimum.reduceat(low, starts), np.maximum.reduceat(high, starts))
+
+
+def _concatenate(a, b):
+    return Level(*[np.concatenate(columns) for columns in zip(a, b)])
+
+
+class CellPyramid(object):
+    '''
+    Count, sum, min and max of point values per box at several precisions
+    '''
+    def __init__(self, precisions=(4, 8, 12, 16), max_cells=None, exact_precision=None, encoder=GeoBoxEncoder):
+        require_numpy()
+        self.precisions = tuple(sorted(set(precisions)))
+        if not self.precisions or self.precisions[0] < 1 or self.precisions[-1] > encoder.MAX_PRECISION:
+            raise ValueError("precisions must be between 1 and %d" % encoder.MAX_PRECISION)
+        self.encoder = encoder
+        self.max_cells = max_cells
+        # Levels up to exact_precision are never capped
+        self.exact_precision = self.precisions[0] if exact_precision is None else exact_precision
+        empty = Level(np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64), np.empty(0),
+                      np.empty(0), np.empty(0))
+        self._levels = dict((p, empty) for p in self.precisions)
+        # Bound on the count a box is missing from each capped level: the
+        # largest count dropped by each cap, summed over the caps
+        self.error = dict((p, 0) for p in self.precisions)
+
+    # Updates
+    def add(self, latitudes, longitudes, values=None):
+        '''
+        Add points, with a value each which defaults to 1
+        '''
+        self._update(latitudes, longitudes, values, 1)
+
+    def remove(self, latitudes, longitudes, values=None):
+        '''
+        Remove points added before, with the same values.  Counts and sums are
+        updated, but min and max only grow: after a removal they bound the
+        values of a box instead of being reached.
+        '''
+        self._update(latitudes, longitudes, values, -1)
+
+    def extend(self, points, chunk_size=65536):
+        '''
+        Add an iterable of (latitude, longitude) or (latitude, longitude,
+        value) tuples, chunk_size at a time
+        '''
+        chunk = []
+        for point in points:
+            chunk.append(point)
+            if len(chunk) == chunk_size:
+                self._add_rows(chunk)
+                chunk = []
+        if chunk:
+            self._add_rows(chunk)
+
+    def _add_rows(self, rows):
+        columns = np.array(rows, dtype=np.float64)
+        self.add(columns[:, 0], columns[:, 1], columns[:, 2] if columns.shape[1] > 2 else None)
+
+    def _update(self, latitudes, longitudes, values, sign):
+        latitudes = np.asarray(latitudes, dtype=np.float64).ravel()
+        longitudes = np.asarray(longitudes, dtype=np.float64).ravel()
+        if values is None:
+            values = np.ones(latitudes.size)
+        else:
+            values = np.asarray(values, dtype=np.float64).ravel()
+        if not latitudes.size == longitudes.size == values.size:
+            raise ValueError("latitudes, longitudes and values must have the same size")
+
+        finest = self.precisions[-1]
+        codes = self.encoder.encode_many(latitudes, longitudes, finest, codes=True)
+        count = np.full(codes.size, sign, dtype=np.int64)
+        if sign > 0:
+            batch = _reduce(codes, count, values, values, values)
+        else:
+            batch = _reduce(codes, count, -values, np.full(codes.size, np.inf), np.full(codes.size, -np.inf))
+        self._merge_levels(self._rollup(batch))
+
+    def merge(self, other):
+        '''
+        Add the aggregates of another pyramid with the same precisions
+        '''
+        if other.precisions != self.precisions:
+            raise ValueError("Can not merge pyramids of different precisions")
+        for precision in self.precisions:
+            self.error[precision] += other.error[precision]
+        self._merge_levels(other._levels)
+
+    def _rollup(self, batch):
+        '''
+        Aggregates of a batch at every level, from those of the finest one
+        '''
+        levels = {self.precisions[-1]: batch}
+        finer = self.precisions[-1]
+        for precision in reversed(self.precisions[:-1]):
+            shift = np.uint64(2 * (finer - precision))
+            batch = _reduce(batch.codes >> shift, batch.count, batch.sum, batch.min, batch.max)
+            levels[precision] = batch
+            finer = precision
+        return levels
+
+    def _merge_levels(self, levels):
+        for precision in self.precisions:
+            level = _reduce(*_concatenate(self._levels[precision], levels[precision]))
+            # Boxes whose points were all removed
+            level = Level(*[column[level.count > 0] for column in level])
+            if self.max_cells is not None and precision > self.exact_precision and level.codes.size > self.max_cells:
+                level = self._cap(precision, level)
+            self._levels[precision] = level
+
+    def _cap(self, precision, level):
+        '''
+        Keep the max_cells boxes of a level holding the most points.  A box
+        may be dropped by several caps, so each one adds the largest count
+        it drops to the error.
+        '''
+        keep = np.argpartition(level.count, level.count.size - self.max_cells)[-self.max_cells:]
+        dropped = np.ones(level.count.size, dtype=bool)
+        dropped[keep] = False
+        self.error[precision] += int(level.count[dropped].max())
+        keep.sort()
+        return Level(*[column[keep] for column in level])
+
+    # Queries
+    def level(self, precision):
+        '''
+        Level of the aggregates of every box of a precision, sorted by code.
+        The arrays must not be modified.
+        '''
+        if precision not in self._levels:
+            raise ValueError("No level of precision %d, expected one of %s" % (precision, self.precisions))
+        return self._levels[precision]
+
+    def ids(self, precision):
+        '''
+        geobox_ids of the boxes of a level, in the order of its aggregates
+        '''
+        return self.encoder.codes_to_ids(self.level(precision).codes, precision)
+
+    def cell(self, geobox_id):
+        '''
+        Return the (count, sum, min, max) of a box, None when it holds no point
+        '''
+        level = self.level(len(geobox_id))
+        code = np.uint64(self.encoder.id_to_code(geobox_id))
+        position = int(np.searchsorted(level.codes, code))
+        if position == level.codes.size or level.codes[position] != code:
+            return None
+        return (int(level.count[position]), float(level.sum[position]),
+                float(level.min[position]), float(level.max[position]))
+
+    def top(self, precision, k):
+        '''
+        Return the (geobox_ids, counts) of the k boxes of a level holding the
+        most points, most populated first
+        '''
+        level = self.level(precision)
+        order = np.argsort(-level.count, kind='mergesort')[:k]
+        return self.encoder.codes_to_ids(level.codes[order], precision), level.count[order]
+
+    def __len__(self):
+        return int(self._levels[self.precisions[0]].count.sum())
@@ -0,0 +1,227 @@
+'''
+Streaming JSON and NDJSON serialization of points.
+
+json.dumps with GeoPointEncoder calls back into Python for every point and
+builds a dict for each of them.  Here a line is formatted straight from the
+point attributes, or from whole columns of a GeoPointArray, and the output
+is produced as text chunks that can be written to a response as they come:
+
+    for chunk in iter_ndjson(points, box=True):
+        response.write(chunk)
+
+A point is the object written by GeoPointEncoder, optionally followed by
+the coordinates of its box corners and the geobox_ids of its neighbors in
+the order of GeoBoxEncoder.NEIGHBORS, the ones beyond a pole left out:
+
+    {"geobox_id": "...", "latitude": 45.46, "longitude": 9.19,
+     "box": {"SW": [lat, lng], "SE": [...], "NE": [...], "NW": [...]},
+     "neighbors": ["...", ...]}
+
+Coordinates which are NaN or infinite have no JSON number: they are written
+as null, as JSON.stringify does, and read back as NaN.
+
+load reads NDJSON, or a JSON array, back into a GeoPointArray or a list of
+GeoPoints.  NDJSON is parsed chunk_size lines at a time; a JSON array is
+read and parsed as a whole, so only NDJSON input streams.
+'''
+import json
+import math
+from itertools import islice
+
+from . import GeoBoxEncoder, GeoPoint
+from .points import GeoPointArray
+from .curve import np, require_numpy
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+CHUNK_SIZE = 1000
+
+_POINT = '{"geobox_id": "%s", "latitude": %r, "longitude": %r'
+# Each bound shows up in two corners: it is formatted once, then placed with %s
+_BOX = ', "box": {"SW": [%s, %s], "SE": [%s, %s], "NE": [%s, %s], "NW": [%s, %s]}'
+_NEIGHBORS = ', "neighbors": [%s]'
+_BEARINGS = [bearing for bearing, _, _ in GeoBoxEncoder.NEIGHBORS]
+
+
+class _Null(object):
+    # Takes the place of a non finite coordinate under the %r of _POINT
+    def __repr__(self):
+        return 'null'
+
+
+_NULL = _Null()
+
+
+def _coordinate(value):
+    if math.isnan(value) or math.isinf(value):
+        return _NULL
+    return value
+
+
+def _coordinates(values):
+    '''
+    tolist of a coordinate column, non finite values replaced by _NULL
+    '''
+    if np.isfinite(values).all():
+        return values.tolist()
+    return [_coordinate(v) for v in values.tolist()]
+
+
+def _template(box, neighbors):
+    return _POINT + (_BOX if box else '') + (_NEIGHBORS if neighbors else '') + '}'
+
+
+def _neighbor_list(geobox_ids):
+    geobox_ids = [i for i in geobox_ids if i]
+    if not geobox_ids:
+        return ''
+    return '"' + '", "'.join(geobox_ids) + '"'
+
+
+def _array_rows(points, box, neighbors):
+    '''
+    Columns of a GeoPointArray zipped into the rows formatted by _template
+    '''
+    columns = [points.gcode().astype(str).tolist(), _coordinates(points.latitudes), _coordinates(points.longitudes)]
+    if box:
+        (lat_min, lng_min), (lat_max, lng_max) = points.bounds()
+        lat_min, lng_min, lat_max, lng_max = (list(map(repr, c.tolist())) for c in (lat_min, lng_min, lat_max, lng_max))
+        columns.extend((lat_min, lng_min, lat_min, lng_max, lat_max, lng_max, lat_max, lng_min))
+    if neighbors:
+        columns.append([_neighbor_list(row) for row in points.neighbors().astype(str).tolist()])
+    return zip(*columns)
+
+
+def _point_rows(points, box, neighbors):
+    for point in points:
+        row = (point.gcode, _coordinate(float(point.latitude)), _coordinate(float(point.longitude)))
+        if box:
+            lat_min, lng_min = map(repr, point._latLng_SW)
+            lat_max, lng_max = map(repr, point._latLng_NE)
+            row += (lat_min, lng_min, lat_min, lng_max, lat_max, lng_max, lat_max, lng_min)
+        if neighbors:
+            by_bearing = dict(GeoBoxEncoder.neighbors(point.gcode))
+            row += (_neighbor_list(by_bearing.get(b) for b in _BEARINGS),)
+        yield row
+
+
+def _chunks(points, box, neighbors, chunk_size):
+    '''
+    Yield the list of formatted points of each chunk
+    '''
+    template = _template(box, neighbors)
+    if isinstance(points, GeoPoint):
+        points = [points]
+    if isinstance(points, GeoPointArray):
+        for start in range(0, len(points), chunk_size):
+            rows = _array_rows(points[start:start + chunk_size], box, neighbors)
+            yield [template % row for row in rows]
+        return
+    points = iter(points)
+    while True:
+        chunk = [template % row for row in _point_rows(islice(points, chunk_size), box, neighbors)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_ndjson(points, box=False, neighbors=False, chunk_size=CHUNK_SIZE):
+    '''
+    Yield NDJSON text chunks of up to chunk_size lines, one per point.
+    points is a GeoPoint, an iterable of GeoPoints or a GeoPointArray.
+    '''
+    for chunk in _chunks(points, box, neighbors, chunk_size):
+        yield '\n'.join(chunk) + '\n'
+
+
+def iter_json(points, box=False, neighbors=False, chunk_size=CHUNK_SIZE):
+    '''
+    Yield text chunks which together are a JSON array of the points
+    '''
+    separator = '['
+    for chunk in _chunks(points, box, neighbors, chunk_size):
+        yield separator + ', '.join(chunk)
+        separator = ', '
+    yield '[]' if separator == '[' else ']'
+
+
+def dump(points, stream, box=False, neighbors=False, ndjson=True, chunk_size=CHUNK_SIZE):
+    '''
+    Write the points to a text stream as NDJSON, or as a JSON array when
+    ndjson is False
+    '''
+    chunks = iter_ndjson if ndjson else iter_json
+    for chunk in chunks(points, box, neighbors, chunk_size):
+        stream.write(chunk)
+
+
+def dumps(points, box=False, neighbors=False, ndjson=True):
+    chunks = iter_ndjson if ndjson else iter_json
+    return ''.join(chunks(points, box, neighbors))
+
+
+def _records(stream, chunk_size):
+    '''
+    Yield lists of up to chunk_size point dicts read from NDJSON, or a
+    single list holding all the points of a JSON array
+    '''
+    lines = iter(stream.splitlines() if isinstance(stream, string_types) else stream)
+    for first in lines:
+        if first.strip():
+            break
+    else:
+        return
+    if first.lstrip().startswith('['):
+        yield json.loads(first + ''.join(lines))
+        return
+
+    pending = [first]
+    for line in lines:
+        if line.strip():
+            pending.append(line)
+            if len(pending) == chunk_size:
+                # A single call parses the whole chunk
+                yield json.loads('[' + ','.join(pending) + ']')
+                pending = []
+    if pending:
+        yield json.loads('[' + ','.join(pending) + ']')
+
+
+def _point(geobox_id, latitude, longitude):
+    latitude = float('nan') if latitude is None else latitude
+    longitude = float('nan') if longitude is None else longitude
+    if len(geobox_id) > GeoBoxEncoder.MAX_PRECISION:
+        # No 64 bit code: decode the string, as GeoBoxEncoder.decode does
+        point = GeoPoint(geobox_id=geobox_id)
+        point._lat, point._lng = latitude, longitude
+        return point
+    return GeoPoint._from_code(
+        latitude, longitude, GeoBoxEncoder.id_to_code(geobox_id), len(geobox_id), build_box=True)
+
+
+def load(stream, columnar=True, chunk_size=10000):
+    '''
+    Read points written by dump from a text stream, an iterable of lines
+    or a string.  Return a GeoPointArray, or a list of GeoPoints when
+    columnar is False.  Box and neighbors are not read back, they follow
+    from the geobox_id; null coordinates are read as NaN.
+    '''
+    if not columnar:
+        points = []
+        for records in _records(stream, chunk_size):
+            for r in records:
+                points.append(_point(r['geobox_id'], r['latitude'], r['longitude']))
+        return points
+
+    require_numpy()
+    arrays = []
+    for records in _records(stream, chunk_size):
+        geobox_ids = GeoPointArray.from_ids([r['geobox_id'] for r in records])
+        arrays.append(GeoPointArray(
+            np.array([r['latitude'] for r in records], dtype=np.float64),
+            np.array([r['longitude'] for r in records], dtype=np.float64),
+            geobox_ids.codes, geobox_ids.precisions))
+    return GeoPointArray.concatenate(arrays)
@@ -0,0 +1,250 @@
+'''
+Asyncio server coalescing many small requests into batched encoder calls.
+
+Python 3 only, and not imported by the geobox package.  Requests and
+responses are newline delimited JSON over TCP or a Unix socket:
+
+    {"id": 1, "op": "encode", "lat": 45.46, "lng": 9.19, "precision": 12}
+    {"id": 2, "op": "decode", "geobox_id": "ecagtcctttgt"}
+    {"id": 3, "op": "neighbors", "geobox_id": "ecagtcctttgt"}
+    {"id": 4, "op": "distance", "from": [45.46, 9.19], "to": [48.85, 2.35]}
+    {"id": 5, "op": "stats"}
+
+Each response carries the id of its request, with either a "result" or an
+"error".  A connection may send requests without waiting for the responses,
+which then come back in the order they complete.
+
+Requests of the same kind arriving within window seconds of each other are
+run through a single GeoBoxEncoder batch call, at most max_batch at a time.
+At most max_pending requests are in flight: beyond that the server stops
+reading from its connections until responses are written.  Latencies, from
+the reception of a request to its response, are kept in a Metrics by
+operation, and the duration of every batch under 'batch:<op>':
+
+    python -m geobox.server --port 8765 --window 0.5 --max-batch 1024
+
+The 'stats' operation returns the Metrics snapshot.
+'''
+import argparse
+import asyncio
+import json
+import sys
+from timeit import default_timer
+
+from . import GeoBoxEncoder, central_angle
+from .curve import np, require_numpy
+from .metrics import Metrics
+
+OPERATIONS = ('encode', 'decode', 'neighbors', 'distance', 'stats')
+WINDOW = 0.0005
+MAX_BATCH = 1024
+MAX_PENDING = 8192
+
+
+class GeoServer(object):
+    '''
+    Newline delimited JSON server of the encoder, see the module documentation
+    '''
+    def __init__(self, window=WINDOW, max_batch=MAX_BATCH, max_pending=MAX_PENDING, encoder=GeoBoxEncoder):
+        require_numpy()
+        if window < 0 or max_batch < 1 or max_pending < 1:
+            raise ValueError("window must be positive, max_batch and max_pending at least 1")
+        self.window = window
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.encoder = encoder
+        self.metrics = Metrics()
+        self.server = None
+        # Batches being collected by key: (operation, precision or id length)
+        self._batches = {}
+        self._slots = None
+        self._connections = set()
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        '''
+        Listen on host and port, or on the Unix socket path.  Return the
+        asyncio server, whose sockets give the port actually bound.
+        '''
+        self._slots = asyncio.Semaphore(self.max_pending)
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self._connection, path)
+        else:
+            self.server = await asyncio.start_server(self._connection, host, port)
+        return self.server
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        '''
+        Stop listening, then wait for the open connections to be closed by
+        their clients
+        '''
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self._connections:
+            await asyncio.gather(*self._connections)
+
+    # Connections
+    async def _connection(self, reader, writer):
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                # Backpressure: no more reading while max_pending requests wait
+                await self._slots.acquire()
+                task = asyncio.ensure_future(self._respond(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            self._connections.discard(connection)
+
+    async def _respond(self, line, writer):
+        start = default_timer()
+        request_id, operation = None, 'invalid'
+        try:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("request must be a JSON object")
+                request_id = request.get('id')
+                operation = request.get('op')
+                response = {'id': request_id, 'result': await self._call(operation, request)}
+            except Exception as e:
+                response = {'id': request_id, 'error': '%s: %s' % (e.__class__.__name__, e)}
+
+            writer.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.metrics.record(operation if operation in OPERATIONS else 'invalid', default_timer() - start)
+            await writer.drain()
+        finally:
+            # Held until the response is drained, so that a client not
+            # reading its responses stops the reading of its requests
+            self._slots.release()
+
+    # Batching
+    def _call(self, operation, request):
+        '''
+        Return a future of the result of a request
+        '''
+        if operation == 'encode':
+            precision = int(request.get('precision', self.encoder.DEFAULT_PRECISION))
+            item = (float(request['lat']), float(request['lng']))
+            return self._submit(('encode', precision), item)
+        if operation in ('decode', 'neighbors'):
+            geobox_id = request['geobox_id']
+            if not isinstance(geobox_id, str) or not geobox_id:
+                raise ValueError("geobox_id must be a non empty string")
+            return self._submit((operation, len(geobox_id)), geobox_id)
+        if operation == 'distance':
+            (lat1, lng1), (lat2, lng2) = request['from'], request['to']
+            return self._submit(('distance', None), (float(lat1), float(lng1), float(lat2), float(lng2)))
+        if operation == 'stats':
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(self.metrics.snapshot())
+            return future
+        raise ValueError("unknown op %r, expected one of: %s" % (operation, ', '.join(OPERATIONS)))
+
+    def _submit(self, key, item):
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = ([], [], loop.call_later(self.window, self._flush, key))
+        items, futures, timer = batch
+        future = loop.create_future()
+        items.append(item)
+        futures.append(future)
+        if len(items) >= self.max_batch:
+            timer.cancel()
+            self._flush(key)
+        return future
+
+    def _flush(self, key):
+        items, futures, _ = self._batches.pop(key)
+        operation, parameter = key
+        start = default_timer()
+        try:
+            results = getattr(self, '_' + operation + '_many')(items, parameter)
+        except Exception:
+            # A bad request fails the whole batch: run each request on its own
+            # to report the error to its sender only
+            results = []
+            for item in items:
+                try:
+                    results.append(getattr(self, '_' + operation + '_many')([item], parameter)[0])
+                except Exception as e:
+                    results.append(e)
+        self.metrics.record('batch:' + operation, default_timer() - start)
+
+        for future, result in zip(futures, results):
+            if future.cancelled():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _encode_many(self, items, precision):
+        latitudes, longitudes = np.array(items, dtype=np.float64).reshape(-1, 2).T
+        return self.encoder.encode_many(latitudes, longitudes, precision).astype(str).tolist()
+
+    def _decode_many(self, items, length):
+        latitudes, longitudes = self.encoder.decode_many(np.array(items, dtype='S%d' % length))
+        return [list(latLng) for latLng in zip(latitudes.tolist(), longitudes.tolist())]
+
+    def _neighbors_many(self, items, length):
+        neighbors = self.encoder.neighbors_many(np.array(items, dtype='S%d' % length)).astype(str).tolist()
+        bearings = [bearing for bearing, _, _ in self.encoder.NEIGHBORS]
+        return [dict((b, n) for b, n in zip(bearings, row) if n) for row in neighbors]
+
+    def _distance_many(self, items, _):
+        lat1, lng1, lat2, lng2 = np.radians(np.array(items, dtype=np.float64).reshape(-1, 4).T)
+        distances = self.encoder.EARTH_RADIUS * central_angle(
+            lat1, lng1, lat2, lng2, sin=np.sin, cos=np.cos, asin=np.arcsin, sqrt=np.sqrt)
+        return distances.tolist()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Serve the geobox encoder as newline delimited JSON.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH', help="listen on a Unix socket instead of TCP")
+    parser.add_argument('--window', type=float, default=WINDOW * 1000,
+                        help="milliseconds to wait for requests to batch together (default %(default)s)")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    server = GeoServer(args.window / 1000.0, args.max_batch, args.max_pending)
+
+    async def run():
+        listening = await server.start(args.host, args.port, args.unix)
+        print("geobox server listening on %s" % (listening.sockets[0].getsockname(),), file=sys.stderr)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,363 @@
+'''
+Memory mapped on-disk index of points keyed by geobox code.
+
+File layout, all little endian and each section aligned on 8 bytes:
+
+    header      HEADER_SIZE bytes, see HEADER
+    keys        count x uint64, sorted
+    latitudes   count x float32 or float64
+    longitudes  count x float32 or float64
+    offsets     (count + 1) x uint64, payload i is payload[offsets[i]:offsets[i + 1]]
+    payload     payload_size bytes
+
+The keys are either geobox codes at MAX_PRECISION (SCHEME_GEOBOX) or the
+64 bit gbox.Geocode codes (SCHEME_GEOCODE), stored unsigned so that their
+order is the Z-order of the boxes; see signed_geocodes for the values
+returned by Geocode.gcode().
+
+GeoIndexFile maps the file and exposes every section as a read-only NumPy
+view, so opening an index costs the same whatever its size.
+GeoIndexWriter builds files larger than memory: points are sorted in runs
+of bounded size spilled to temporary index files, then merged block by
+block into the final file.
+'''
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+from . import GeoBoxEncoder
+from .curve import interleave, interleave_many, np, quantize_many, require_numpy
+
+MAGIC = b'GEOBOXIX'
+VERSION = 1
+SCHEME_GEOBOX = 1
+SCHEME_GEOCODE = 2
+SCHEMES = {'geobox': SCHEME_GEOBOX, 'geocode': SCHEME_GEOCODE}
+
+# magic, version, scheme, coordinate size, precision, count, payload size,
+# then the offsets of the keys, latitudes, longitudes, offsets and payload sections
+HEADER = struct.Struct('<8sHHHHQQQQQQQ')
+HEADER_SIZE = 128
+
+# Depth of gbox.Geocode codes
+GEOCODE_DEPTH = 32
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _layout(count, coord_size, payload_size):
+    '''
+    Return the section offsets and the total size of a file
+    '''
+    keys = HEADER_SIZE
+    latitudes = _align(keys + 8 * count)
+    longitudes = _align(latitudes + coord_size * count)
+    offsets = _align(longitudes + coord_size * count)
+    payload = offsets + 8 * (count + 1)
+    return (keys, latitudes, longitudes, offsets, payload), payload + payload_size
+
+
+def geocode_keys(latitudes, longitudes, depth=GEOCODE_DEPTH):
+    '''
+    Unsigned gbox.Geocode codes, of depth 32 by default, for arrays of points
+    '''
+    lng_index = quantize_many(longitudes, -180.0, 360.0, depth)
+    lat_index = quantize_many(latitudes, -90.0, 180.0, depth)
+    return interleave_many(lng_index, lat_index)
+
+
+def signed_geocodes(keys):
+    '''
+    View unsigned geocode keys as the signed values of Geocode.gcode()
+    '''
+    return np.asarray(keys, dtype=np.uint64).view(np.int64)
+
+
+def _keys(scheme, latitudes, longitudes):
+    if scheme == SCHEME_GEOCODE:
+        return geocode_keys(latitudes, longitudes)
+    return GeoBoxEncoder.encode_many(latitudes, longitudes, GeoBoxEncoder.MAX_PRECISION, codes=True)
+
+
+def _scheme(scheme):
+    try:
+        return SCHEMES[scheme]
+    except KeyError:
+        raise ValueError("Unknown key scheme '%s', expected one of: %s" % (scheme, ', '.join(sorted(SCHEMES))))
+
+
+def _pack_payloads(payloads, count):
+    '''
+    Return (offsets, blob) for a sequence of bytes payloads, or empty payloads
+    '''
+    offsets = np.zeros(count + 1, dtype=np.uint64)
+    if payloads is None:
+        return offsets, b''
+    if len(payloads) != count:
+        raise ValueError("Expected %d payloads, got %d" % (count, len(payloads)))
+    offsets[1:] = np.cumsum([len(p) for p in payloads])
+    return offsets, b''.join(payloads)
+
+
+def write_index(path, latitudes, longitudes, payloads=None, scheme='geobox', coord_dtype='f8'):
+    '''
+    Write an index file for points that fit in memory.  payloads is an
+    optional sequence of bytes, one per point.
+    '''
+    require_numpy()
+    latitudes = np.asarray(latitudes, dtype=np.float64).ravel()
+    longitudes = np.asarray(longitudes, dtype=np.float64).ravel()
+    scheme = _scheme(scheme)
+    keys = _keys(scheme, latitudes, longitudes)
+    order = np.argsort(keys, kind='mergesort')
+    if payloads is not None:
+        payloads = [payloads[i] for i in order]
+    offsets, blob = _pack_payloads(payloads, keys.size)
+    _write(path, scheme, np.dtype(coord_dtype), keys[order], latitudes[order], longitudes[order], offsets, blob)
+
+
+def _write(path, scheme, coord_dtype, keys, latitudes, longitudes, offsets, blob):
+    count = keys.size
+    sections, _ = _layout(count, coord_dtype.itemsize, len(blob))
+    with open(path, 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, VERSION, scheme, coord_dtype.itemsize, GeoBoxEncoder.MAX_PRECISION,
+                             count, len(blob), *sections).ljust(HEADER_SIZE, b'\0'))
+        columns = (keys.astype('<u8'), latitudes.astype(coord_dtype.newbyteorder('<')),
+                   longitudes.astype(coord_dtype.newbyteorder('<')), offsets.astype('<u8'))
+        for offset, column in zip(sections, columns):
+            fh.write(b'\0' * (offset - fh.tell()))
+            fh.write(column.tobytes())
+        fh.write(blob)
+
+
+class GeoIndexFile(object):
+    '''
+    Read-only, memory mapped index file
+    '''
+    def __init__(self, path):
+        require_numpy()
+        self.path = path
+        with open(path, 'rb') as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.scheme, coord_size, self.precision, self.count,
+         self.payload_size, keys, latitudes, longitudes, offsets, payload) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a geobox index file" % path)
+        if version != VERSION:
+            raise ValueError("Unsupported geobox index version %d in %s" % (version, path))
+
+        coord_dtype = np.dtype('<f%d' % coord_size)
+        self.keys = np.frombuffer(self._mmap, dtype='<u8', count=self.count, offset=keys)
+        self.latitudes = np.frombuffer(self._mmap, dtype=coord_dtype, count=self.count, offset=latitudes)
+        self.longitudes = np.frombuffer(self._mmap, dtype=coord_dtype, count=self.count, offset=longitudes)
+        self.offsets = np.frombuffer(self._mmap, dtype='<u8', count=self.count + 1, offset=offsets)
+        self.payload_data = np.frombuffer(self._mmap, dtype=np.uint8, count=self.payload_size, offset=payload)
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        # Views must be dropped before the map can be closed
+        self.keys = self.latitudes = self.longitudes = self.offsets = self.payload_data = None
+        self._mmap.close()
+
+    def payload(self, position):
+        '''
+        Payload bytes of the point at the given position in the sorted columns
+        '''
+        return self.payload_data[int(self.offsets[position]):int(self.offsets[position + 1])].tobytes()
+
+    def key_range(self, prefix):
+        '''
+        Return the (lowest, highest) keys of the points in the box of a geobox_id prefix
+        '''
+        if self.scheme == SCHEME_GEOBOX:
+            return GeoBoxEncoder.prefix_range(prefix, self.precision)
+
+        # A geobox_id of length L fixes the top L longitude bits and L - 1
+        # latitude bits, which are the first 2L - 1 bits of a geocode
+        precision = len(prefix)
+        lng_cell, lat_cell = GeoBoxEncoder.cell_indices(GeoBoxEncoder.id_to_code(prefix), precision)
+        code = (interleave(lng_cell >> 1, lat_cell) << 1) | (lng_cell & 1)
+        shift = 2 * GEOCODE_DEPTH - (2 * precision - 1)
+        return code << shift, ((code + 1) << shift) - 1
+
+    def prefix_slice(self, prefix):
+        '''
+        Slice of the sorted columns holding the points in the box of a geobox_id prefix
+        '''
+        lowest, highest = self.key_range(prefix)
+        return slice(int(np.searchsorted(self.keys, np.uint64(lowest), 'left')),
+                     int(np.searchsorted(self.keys, np.uint64(highest), 'right')))
+
+    def within_radius(self, latitude, longitude, radius, max_cells=16):
+        '''
+        Return (positions, distances) of the points within radius meter,
+        sorted by distance.  Positions index the columns and payload().
+        '''
+        prefixes = GeoBoxEncoder.cover_circle(latitude, longitude, radius, max_cells)
+        if self.scheme == SCHEME_GEOCODE:
+            # Geocode puts the 0 meridian in the west hemisphere, while
+            # geobox puts it in the east one: add the boxes west of it
+            for prefix in list(prefixes):
+                latLng_SW = GeoBoxEncoder.decode(prefix, box=True)[1]
+                if latLng_SW[1] == 0.0:
+                    lng_cell, lat_cell = GeoBoxEncoder.cell_indices(GeoBoxEncoder.id_to_code(prefix), len(prefix))
+                    west = GeoBoxEncoder.cell_code(lng_cell - 1, lat_cell, len(prefix))
+                    prefixes.append(GeoBoxEncoder.code_to_id(west, len(prefix)))
+
+        slices = [self.prefix_slice(p) for p in prefixes]
+        positions = np.concatenate([np.arange(s.start, s.stop) for s in slices] or [np.empty(0, dtype=np.intp)])
+        positions = np.unique(positions)
+        distances = GeoBoxEncoder.haversine_many(
+            (latitude, longitude), self.latitudes[positions].astype(np.float64),
+            self.longitudes[positions].astype(np.float64))
+
+        keep = distances <= radius
+        positions, distances = positions[keep], distances[keep]
+        order = np.argsort(distances, kind='mergesort')
+        return positions[order], distances[order]
+
+
+class GeoIndexWriter(object):
+    '''
+    Streaming writer for index files larger than memory.
+
+    Points given to add() are buffered up to run_size, then sorted and spilled
+    to a temporary index file.  close() merges the sorted runs block by block
+    into the final file.
+    '''
+    BLOCK_SIZE = 1 << 16
+
+    def __init__(self, path, scheme='geobox', coord_dtype='f8', run_size=1 << 20, tmpdir=None):
+        require_numpy()
+        self.path = path
+        self.scheme = scheme
+        self.coord_dtype = np.dtype(coord_dtype)
+        self.run_size = run_size
+        self._tmpdir = tempfile.mkdtemp(prefix='geobox-', dir=tmpdir)
+        self._runs = []
+        self._buffer = []
+        self._buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def add(self, latitudes, longitudes, payloads=None):
+        latitudes = np.asarray(latitudes, dtype=np.float64).ravel()
+        longitudes = np.asarray(longitudes, dtype=np.float64).ravel()
+        if payloads is None:
+            payloads = [b''] * latitudes.size
+        self._buffer.append((latitudes, longitudes, list(payloads)))
+        self._buffered += latitudes.size
+        if self._buffered >= self.run_size:
+            self._spill()
+
+    def _spill(self):
+        if not self._buffered:
+            return
+        latitudes = np.concatenate([b[0] for b in self._buffer])
+        longitudes = np.concatenate([b[1] for b in self._buffer])
+        payloads = [p for b in self._buffer for p in b[2]]
+        run = os.path.join(self._tmpdir, 'run%05d' % len(self._runs))
+        write_index(run, latitudes, longitudes, payloads, self.scheme, self.coord_dtype)
+        self._runs.append(run)
+        self._buffer = []
+        self._buffered = 0
+
+    def close(self):
+        self._spill()
+        try:
+            if len(self._runs) == 1:
+                shutil.move(self._runs[0], self.path)
+            else:
+                self._merge()
+        finally:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def _merge(self):
+        runs = [GeoIndexFile(run) for run in self._runs]
+        try:
+            count = sum(r.count for r in runs)
+            payload_size = sum(r.payload_size for r in runs)
+            sections, size = _layout(count, self.coord_dtype.itemsize, payload_size)
+            with open(self.path, 'wb') as fh:
+                fh.write(HEADER.pack(MAGIC, VERSION, _scheme(self.scheme), self.coord_dtype.itemsize,
+                                     GeoBoxEncoder.MAX_PRECISION, count, payload_size, *sections))
+                fh.truncate(size)
+
+            out = np.memmap(self.path, dtype=np.uint8, mode='r+')
+            keys = out[sections[0]:sections[0] + 8 * count].view('<u8')
+            coord_dtype = self.coord_dtype.newbyteorder('<')
+            size = self.coord_dtype.itemsize * count
+            latitudes = out[sections[1]:sections[1] + size].view(coord_dtype)
+            longitudes = out[sections[2]:sections[2] + size].view(coord_dtype)
+            offsets = out[sections[3]:sections[3] + 8 * (count + 1)].view('<u8')
+            payload = out[sections[4]:]
+            offsets[0] = 0
+
+            positions = [0] * len(runs)
+            written = 0
+            while written < count:
+                written = self._merge_block(runs, positions, written, keys, latitudes, longitudes, offsets, payload)
+            out.flush()
+            del out, keys, latitudes, longitudes, offsets, payload
+        finally:
+            for run in runs:
+                run.close()
+
+    def _merge_block(self, runs, positions, written, keys, latitudes, longitudes, offsets, payload):
+        '''
+        Merge the next block of every run up to the smallest of their last
+        keys, which is the largest key known to have no smaller key left.
+        '''
+        active = [i for i, r in enumerate(runs) if positions[i] < r.count]
+        bound = min(runs[i].keys[min(positions[i] + self.BLOCK_SIZE, runs[i].count) - 1] for i in active)
+
+        parts = []
+        for i in active:
+            run, start = runs[i], positions[i]
+            stop = start + int(np.searchsorted(run.keys[start:start + self.BLOCK_SIZE], bound, 'right'))
+            parts.append((i, start, stop))
+            positions[i] = stop
+
+        block_keys = np.concatenate([runs[i].keys[a:b] for i, a, b in parts])
+        order = np.argsort(block_keys, kind='mergesort')
+        end = written + block_keys.size
+        keys[written:end] = block_keys[order]
+        latitudes[written:end] = np.concatenate([runs[i].latitudes[a:b] for i, a, b in parts])[order]
+        longitudes[written:end] = np.concatenate([runs[i].longitudes[a:b] for i, a, b in parts])[order]
+
+        # Payloads: ragged gather of the byte ranges of each run, in merged order
+        starts = np.concatenate([runs[i].offsets[a:b] for i, a, b in parts])[order]
+        lengths = np.concatenate([np.diff(runs[i].offsets[a:b + 1]) for i, a, b in parts])[order]
+        sources = np.concatenate([np.full(b - a, n, dtype=np.intp) for n, (i, a, b) in enumerate(parts)])[order]
+        base = int(offsets[written])
+        offsets[written + 1:end + 1] = base + np.cumsum(lengths)
+        for n, (i, a, b) in enumerate(parts):
+            rows = np.flatnonzero(sources == n)
+            if not rows.size or not lengths[rows].sum():
+                continue
+            row_lengths = lengths[rows].astype(np.intp)
+            target = (offsets[written + rows] - base).astype(np.intp)
+            index = np.arange(int(row_lengths.sum())) - np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths)
+            payload[base + np.repeat(target, row_lengths) + index] = \
+                runs[i].payload_data[np.repeat(starts[rows].astype(np.intp), row_lengths) + index]
+        return end
@@ -0,0 +1,420 @@
+'''
+Exact conversions between geobox_ids, gbox.Geocode codes and geohashes.
+
+The three encodings bisect the same -180/180 longitude by -90/90 latitude
+world and interleave the bits of the longitude and latitude cell indices,
+longitude first:
+
+    geobox_id of precision P    P longitude bits ('w'/'e' then P - 1 bits),
+                                P - 1 latitude bits
+    Geocode of depth d          d longitude bits, d latitude bits
+    geohash of L characters     5L bits: ceil(5L / 2) longitude bits,
+                                floor(5L / 2) latitude bits
+
+So a cell of any of them is a Cell: its longitude and latitude indices with
+their number of bits.  The from_* functions read a Cell out of an encoding
+and the to_* functions write a Cell into another one, without going through
+a float latitude/longitude:
+
+    >>> from geobox import transcode
+    >>> transcode.to_geohash(transcode.from_geobox('watacg'))
+    '9q'
+    >>> transcode.to_geobox(transcode.from_geohash('9q'))
+    'watac'
+
+Without an explicit precision, depth or length, the result is the smallest
+cell of the target encoding that contains the source cell, found by
+dropping the extra low bits of the indices.  Asking for a cell finer than
+the source raises ValueError: it would not be exact.
+
+Cells are converted, not points.  A point exactly on a cell edge can be
+encoded into different cells: geobox_ids and Geocodes send an edge to the
+lower cell, except for the 0 meridian which is 'e' in a geobox_id, and
+geohashes send it to the upper cell.
+'''
+from collections import namedtuple
+
+from gbox import Geocode
+from geohash import CHARACTER_CELLS, Geohash
+
+from . import GeoBoxEncoder
+from .curve import (
+    deinterleave,
+    deinterleave_many,
+    hilbert_decode,
+    hilbert_decode_many,
+    hilbert_encode,
+    hilbert_encode_many,
+    interleave,
+    interleave_many,
+    np,
+    require_numpy,
+)
+
+GEOHASH_BASE_32 = Geohash.BASE_32
+
+# Longitude (x) and latitude (y) cell indices, and their number of bits.
+# The batch functions use arrays of indices with the same numbers of bits.
+Cell = namedtuple('Cell', 'x y x_bits y_bits')
+
+
+def _join_table(x_first):
+    '''
+    Value of a geohash character from its (longitude bits, latitude bits)
+    packed as longitude bits << latitude width | latitude bits
+    '''
+    y_width = 2 if x_first else 3
+    values = [0] * 32
+    for value, (x, y) in enumerate(CHARACTER_CELLS[x_first]):
+        values[(x << y_width) | y] = value
+    return values
+
+
+# For a geohash character starting with a longitude bit (True) or a latitude
+# bit: the (longitude bits, latitude bits) of each value, and the reverse
+_SPLIT = CHARACTER_CELLS
+_JOIN = {True: _join_table(True), False: _join_table(False)}
+_GEOHASH_VALUES = dict((c, i) for i, c in enumerate(GEOHASH_BASE_32))
+
+# Byte tables of the batch functions: digit to character, and character to
+# digit (0xFF for invalid characters)
+if np is not None:
+    _geohash_bytes = np.frombuffer(GEOHASH_BASE_32.encode('ascii'), dtype=np.uint8)
+    _geohash_digits = np.full(256, 0xFF, dtype=np.uint8)
+    _geohash_digits[_geohash_bytes] = np.arange(32)
+
+
+def _widths(index):
+    '''
+    (longitude, latitude) bits of the geohash character at index
+    '''
+    return (3, 2) if index % 2 == 0 else (2, 3)
+
+
+def geohash_bits(length):
+    '''
+    (longitude, latitude) bits of a geohash of length characters
+    '''
+    return (5 * length + 1) // 2, 5 * length // 2
+
+
+def _shifts(cell, x_bits, y_bits):
+    '''
+    Bits to drop from the indices of cell to get those of the cell of
+    x_bits by y_bits that contains it
+    '''
+    if x_bits > cell.x_bits or y_bits > cell.y_bits:
+        raise ValueError("Cannot convert a cell of %d x %d bits into a smaller one of %d x %d bits" % (
+            cell.x_bits, cell.y_bits, x_bits, y_bits))
+    return cell.x_bits - x_bits, cell.y_bits - y_bits
+
+
+def _check_precision(precision):
+    if not 1 <= precision <= GeoBoxEncoder.MAX_PRECISION:
+        raise ValueError("precision must be between 1 and %d, got %s" % (GeoBoxEncoder.MAX_PRECISION, precision))
+
+
+def _check_depth(depth, curve):
+    Geocode._checkDepth(depth)
+    Geocode._checkCurve(curve)
+
+
+def _default_precision(cell):
+    return min(cell.x_bits, cell.y_bits + 1, GeoBoxEncoder.MAX_PRECISION)
+
+
+def _default_depth(cell):
+    return min(cell.x_bits, cell.y_bits, Geocode.MAX_DEPTH)
+
+
+def _default_length(cell):
+    # ceil(5L / 2) <= x_bits and floor(5L / 2) <= y_bits
+    return min(2 * cell.x_bits // 5, (2 * cell.y_bits + 1) // 5)
+
+
+# ---------------------------------------------------------------------
+# Scalar
+
+def from_geobox(geobox_id, precision=None):
+    '''
+    Cell of a geobox_id, or of an integer code returned by
+    GeoBoxEncoder.encode_int when precision is given
+    '''
+    if precision is None:
+        precision = len(geobox_id)
+        code = GeoBoxEncoder.id_to_code(geobox_id)
+    else:
+        code = geobox_id
+    _check_precision(precision)
+    x, y = GeoBoxEncoder.cell_indices(code, precision)
+    return Cell(x, y, precision, precision - 1)
+
+
+def to_geobox(cell, precision=None, code=False):
+    '''
+    geobox_id, or integer code when code is True, of the box of the given
+    precision that contains cell, by default the smallest one
+    '''
+    if precision is None:
+        precision = _default_precision(cell)
+    _check_precision(precision)
+    x_shift, y_shift = _shifts(cell, precision, precision - 1)
+    result = GeoBoxEncoder.cell_code(cell.x >> x_shift, cell.y >> y_shift, precision)
+    if code:
+        return result
+    return GeoBoxEncoder.code_to_id(result, precision)
+
+
+def from_geocode(code, depth=32, curve='morton'):
+    '''
+    Cell of a code returned by Geocode.gcode()
+    '''
+    _check_depth(depth, curve)
+    # A negative code wraps around to its unsigned 64 bit value
+    code &= (1 << (2 * depth)) - 1
+    if curve == 'hilbert':
+        x, y = hilbert_decode(code, depth)
+    else:
+        x, y = deinterleave(code)
+    return Cell(x, y, depth, depth)
+
+
+def to_geocode(cell, depth=None, curve='morton'):
+    '''
+    Geocode code of the box of the given depth that contains cell, by
+    default the smallest one, as a signed 64 bit value like Geocode.gcode()
+    '''
+    if depth is None:
+        depth = _default_depth(cell)
+    _check_depth(depth, curve)
+    x_shift, y_shift = _shifts(cell, depth, depth)
+    if curve == 'hilbert':
+        code = hilbert_encode(cell.x >> x_shift, cell.y >> y_shift, depth)
+    else:
+        code = interleave(cell.x >> x_shift, cell.y >> y_shift)
+    if code >= 1 << 63:
+        code -= 1 << 64
+    return code
+
+
+def from_geohash(geohash):
+    '''
+    Cell of a geohash
+    '''
+    code = 0
+    for c in geohash:
+        try:
+            code = (code << 5) | _GEOHASH_VALUES[c]
+        except KeyError:
+            raise ValueError("Invalid geohash '%s': expect characters of '%s'" % (geohash, GEOHASH_BASE_32))
+    x_bits, y_bits = geohash_bits(len(geohash))
+    if x_bits > 33:
+        return _from_geohash_code(code, len(geohash))
+    if x_bits > y_bits:
+        # The last bit is a longitude bit
+        x, y = deinterleave(code >> 1)
+        return Cell((x << 1) | (code & 1), y, x_bits, y_bits)
+    x, y = deinterleave(code)
+    return Cell(x, y, x_bits, y_bits)
+
+
+def _from_geohash_code(code, length):
+    '''
+    from_geohash one character at a time, for codes wider than 64 bits
+    '''
+    x = y = 0
+    for i in range(length):
+        x_width, y_width = _widths(i)
+        x_part, y_part = _SPLIT[i % 2 == 0][(code >> (5 * (length - 1 - i))) & 31]
+        x = (x << x_width) | x_part
+        y = (y << y_width) | y_part
+    x_bits, y_bits = geohash_bits(length)
+    return Cell(x, y, x_bits, y_bits)
+
+
+def to_geohash(cell, length=None):
+    '''
+    Geohash of the given length whose cell contains cell, by default the
+    longest one
+    '''
+    if length is None:
+        length = _default_length(cell)
+    x_bits, y_bits = geohash_bits(length)
+    x_shift, y_shift = _shifts(cell, x_bits, y_bits)
+    x = cell.x >> x_shift
+    y = cell.y >> y_shift
+    if x_bits > 33:
+        return _to_geohash_chars(x, y, length)
+    if x_bits > y_bits:
+        code = (interleave(x >> 1, y) << 1) | (x & 1)
+    else:
+        code = interleave(x, y)
+    return ''.join([GEOHASH_BASE_32[(code >> shift) & 31] for shift in range(5 * length - 5, -5, -5)])
+
+
+def _to_geohash_chars(x, y, length):
+    '''
+    to_geohash one character at a time, for codes wider than 64 bits
+    '''
+    x_bits, y_bits = geohash_bits(length)
+    chars = []
+    for i in range(length):
+        x_width, y_width = _widths(i)
+        x_bits -= x_width
+        y_bits -= y_width
+        x_part = (x >> x_bits) & ((1 << x_width) - 1)
+        y_part = (y >> y_bits) & ((1 << y_width) - 1)
+        chars.append(GEOHASH_BASE_32[_JOIN[i % 2 == 0][(x_part << y_width) | y_part]])
+    return ''.join(chars)
+
+
+# ---------------------------------------------------------------------
+# NumPy batch mode
+
+def from_geobox_many(geobox_ids, precision=None):
+    '''
+    Vectorized from_geobox of an array of geobox_ids of the same length, or
+    of integer codes when precision is given
+    '''
+    require_numpy()
+    geobox_ids = np.asarray(geobox_ids)
+    if geobox_ids.dtype.kind in 'iu':
+        if precision is None:
+            raise ValueError("precision is required to convert integer codes")
+        codes = geobox_ids.astype(np.uint64)
+    else:
+        if geobox_ids.dtype.kind == 'U':
+            geobox_ids = geobox_ids.astype('S')
+        codes = GeoBoxEncoder.ids_to_codes(geobox_ids)
+        precision = geobox_ids.dtype.itemsize
+    _check_precision(precision)
+    bits = np.uint64(precision - 1)
+    x, y = deinterleave_many(codes & np.uint64((1 << (2 * (precision - 1))) - 1))
+    x |= (codes >> (bits + bits)) << bits
+    return Cell(x, y, precision, precision - 1)
+
+
+def to_geobox_many(cell, precision=None, codes=False):
+    '''
+    Vectorized to_geobox, returning a fixed width 'S<precision>' array, or
+    the uint64 codes when codes is True
+    '''
+    require_numpy()
+    if precision is None:
+        precision = _default_precision(cell)
+    _check_precision(precision)
+    x_shift, y_shift = _shifts(cell, precision, precision - 1)
+    bits = np.uint64(precision - 1)
+    x = np.asarray(cell.x).astype(np.uint64) >> np.uint64(x_shift)
+    y = np.asarray(cell.y).astype(np.uint64) >> np.uint64(y_shift)
+    result = ((x >> bits) << (bits + bits)) | interleave_many(x & np.uint64((1 << (precision - 1)) - 1), y)
+    if codes:
+        return result
+    return GeoBoxEncoder.codes_to_ids(result, precision)
+
+
+def from_geocode_many(codes, depth=32, curve='morton'):
+    '''
+    Vectorized from_geocode
+    '''
+    require_numpy()
+    _check_depth(depth, curve)
+    codes = np.asarray(codes).astype(np.uint64) & np.uint64((1 << (2 * depth)) - 1)
+    if curve == 'hilbert':
+        x, y = hilbert_decode_many(codes, depth)
+    else:
+        x, y = deinterleave_many(codes)
+    return Cell(x, y, depth, depth)
+
+
+def to_geocode_many(cell, depth=None, curve='morton'):
+    '''
+    Vectorized to_geocode, returning int64 codes
+    '''
+    require_numpy()
+    if depth is None:
+        depth = _default_depth(cell)
+    _check_depth(depth, curve)
+    x_shift, y_shift = _shifts(cell, depth, depth)
+    x = np.asarray(cell.x).astype(np.uint64) >> np.uint64(x_shift)
+    y = np.asarray(cell.y).astype(np.uint64) >> np.uint64(y_shift)
+    if curve == 'hilbert':
+        return hilbert_encode_many(x, y, depth).view(np.int64)
+    return interleave_many(x, y).view(np.int64)
+
+
+def from_geohash_many(geohashes):
+    '''
+    Vectorized from_geohash of an array of geohashes of the same length
+    '''
+    require_numpy()
+    geohashes = np.asarray(geohashes)
+    if geohashes.dtype.kind == 'U':
+        geohashes = geohashes.astype('S')
+    if geohashes.dtype.kind != 'S':
+        raise ValueError("Expected an array of geohashes, got dtype %s" % geohashes.dtype)
+    length = geohashes.dtype.itemsize
+    x_bits, y_bits = geohash_bits(length)
+    if x_bits > 64:
+        raise ValueError("Batch conversion supports geohashes up to 25 characters")
+
+    chars = np.ascontiguousarray(geohashes).view(np.uint8).reshape(geohashes.shape + (length,))
+    values = _geohash_digits[chars]
+    if (values == 0xFF).any():
+        # Shorter geohashes are null padded by NumPy
+        raise ValueError("Invalid geohash in array: expect '%s' characters and the same length" % GEOHASH_BASE_32)
+
+    if 5 * length <= 64:
+        codes = np.zeros(geohashes.shape, dtype=np.uint64)
+        for i in range(length):
+            codes = (codes << np.uint64(5)) | values[..., i]
+        if x_bits > y_bits:
+            # The last bit is a longitude bit
+            x, y = deinterleave_many(codes >> np.uint64(1))
+            return Cell((x << np.uint64(1)) | (codes & np.uint64(1)), y, x_bits, y_bits)
+        x, y = deinterleave_many(codes)
+        return Cell(x, y, x_bits, y_bits)
+
+    # Codes wider than 64 bits, one character at a time
+    x = np.zeros(geohashes.shape, dtype=np.uint64)
+    y = np.zeros(geohashes.shape, dtype=np.uint64)
+    for i in range(length):
+        x_width, y_width = _widths(i)
+        x_parts, y_parts = [np.array(p, dtype=np.uint64) for p in zip(*_SPLIT[i % 2 == 0])]
+        x = (x << np.uint64(x_width)) | x_parts[values[..., i]]
+        y = (y << np.uint64(y_width)) | y_parts[values[..., i]]
+    return Cell(x, y, x_bits, y_bits)
+
+
+def to_geohash_many(cell, length=None):
+    '''
+    Vectorized to_geohash, returning a fixed width 'S<length>' array
+    '''
+    require_numpy()
+    if length is None:
+        length = _default_length(cell)
+    x_bits, y_bits = geohash_bits(length)
+    x_shift, y_shift = _shifts(cell, x_bits, y_bits)
+    x = np.asarray(cell.x).astype(np.uint64) >> np.uint64(x_shift)
+    y = np.asarray(cell.y).astype(np.uint64) >> np.uint64(y_shift)
+
+    chars = np.empty(x.shape + (length,), dtype=np.uint8)
+    if 5 * length <= 64:
+        if x_bits > y_bits:
+            codes = (interleave_many(x >> np.uint64(1), y) << np.uint64(1)) | (x & np.uint64(1))
+        else:
+            codes = interleave_many(x, y)
+        for i in range(length):
+            chars[..., i] = _geohash_bytes[((codes >> np.uint64(5 * (length - 1 - i))) & np.uint64(31)).astype(np.intp)]
+        return chars.view('S%d' % length).reshape(x.shape)
+
+    # Codes wider than 64 bits, one character at a time
+    for i in range(length):
+        x_width, y_width = _widths(i)
+        x_bits -= x_width
+        y_bits -= y_width
+        x_part = (x >> np.uint64(x_bits)) & np.uint64((1 << x_width) - 1)
+        y_part = (y >> np.uint64(y_bits)) & np.uint64((1 << y_width) - 1)
+        values = np.array(_JOIN[i % 2 == 0], dtype=np.uint8)[((x_part << np.uint64(y_width)) | y_part).astype(np.intp)]
+        chars[..., i] = _geohash_bytes[values]
+    return chars.view('S%d' % length).reshape(x.shape)
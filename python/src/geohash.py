@@ -91,18 +91,217 @@ Some degenerate cases:
 """
 
 
+import heapq
+from math import asin, atan2, cos, degrees, radians, sin, sqrt
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+# Bits of an axis that still turn into a float without rounding
+_FLOAT_BITS = 53
+
+# Meter, the radius of the geobox package
+EARTH_RADIUS = 6378100
+
+_SPREAD_MASKS = (
+    (16, 0x0000FFFF0000FFFF),
+    (8, 0x00FF00FF00FF00FF),
+    (4, 0x0F0F0F0F0F0F0F0F),
+    (2, 0x3333333333333333),
+    (1, 0x5555555555555555),
+)
+_COMPACT_MASKS = (
+    (1, 0x3333333333333333),
+    (2, 0x0F0F0F0F0F0F0F0F),
+    (4, 0x00FF00FF00FF00FF),
+    (8, 0x0000FFFF0000FFFF),
+    (16, 0x00000000FFFFFFFF),
+)
+
+
+def _spread_masks(value):
+    for shift, mask in _SPREAD_MASKS:
+        value = (value | (value << shift)) & mask
+    return value
+
+# Spread of every byte: four table lookups beat the five mask steps
+_SPREAD_BYTES = [_spread_masks(i) for i in range(256)]
+
+
+def _spread(value):
+    '''
+    Insert a 0 bit in front of each of the lower 32 bits of value:
+    abcd -> 0a0b0c0d
+    '''
+    return (_SPREAD_BYTES[value & 0xFF] |
+            _SPREAD_BYTES[(value >> 8) & 0xFF] << 16 |
+            _SPREAD_BYTES[(value >> 16) & 0xFF] << 32 |
+            _SPREAD_BYTES[(value >> 24) & 0xFF] << 48)
+
+
+def _compact(value):
+    '''
+    Inverse of _spread: keep the even bits of value and pack them together
+    '''
+    value &= 0x5555555555555555
+    for shift, mask in _COMPACT_MASKS:
+        value = (value | (value >> shift)) & mask
+    return value
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("NumPy is required for the batch geohash functions")
+
+
+def _spread_many(values):
+    '''
+    Vectorized _spread, returning uint64
+    '''
+    values = np.asarray(values).astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift, mask in _SPREAD_MASKS:
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def _distance(a, b):
+    '''
+    Haversine distance in meter between two (longitude, latitude) points
+    '''
+    lng1, lat1 = radians(a[0]), radians(a[1])
+    lng2, lat2 = radians(b[0]), radians(b[1])
+    h = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return EARTH_RADIUS * 2 * asin(sqrt(h))
+
+
+def _box_distance(coord, minx, miny, maxx, maxy):
+    '''
+    Distance in meter from a (longitude, latitude) point to the nearest
+    point of a box, 0 inside the box
+    '''
+    lng, lat = coord
+    # Longitude east of the west edge, in [0, 360)
+    offset = (lng - minx) % 360.0
+    width = maxx - minx
+    if offset <= width:
+        return EARTH_RADIUS * radians(max(miny - lat, lat - maxy, 0.0))
+
+    if offset - width <= 360.0 - offset:
+        edge, delta = maxx, offset - width
+    else:
+        edge, delta = minx, 360.0 - offset
+    # Nearest point of the edge meridian, clamped to the box latitudes
+    nearest = degrees(atan2(sin(radians(lat)), cos(radians(lat)) * cos(radians(delta))))
+    return _distance(coord, (edge, min(max(nearest, miny), maxy)))
+
+
+def _interleave(x, y, depth):
+    '''
+    Interleave the lower depth bits of x (odd positions) and y (even
+    positions), 32 bits at a time so that any depth works
+    '''
+    code = 0
+    for shift in range(0, depth, 32):
+        chunk = (_spread((x >> shift) & 0xFFFFFFFF) << 1) | _spread((y >> shift) & 0xFFFFFFFF)
+        code |= chunk << (2 * shift)
+    return code
+
+
+def _deinterleave(code, depth):
+    '''
+    Inverse of _interleave
+    '''
+    x = y = 0
+    for shift in range(0, depth, 32):
+        chunk = (code >> (2 * shift)) & 0xFFFFFFFFFFFFFFFF
+        x |= _compact(chunk >> 1) << shift
+        y |= _compact(chunk) << shift
+    return x, y
+
+
+def _character_cells(x_first):
+    '''
+    The (x bits, y bits) of each of the 32 values of a 5 bit character
+    starting with an x bit (True) or a y bit
+    '''
+    cells = []
+    for value in range(32):
+        x = y = 0
+        for i in range(5):
+            bit = (value >> (4 - i)) & 1
+            if (i % 2 == 0) == x_first:
+                x = (x << 1) | bit
+            else:
+                y = (y << 1) | bit
+        cells.append((x, y))
+    return cells
+
+
+# The characters of a hash start with an x bit at even positions
+CHARACTER_CELLS = {True: _character_cells(True), False: _character_cells(False)}
+
+
+def _adjacent_tables(alphabet):
+    '''
+    For the last character of a hash, starting with an x bit (odd number of
+    characters) or a y bit, and each of the N, S, E and W directions: the
+    dict of the character of the next cell, and the set of the characters
+    whose next cell is in the next parent cell
+    '''
+    moves = {'N': (0, 1), 'S': (0, -1), 'E': (1, 0), 'W': (-1, 0)}
+    tables = {}
+    for x_first in (True, False):
+        width, height = (8, 4) if x_first else (4, 8)
+        cells = dict(zip(CHARACTER_CELLS[x_first], alphabet))
+        for direction, (dx, dy) in moves.items():
+            adjacent = {}
+            borders = set()
+            for (x, y), char in cells.items():
+                if not (0 <= x + dx < width and 0 <= y + dy < height):
+                    borders.add(char)
+                adjacent[char] = cells[(x + dx) % width, (y + dy) % height]
+            tables[x_first, direction] = adjacent, frozenset(borders)
+    return tables
+
+
 class Geostring(object):
+    # Characters of a 0 and a 1 bit in the hash
+    BITS = "01"
+
+    @classmethod
+    def _to_int(cls, f, depth=32):
+        '''
+        Lower depth bits of f scaled by 2**depth and truncated
+        '''
+        return int(f * (1 << depth)) & ((1 << depth) - 1)
+
     @classmethod
     def _to_bits(cls, f, depth=32):
-        f *= (1L << depth)
-        return [(long(f) >> (depth-i)) & 1 for i in range(1, depth+1)]
+        n = cls._to_int(f, depth)
+        return [(n >> (depth-i)) & 1 for i in range(1, depth+1)]
+
+    @classmethod
+    def _to_code(cls, coord, bound=(-180, -90, 180, 90), depth=32):
+        '''
+        The 2 * depth bits of a (x, y) point as an integer, x bits first
+        '''
+        x, y = coord
+        x = cls._to_int((x-bound[0]) / float(bound[2]-bound[0]), depth)
+        y = cls._to_int((y-bound[1]) / float(bound[3]-bound[1]), depth)
+        return _interleave(x, y, depth)
 
     @classmethod
-    def bitstring(cls, (x, y), bound=(-180, -90, 180, 90), depth=32):
-        x = cls._to_bits((x-bound[0]) / float(bound[2]-bound[0]), depth)
-        y = cls._to_bits((y-bound[1]) / float(bound[3]-bound[1]), depth)
-        bits = reduce(lambda x, y: x+list(y), zip(x, y), [])
-        return "".join(map(str, bits))
+    def bitstring(cls, coord, bound=(-180, -90, 180, 90), depth=32):
+        if not depth:
+            return ""
+        return format(cls._to_code(coord, bound, depth), '0%db' % (2 * depth))
 
     def __init__(self, data, bound=(-180, -90, 180, 90), depth=32):
         self.bound = bound
@@ -118,30 +317,54 @@ class Geostring(object):
         return self.hash
 
     def _to_bbox(self, bits):
-        depth = len(bits)/2
+        if isinstance(bits, string_types) and not bits.strip("01"):
+            return self._code_bbox(int(bits, 2) if bits else 0, len(bits))
+        return self._bits_bbox(bits)
+
+    def _code_bbox(self, code, length):
+        '''
+        Bounding box of length bits given as an integer.  Same result as
+        _bits_bbox, which adds the bits one at a time: sums of powers of 2
+        are exact, as long as an axis fits in a float.
+        '''
+        depth = length//2
+        if length - depth > _FLOAT_BITS:
+            return self._bits_bbox(format(code, '0%db' % length))
+
+        if length % 2:
+            # The last bit is an x bit
+            x, y = _deinterleave(code >> 1, depth)
+            x = (x << 1) | (code & 1)
+        else:
+            x, y = _deinterleave(code, depth)
+        minx = x / float(1 << (length - depth))
+        miny = y / float(1 << depth)
+        return self._scale_bbox(minx, miny, length)
+
+    def _bits_bbox(self, bits):
+        depth = len(bits)//2
         minx = miny = 0.0
-        maxx = maxy = 1.0
         for i in range(depth+1):
             try:
-                minx += float(bits[i*2])/(2L << i)
-                miny += float(bits[i*2+1])/(2L << i)
+                minx += float(bits[i*2])/(2 << i)
+                miny += float(bits[i*2+1])/(2 << i)
             except IndexError:
                 pass
+        return self._scale_bbox(minx, miny, len(bits))
 
-        print "# %s, %s, %s, %s" % (minx, miny, maxx, maxy)
-
+    def _scale_bbox(self, minx, miny, length):
+        depth = length//2
+        maxx = maxy = 1.0
         if depth:
-            maxx = minx + 1.0/(2L << (depth-1))
-            maxy = miny + 1.0/(2L << (depth-1))
-        elif len(bits) == 1:
+            maxx = minx + 1.0/(2 << (depth-1))
+            maxy = miny + 1.0/(2 << (depth-1))
+        elif length == 1:
             # degenerate case
             maxx = min(minx + .5, 1.0)
         minx, maxx = [self.origin[0] + x * self.size[0] for x in(minx, maxx)]
         miny, maxy = [self.origin[1] + y * self.size[1] for y in(miny, maxy)]
 
-
-
-        return tuple([round(x, 6) for x in minx, miny, maxx, maxy])
+        return tuple([round(x, 6) for x in (minx, miny, maxx, maxy)])
 
     def bbox(self, prefix=None):
         if not prefix:
@@ -163,8 +386,105 @@ class Geostring(object):
 
     __add__ = union
 
+    # -----------------------------------------------------------------
+    # NumPy batch mode, for up to 64 bits per hash
+
+    @classmethod
+    def _codes_many(cls, xs, ys, bound=(-180, -90, 180, 90), depth=32):
+        '''
+        Vectorized _to_code, returning uint64 codes
+        '''
+        _require_numpy()
+        if depth > 32:
+            raise ValueError("Batch encoding supports a depth up to 32, got %s" % depth)
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        if not (np.isfinite(xs).all() and np.isfinite(ys).all()):
+            raise ValueError("Cannot encode NaN or infinite coordinates")
+        mask = np.int64((1 << depth) - 1)
+        x = np.trunc((xs-bound[0]) / float(bound[2]-bound[0]) * float(1 << depth)).astype(np.int64) & mask
+        y = np.trunc((ys-bound[1]) / float(bound[3]-bound[1]) * float(1 << depth)).astype(np.int64) & mask
+        return (_spread_many(x) << np.uint64(1)) | _spread_many(y)
+
+    @classmethod
+    def bitstring_many(cls, xs, ys, bound=(-180, -90, 180, 90), depth=32):
+        '''
+        Vectorized bitstring, returning a fixed width 'S<2 * depth>' array
+        '''
+        codes = cls._codes_many(xs, ys, bound, depth)
+        chars = np.frombuffer(cls.BITS.encode('ascii'), dtype=np.uint8)
+        bits = np.empty(codes.shape + (2 * depth,), dtype=np.uint8)
+        for i in range(2 * depth):
+            bits[..., i] = chars[((codes >> np.uint64(2 * depth - 1 - i)) & np.uint64(1)).astype(np.intp)]
+        return bits.view('S%d' % (2 * depth)).reshape(codes.shape)
+
+    @classmethod
+    def _digits_many(cls, hashes, alphabet):
+        '''
+        Array of the digit of every character of an array of hashes of the
+        same length, with its last axis running over the characters
+        '''
+        _require_numpy()
+        hashes = np.asarray(hashes)
+        if hashes.dtype.kind == 'U':
+            hashes = hashes.astype('S')
+        if hashes.dtype.kind != 'S':
+            raise ValueError("Expected an array of hashes, got dtype %s" % hashes.dtype)
+        length = hashes.dtype.itemsize
+        chars = np.ascontiguousarray(hashes).view(np.uint8).reshape(hashes.shape + (length,))
+        table = np.full(256, 0xFF, dtype=np.uint8)
+        table[np.frombuffer(alphabet.encode('ascii'), dtype=np.uint8)] = np.arange(len(alphabet))
+        digits = table[chars]
+        if (digits == 0xFF).any():
+            raise ValueError("Expected hashes of '%s' characters with the same length" % alphabet)
+        return digits
+
+    @classmethod
+    def _bbox_many(cls, digits, digit_bits, bound):
+        '''
+        Vectorized _code_bbox of an array of digits of digit_bits bits each
+        '''
+        length = digits.shape[-1] * digit_bits
+        depth = length // 2
+        if length - depth > _FLOAT_BITS:
+            raise ValueError("Batch decoding supports up to %d bits, got %d" % (2 * _FLOAT_BITS, length))
+
+        x = np.zeros(digits.shape[:-1], dtype=np.uint64)
+        y = np.zeros(digits.shape[:-1], dtype=np.uint64)
+        for i in range(length):
+            digit = digits[..., i // digit_bits].astype(np.uint64)
+            bit = (digit >> np.uint64(digit_bits - 1 - i % digit_bits)) & np.uint64(1)
+            if i % 2:
+                y = (y << np.uint64(1)) | bit
+            else:
+                x = (x << np.uint64(1)) | bit
+
+        minx = x / float(1 << (length - depth))
+        miny = y / float(1 << depth)
+        maxx = np.ones(minx.shape)
+        maxy = np.ones(miny.shape)
+        if depth:
+            maxx = minx + 1.0/(2 << (depth-1))
+            maxy = miny + 1.0/(2 << (depth-1))
+        elif length == 1:
+            maxx = np.minimum(minx + .5, 1.0)
+        size = (bound[2]-bound[0], bound[3]-bound[1])
+        return (bound[0] + minx * size[0], bound[1] + miny * size[1],
+                bound[0] + maxx * size[0], bound[1] + maxy * size[1])
+
+    @classmethod
+    def bbox_many(cls, hashes, bound=(-180, -90, 180, 90)):
+        '''
+        Vectorized bbox of an array of hashes of the same length, returning
+        the (minx, miny, maxx, maxy) arrays.  Unlike bbox, the bounds are not
+        rounded to 6 decimals.
+        '''
+        return cls._bbox_many(cls._digits_many(hashes, cls.BITS), 1, bound)
+
 
 class Geoindex(Geostring):
+    BITS = "02"
+
     def bitstring(cls, coord, bound=(-180, -90, 180, 90), depth=32):
         bits = Geostring.bitstring(coord, bound, depth)
         bits = bits.replace("1", "2")
@@ -194,23 +514,255 @@ class Geohash(Geostring):
     BASE_32 = "0123456789bcdefghjkmnpqrstuvwxyz"
 
     def bitstring(cls, coord, bound=(-180, -90, 180, 90), depth=32):
-        bits = Geostring.bitstring(coord, bound, depth)
-        hash = ""
-        for i in range(0, len(bits), 5):
-            m = sum([int(n) << (4-j) for j, n in enumerate(bits[i:i+5])])
-            hash += cls.BASE_32[m]
-        return hash
+        # The bits are cut in characters of 5 bits, the last one padded with 0
+        length = 2 * depth
+        pad = -length % 5
+        code = cls._to_code(coord, bound, depth) << pad
+        return "".join([cls.BASE_32[(code >> shift) & 31] for shift in range(length + pad - 5, -5, -5)])
     bitstring = classmethod(bitstring)
 
     def bbox(self, prefix=None):
         if not prefix:
             prefix = len(self.hash)
-        bits = [
-            [n >> (4-i) & 1 for i in range(5)]
-            for n in map(self.BASE_32.find, self.hash[:prefix])
-        ]
-        bits = reduce(lambda x, y: x + y, bits, [])
-        return self._to_bbox(bits)
+        code = 0
+        for c in self.hash[:prefix]:
+            # An invalid character reads as 11111
+            code = (code << 5) | (self.BASE_32.find(c) & 31)
+        return self._code_bbox(code, 5 * len(self.hash[:prefix]))
+
+    # -----------------------------------------------------------------
+    # Neighbors
+
+    DIRECTIONS = ('N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW')
+    _ADJACENT = _adjacent_tables(BASE_32)
+
+    @classmethod
+    def _adjacent(cls, hash, direction):
+        '''
+        Hash of the next cell in the N, S, E or W direction, None past the
+        north or south edge
+        '''
+        if not hash:
+            # The whole bound, which only wraps around east-west
+            return None if direction in ('N', 'S') else hash
+        adjacent, borders = cls._ADJACENT[len(hash) % 2 == 1, direction]
+        last = hash[-1]
+        if last not in adjacent:
+            raise ValueError("Invalid geohash character '%s'" % last)
+        parent = hash[:-1]
+        if last in borders:
+            parent = cls._adjacent(parent, direction)
+            if parent is None:
+                return None
+        return parent + adjacent[last]
+
+    def adjacent(self, direction):
+        '''
+        Return the Geohash of the same length next to this one in one of the
+        DIRECTIONS, or None past the north or south edge of the bound.  Cells
+        wrap around the east and west edges.
+        '''
+        if direction not in self.DIRECTIONS:
+            raise ValueError("Expected one of %s, got %r" % (', '.join(self.DIRECTIONS), direction))
+        hash = self.hash
+        for d in direction:
+            hash = self._adjacent(hash, d)
+            if hash is None:
+                return None
+        return type(self)(hash, self.bound, self.depth)
+
+    def neighbors(self):
+        '''
+        Return the dict of the surrounding Geohash by direction, without the
+        directions past the north or south edge
+        '''
+        result = {}
+        for direction in self.DIRECTIONS:
+            neighbor = self.adjacent(direction)
+            if neighbor is not None:
+                result[direction] = neighbor
+        return result
+
+    # -----------------------------------------------------------------
+    # Covers
+
+    @classmethod
+    def _cell_bounds(cls, hash, bound=(-180, -90, 180, 90)):
+        '''
+        Unrounded (minx, miny, maxx, maxy) of the cell of hash.  Unlike bbox,
+        a cell of an odd number of bits is twice as wide as it is high.
+        '''
+        code = 0
+        for c in hash:
+            value = cls.BASE_32.find(c)
+            if value < 0:
+                raise ValueError("Invalid geohash character '%s'" % c)
+            code = (code << 5) | value
+        length = 5 * len(hash)
+        y_bits = length // 2
+        if length % 2:
+            x, y = _deinterleave(code >> 1, y_bits)
+            x = (x << 1) | (code & 1)
+        else:
+            x, y = _deinterleave(code, y_bits)
+        width = (bound[2]-bound[0]) / float(1 << (length - y_bits))
+        height = (bound[3]-bound[1]) / float(1 << y_bits)
+        return (bound[0] + x * width, bound[1] + y * height,
+                bound[0] + (x + 1) * width, bound[1] + (y + 1) * height)
+
+    @classmethod
+    def cover_length(cls, x_delta, y_delta, max_length=12):
+        '''
+        Longest hash, up to max_length, whose cells are at least x_delta by
+        y_delta degrees: an area that far from a point is within the 3x3
+        cells around it.  0 when the area needs the whole world.
+        '''
+        length = 0
+        while length < max_length:
+            minx, miny, maxx, maxy = cls._cell_bounds("0" * (length + 1))
+            if maxx - minx < x_delta or maxy - miny < y_delta:
+                break
+            length += 1
+        return length
+
+    @classmethod
+    def cover_radius(cls, coord, radius, max_cells=16, max_length=12):
+        '''
+        Return the sorted list of geohash prefixes whose cells cover the
+        circle of radius meter around coord, a (longitude, latitude) tuple.
+
+        Like GeoBoxEncoder.cover_circle, the search starts with the cell of
+        the center and its neighbors, then splits the cells crossing the
+        circle while the result stays within max_cells.  Every point of the
+        circle has a geohash starting with one of the prefixes, so a radius
+        query on a geohash keyed store becomes one prefix scan per prefix.
+        '''
+        lat = coord[1]
+        angle = float(radius) / EARTH_RADIUS
+        y_delta = degrees(angle)
+        if abs(lat) + y_delta < 90.0:
+            x_delta = degrees(asin(min(sin(angle) / cos(radians(lat)), 1.0)))
+        else:
+            x_delta = 180.0
+
+        def intersects(minx, miny, maxx, maxy):
+            return _box_distance(coord, minx, miny, maxx, maxy) <= radius
+
+        def contains(minx, miny, maxx, maxy):
+            corners = ((minx, miny), (maxx, miny), (minx, maxy), (maxx, maxy))
+            return all(_distance(coord, corner) <= radius for corner in corners)
+
+        return cls._cover(coord, x_delta, y_delta, intersects, contains, max_cells, max_length)
+
+    @classmethod
+    def cover_bbox(cls, bbox, max_cells=16, max_length=12):
+        '''
+        Return the sorted list of geohash prefixes whose cells cover the
+        (minx, miny, maxx, maxy) longitude/latitude rectangle, see
+        cover_radius.  A rectangle crossing the 180 meridian has a minx
+        greater than its maxx.
+        '''
+        lng_min, lat_min, lng_max, lat_max = bbox
+        width = (lng_max - lng_min) % 360.0 or (360.0 if lng_max != lng_min else 0.0)
+        center = ((lng_min + width / 2 + 180.0) % 360.0 - 180.0, (lat_min + lat_max) / 2)
+        if lng_min <= lng_max:
+            lng_ranges = [(lng_min, lng_max)]
+        else:
+            lng_ranges = [(lng_min, 180.0), (-180.0, lng_max)]
+
+        def intersects(minx, miny, maxx, maxy):
+            if lat_max < miny or lat_min > maxy:
+                return False
+            return any(west <= maxx and minx <= east for west, east in lng_ranges)
+
+        def contains(minx, miny, maxx, maxy):
+            if miny < lat_min or maxy > lat_max:
+                return False
+            return any(west <= minx and maxx <= east for west, east in lng_ranges)
+
+        return cls._cover(center, width / 2, (lat_max - lat_min) / 2, intersects, contains, max_cells, max_length)
+
+    @classmethod
+    def _cover(cls, center, x_delta, y_delta, intersects, contains, max_cells, max_length):
+        '''
+        Shared covering logic of cover_radius and cover_bbox
+        '''
+        length = cls.cover_length(x_delta, y_delta, max_length)
+        if length:
+            first = cls(center)
+            first = cls(first.hash[:length], first.bound, first.depth)
+            start = set([first.hash]) | set(n.hash for n in first.neighbors().values())
+        else:
+            length = 1
+            start = set(cls.BASE_32)
+        cells = set(c for c in start if intersects(*cls._cell_bounds(c)))
+
+        # Too many cells for the budget: merge them into their parents
+        while len(cells) > max_cells and length > 0:
+            length -= 1
+            cells = set(c[:length] for c in cells)
+
+        # Split the largest cells crossing the area edge while the budget allows
+        heap = [(len(c), c) for c in cells]
+        heapq.heapify(heap)
+        while heap:
+            _, cell = heapq.heappop(heap)
+            if len(cell) >= max_length or contains(*cls._cell_bounds(cell)):
+                continue
+            children = [cell + c for c in cls.BASE_32 if intersects(*cls._cell_bounds(cell + c))]
+            if len(cells) - 1 + len(children) > max_cells:
+                continue
+            cells.remove(cell)
+            for child in children:
+                cells.add(child)
+                heapq.heappush(heap, (len(child), child))
+
+        return sorted(cls._merge_cells(cells))
+
+    @classmethod
+    def _merge_cells(cls, cells):
+        '''
+        Replace the 32 children of a cell by the cell itself, as long as possible
+        '''
+        cells = set(cells)
+        merged = True
+        while merged:
+            merged = False
+            for parent in set(c[:-1] for c in cells if c):
+                children = [parent + c for c in cls.BASE_32]
+                if all(child in cells for child in children):
+                    cells.difference_update(children)
+                    cells.add(parent)
+                    merged = True
+        return cells
+
+    @classmethod
+    def bitstring_many(cls, xs, ys, bound=(-180, -90, 180, 90), depth=32):
+        '''
+        Vectorized bitstring, returning a fixed width 'S<characters>' array
+        '''
+        codes = cls._codes_many(xs, ys, bound, depth)
+        length = 2 * depth
+        alphabet = np.frombuffer(cls.BASE_32.encode('ascii'), dtype=np.uint8)
+        count = (length + 4) // 5
+        chars = np.empty(codes.shape + (count,), dtype=np.uint8)
+        for i in range(count):
+            # The last character is padded with 0 bits
+            shift = length - 5 * (i + 1)
+            if shift >= 0:
+                digit = codes >> np.uint64(shift)
+            else:
+                digit = codes << np.uint64(-shift)
+            chars[..., i] = alphabet[(digit & np.uint64(31)).astype(np.intp)]
+        return chars.view('S%d' % count).reshape(codes.shape)
+
+    @classmethod
+    def bbox_many(cls, hashes, bound=(-180, -90, 180, 90)):
+        '''
+        Vectorized bbox, see Geostring.bbox_many
+        '''
+        return cls._bbox_many(cls._digits_many(hashes, cls.BASE_32), 5, bound)
+
 
 if __name__ == "__main__":
     import sys
@@ -218,6 +770,6 @@ if __name__ == "__main__":
         import doctest
         doctest.testmod(verbose=True)
     elif len(sys.argv) == 2:
-        print Geohash(sys.argv[1]).bbox()
+        print(Geohash(sys.argv[1]).bbox())
     else:
-        print Geohash(map(float, sys.argv[1:3]))
+        print(Geohash(tuple(map(float, sys.argv[1:3]))))
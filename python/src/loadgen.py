@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+'''
+Load generator for geobox.server, Python 3 only.  Run it from python/src:
+
+    python3 loadgen.py                          # in-process server, batched vs unbatched
+    python3 loadgen.py --port 8765 --op all     # a server started with python -m geobox.server
+
+Every connection keeps up to --concurrency requests in flight.  The client
+side latency of every request is measured from its write to its response;
+the server side statistics come from its 'stats' operation.
+'''
+import argparse
+import asyncio
+import json
+import random
+import sys
+from timeit import default_timer
+
+from geobox import GeoBoxEncoder
+from geobox.server import MAX_BATCH, MAX_PENDING, WINDOW, GeoServer
+
+OPERATIONS = ('encode', 'decode', 'neighbors', 'distance')
+
+
+def requests(op, count, seed):
+    rnd = random.Random(seed)
+    for i in range(count):
+        lat, lng = rnd.uniform(-90, 90), rnd.uniform(-180, 180)
+        kind = rnd.choice(OPERATIONS) if op == 'all' else op
+        if kind == 'encode':
+            yield {'id': i, 'op': 'encode', 'lat': lat, 'lng': lng, 'precision': 12}
+        elif kind == 'distance':
+            yield {'id': i, 'op': 'distance', 'from': [lat, lng], 'to': [rnd.uniform(-90, 90), rnd.uniform(-180, 180)]}
+        else:
+            yield {'id': i, 'op': kind, 'geobox_id': GeoBoxEncoder.encode(lat, lng, 12)}
+
+
+async def client(host, port, path, op, count, concurrency, seed, latencies):
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    slots = asyncio.Semaphore(concurrency)
+    sent = {}
+    errors = [0]
+
+    async def receive():
+        for _ in range(count):
+            response = json.loads(await reader.readline())
+            latencies.append(default_timer() - sent.pop(response['id']))
+            errors[0] += 'error' in response
+            slots.release()
+
+    receiver = asyncio.ensure_future(receive())
+    for request in requests(op, count, seed):
+        await slots.acquire()
+        sent[request['id']] = default_timer()
+        writer.write((json.dumps(request) + '\n').encode('utf-8'))
+        await writer.drain()
+    await receiver
+    writer.close()
+    await writer.wait_closed()
+    return errors[0]
+
+
+async def stats(host, port, path):
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"id": 0, "op": "stats"}\n')
+    response = json.loads(await reader.readline())
+    writer.close()
+    await writer.wait_closed()
+    return response['result']
+
+
+def quantile(values, q):
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+async def run(args, host, port, path):
+    latencies = []
+    start = default_timer()
+    errors = await asyncio.gather(*[
+        client(host, port, path, args.op, args.requests, args.concurrency, seed, latencies)
+        for seed in range(args.connections)])
+    elapsed = default_timer() - start
+    latencies.sort()
+    print("  {0:>10.0f} req/s   client p50 {1:8.3f} ms   p99 {2:8.3f} ms   errors {3}".format(
+        len(latencies) / elapsed, quantile(latencies, 0.5) * 1e3, quantile(latencies, 0.99) * 1e3, sum(errors)))
+
+    snapshot = await stats(host, port, path)
+    for name in sorted(snapshot):
+        if name.startswith('batch:'):
+            operation = name[len('batch:'):]
+            print("  {0:10} {1:8d} requests in {2:6d} batches, server p50 <= {3} us, p99 <= {4} us".format(
+                operation, snapshot[operation]['count'], snapshot[name]['count'],
+                snapshot[operation]['p50'], snapshot[operation]['p99']))
+
+
+async def local(args, window, max_batch):
+    server = GeoServer(window, max_batch, args.max_pending)
+    listening = await server.start('127.0.0.1', 0)
+    try:
+        await run(args, '127.0.0.1', listening.sockets[0].getsockname()[1], None)
+    finally:
+        await server.stop()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Load generator for geobox.server.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help="server to load, one is started in-process when not given")
+    parser.add_argument('--unix', metavar='PATH', help="server Unix socket")
+    parser.add_argument('--op', choices=OPERATIONS + ('all',), default='encode')
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=5000, help="requests per connection")
+    parser.add_argument('--concurrency', type=int, default=64, help="requests in flight per connection")
+    parser.add_argument('--window', type=float, default=WINDOW * 1000, help="in-process server window, milliseconds")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    print("%d connections x %d '%s' requests, %d in flight per connection" % (
+        args.connections, args.requests, args.op, args.concurrency))
+    if args.port is not None or args.unix is not None:
+        asyncio.run(run(args, args.host, args.port, args.unix))
+        return 0
+
+    print("unbatched: max_batch=1")
+    asyncio.run(local(args, 0.0, 1))
+    print("batched: window=%g ms, max_batch=%d" % (args.window, args.max_batch))
+    asyncio.run(local(args, args.window / 1000.0, args.max_batch))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
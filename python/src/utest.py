@@ -2,7 +2,32 @@
 
 import unittest
 from gbox import Geocode
+from geobox import GeoBoxEncoder, GeoIndex, GeoPoint, GeoPointArray, GeoPointEncoder
+from geobox import serialize
+from geobox import CellPyramid, GeofenceEngine, PolygonIndex, geometry
+from geobox import storage
+from geobox.cache import LRUCache
+from geobox.metrics import Metrics
+from geobox import cli
+from geobox import transcode
+from geohash import Geohash, Geoindex, Geostring
+import geobox
+import threading
 import json
+import math
+import os
+import pickle
+import random
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 class GeoBoxTestCase(unittest.TestCase):
     def setUp(self):
@@ -34,9 +59,1279 @@ class GeoBoxTestCase(unittest.TestCase):
             
             for coord, gpoint in g.gbox().iteritems():
                 expected_gpoint = data['gbox'][coord]
-                self.assertItemsEqual(gpoint, expected_gpoint, "Expect gbox['%s'] from %s to match.  Expected %s; got %s" % (coord, loc_name, gpoint, expected_gpoint))
+                self.assertEqual(list(gpoint), expected_gpoint, "Expect gbox['%s'] from %s to match.  Expected %s; got %s" % (coord, loc_name, expected_gpoint, gpoint))
             
 
+def find_position(position, lbound, ubound):
+    '''
+    For given position, compare it to the mid point between lower bound (lbound) and
+    upper bound (ubound).  If after mid point, return 1 and set new lower bound as
+    mid point.  Otherwise return 0 and set upper bound as mid point.
+    '''
+    mid = (lbound + ubound) / 2.0
+    if position > mid:
+        bit = 1
+        lres = mid
+        ures = ubound
+    else:
+        bit = 0
+        lres = lbound
+        ures = mid
+
+    return bit, lres, ures
+
+
+def geocode_bisect(loc, depth):
+    '''
+    Reference implementation of Geocode._calcGeocode: find the postion (both lon and
+    lat) if above or below mid point of the bound, per find_position function,
+    repeated for number of depth provided.
+    '''
+    x, y = loc
+    x_lbound, x_ubound = Geocode.LON_BOUND
+    y_lbound, y_ubound = Geocode.LAT_BOUND
+
+    result = 0
+    for l in range(depth):
+        x_bit, x_lbound, x_ubound = find_position(x, x_lbound, x_ubound)
+        y_bit, y_lbound, y_ubound = find_position(y, y_lbound, y_ubound)
+
+        # Reverse the index
+        i = depth - l - 1
+
+        # Calculate the interleave value
+        result_index = i * 2
+
+        if x_bit:
+            result += 1 << (result_index+1)
+
+        if y_bit:
+            result += 1 << result_index
+
+    # Convert unsigned 64bit long into a signed version
+    u64int = struct.pack("Q", result)
+    s64int = struct.unpack("q", u64int)[0]
+
+    return s64int, (x_lbound, y_lbound, x_ubound, y_ubound)
+
+
+class GeocodeTestCase(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2013)
+        self.points = [(rnd.uniform(-180, 180), rnd.uniform(-90, 90)) for _ in range(500)]
+        # Cell edges, bounds and out of range values
+        self.points += [(0, 0), (0, 51.48), (-180, -90), (180, 90), (90, 45), (-90, -45), (200, -100)]
+
+    def test10_matches_bisection(self):
+        for depth in (32, 17, 1, 0):
+            for lon, lat in self.points:
+                g = Geocode(lon, lat, depth)
+                gcode, gbox_coord = geocode_bisect((lon, lat), depth)
+                self.assertEqual(g.gcode(), gcode)
+                self.assertEqual(g._gbox_coord, gbox_coord)
+
+    def test11_from_code(self):
+        for depth in (32, 17, 1):
+            for lon, lat in self.points:
+                g = Geocode(lon, lat, depth)
+                decoded = Geocode.from_code(g.gcode(), depth)
+                self.assertEqual(decoded.gcode(), g.gcode())
+                self.assertEqual(decoded.gbox(), g.gbox())
+                self.assertEqual(Geocode(decoded.gpoint()[0], decoded.gpoint()[1], depth).gcode(), g.gcode())
+
+        box = Geocode(2.5, 1.5, 2).gbox()
+        self.assertEqual(box, {'SW': (0.0, 0.0), 'SE': (90.0, 0.0), 'NW': (0.0, 45.0), 'NE': (90.0, 45.0)})
+        self.assertRaises(ValueError, Geocode, 0, 0, 33)
+
+    def assertRangesCover(self, ranges, codes, max_ranges):
+        self.assertTrue(0 < len(ranges) <= max_ranges)
+        for (lo, hi), (next_lo, _) in zip(ranges, ranges[1:]):
+            # Sorted, disjoint and merged
+            self.assertTrue(lo <= hi < next_lo - 1)
+        for code in codes:
+            self.assertTrue(any(lo <= code <= hi for lo, hi in ranges), code)
+
+    def test13_ranges_bbox(self):
+        rnd = random.Random(2013)
+        # Around the 0 meridian the codes change sign, then across the 180
+        # meridian, the equator, and a single point on cell edges
+        for bbox in ((-0.5, 51.2, 0.3, 51.7), (170.0, -10.0, -170.0, 10.0), (-20.0, -5.0, 20.0, 5.0), (0.0, 0.0, 0.0, 0.0)):
+            lon_min, lat_min, lon_max, lat_max = bbox
+            width = (lon_max - lon_min) % 360.0
+            points = [((lon_min + rnd.uniform(0, width) + 180.0) % 360.0 - 180.0, rnd.uniform(lat_min, lat_max))
+                      for _ in range(300)]
+            points += [(lon_min, lat_min), (lon_max, lat_max), (lon_min, lat_max), (lon_max, lat_min)]
+            for depth in (32, 20):
+                codes = [Geocode(lon, lat, depth).gcode() for lon, lat in points]
+                for max_ranges in (1, 4, 16, 64):
+                    self.assertRangesCover(Geocode.ranges_bbox(*bbox, max_ranges=max_ranges, depth=depth), codes, max_ranges)
+
+        self.assertEqual(Geocode.ranges_bbox(-180, -90, 180, 90), [(-1 << 63, (1 << 63) - 1)])
+        self.assertEqual(Geocode.ranges_bbox(0, 10, 1, 5), [])
+        self.assertRaises(ValueError, Geocode.ranges_bbox, 0, 0, 1, 1, 0)
+
+    def test14_ranges_circle(self):
+        rnd = random.Random(2013)
+        for lon, lat, radius in ((0.0, 51.48, 20000.0), (12.48, 41.87, 500.0), (179.9, 0.0, 50000.0)):
+            # Sample the bounding square of the circle, keeping what is inside
+            lat_delta = radius / 111000.0
+            lon_delta = lat_delta / math.cos(math.radians(lat))
+            points = []
+            while len(points) < 300:
+                x, y = lon + rnd.uniform(-lon_delta, lon_delta), lat + rnd.uniform(-lat_delta, lat_delta)
+                if GeoBoxEncoder.haversine((lat, lon), (y, x)) <= radius:
+                    points.append(((x + 180.0) % 360.0 - 180.0, y))
+            codes = [Geocode(x, y).gcode() for x, y in points]
+            for max_ranges in (1, 8, 32):
+                ranges = Geocode.ranges_circle(lon, lat, radius, max_ranges)
+                self.assertRangesCover(ranges, codes, max_ranges)
+
+    def test15_hilbert(self):
+        for depth in (32, 17, 1):
+            for lon, lat in self.points:
+                g = Geocode(lon, lat, depth, 'hilbert')
+                morton = Geocode(lon, lat, depth)
+                self.assertEqual(g.gbox(), morton.gbox())
+                decoded = Geocode.from_code(g.gcode(), depth, 'hilbert')
+                self.assertEqual(decoded.gbox(), g.gbox())
+                if depth > 1:
+                    self.assertEqual(Geocode(lon, lat, depth - 1, 'hilbert').gcode(), (g.gcode() % (1 << 64)) >> 2)
+
+        rnd = random.Random(2013)
+        points = [(rnd.uniform(-0.5, 0.3), rnd.uniform(51.2, 51.7)) for _ in range(300)]
+        codes = [Geocode(lon, lat, curve='hilbert').gcode() for lon, lat in points]
+        for max_ranges in (1, 4, 16):
+            self.assertRangesCover(Geocode.ranges_bbox(-0.5, 51.2, 0.3, 51.7, max_ranges, curve='hilbert'), codes, max_ranges)
+            self.assertRangesCover(Geocode.ranges_circle(0.0, 51.48, 20000.0, max_ranges, curve='hilbert'),
+                                   [c for c, (lon, lat) in zip(codes, points)
+                                    if GeoBoxEncoder.haversine((51.48, 0.0), (lat, lon)) <= 20000.0], max_ranges)
+
+    @unittest.skipIf(np is None, 'numpy not installed')
+    def test12_batch(self):
+        lons = np.array([p[0] for p in self.points])
+        lats = np.array([p[1] for p in self.points])
+        for depth in (32, 17, 1):
+            codes = Geocode.encode_many(lons, lats, depth)
+            self.assertEqual(codes.dtype, np.int64)
+            self.assertEqual(codes.tolist(), [Geocode(lon, lat, depth).gcode() for lon, lat in self.points])
+
+            (x, y), lbound, ubound = Geocode.decode_many(codes, depth, box=True)
+            for i, code in enumerate(codes.tolist()):
+                x_lbound, y_lbound, x_ubound, y_ubound = Geocode.from_code(code, depth)._gbox_coord
+                self.assertEqual((lbound[0][i], lbound[1][i], ubound[0][i], ubound[1][i]),
+                                 (x_lbound, y_lbound, x_ubound, y_ubound))
+                self.assertEqual((x[i], y[i]), Geocode.from_code(code, depth).gpoint())
+
+            codes = Geocode.encode_many(lons, lats, depth, 'hilbert')
+            self.assertEqual(codes.tolist(), [Geocode(lon, lat, depth, 'hilbert').gcode() for lon, lat in self.points])
+            self.assertTrue((Geocode.decode_many(codes, depth, curve='hilbert')[0] == x).all())
+
+
+class GeoBoxEncoderTestCase(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2013)
+        self.points = [(rnd.uniform(-90, 90), rnd.uniform(-180, 180)) for _ in range(2000)]
+        # Points sitting exactly on cell edges exercise the '>' vs '<=' rule
+        for precision in (2, 9, 18, 32):
+            unit = 180.0 / (1 << (precision - 1))
+            for k in (-2, -1, 0, 1, 2):
+                self.points.append((k * unit, k * unit))
+                self.points.append((90 - k * unit, -180 + k * unit))
+        self.points.extend([(90, 180), (-90, -180), (0, 0), (95, 200), (-95, -200)])
+
+    def test10_encode_matches_bisection(self):
+        for lat, lng in self.points:
+            for precision in (1, 2, 18, 31, 32):
+                expected = GeoBoxEncoder._encode_bisect(lat, lng, precision, box=True)
+                got = GeoBoxEncoder.encode(lat, lng, precision, box=True)
+                self.assertEqual(got, expected, "Expect encode(%s, %s, %s) to match.  Expected %s; got %s" % (lat, lng, precision, expected, got))
+
+    def test11_decode_matches_bisection(self):
+        for lat, lng in self.points:
+            geobox_id = GeoBoxEncoder.encode(lat, lng, GeoBoxEncoder.MAX_PRECISION)
+            for precision in (1, 2, 18, 32):
+                expected = GeoBoxEncoder._decode_bisect(geobox_id[:precision], box=True)
+                got = GeoBoxEncoder.decode(geobox_id[:precision], box=True)
+                self.assertEqual(got, expected, "Expect decode(%s) to match.  Expected %s; got %s" % (geobox_id[:precision], expected, got))
+
+    def test12_integer_code(self):
+        geobox_id = GeoBoxEncoder.encode(41.87643118161227, 12.481563961993402)
+        self.assertEqual(geobox_id, 'eagacagacctggaaaga')
+        code = GeoBoxEncoder.id_to_code(geobox_id)
+        self.assertEqual(GeoBoxEncoder.code_to_id(code, len(geobox_id)), geobox_id)
+        self.assertEqual(code, GeoBoxEncoder.encode_int(41.87643118161227, 12.481563961993402))
+        self.assertRaises(ValueError, GeoBoxEncoder.id_to_code, 'xgat')
+
+    @unittest.skipIf(np is None, 'numpy not installed')
+    def test13_batch_matches_scalar(self):
+        lats = np.array([p[0] for p in self.points])
+        lngs = np.array([p[1] for p in self.points])
+        for precision in (1, 2, 18, 32):
+            ids = GeoBoxEncoder.encode_many(lats, lngs, precision)
+            self.assertEqual(ids.dtype, np.dtype('S%d' % precision))
+            codes = GeoBoxEncoder.encode_many(lats, lngs, precision, codes=True)
+            (lat, lng), latLng_SW, latLng_NE = GeoBoxEncoder.decode_many(ids, box=True)
+            self.assertTrue((GeoBoxEncoder.decode_many(codes, precision)[0] == lat).all())
+
+            for i, (latitude, longitude) in enumerate(self.points):
+                geobox_id = GeoBoxEncoder.encode(latitude, longitude, precision)
+                self.assertEqual(ids[i].decode('ascii'), geobox_id)
+                self.assertEqual(int(codes[i]), GeoBoxEncoder.id_to_code(geobox_id))
+                expected = GeoBoxEncoder.decode(geobox_id, box=True)
+                got = ((lat[i], lng[i]), (latLng_SW[0][i], latLng_SW[1][i]), (latLng_NE[0][i], latLng_NE[1][i]))
+                self.assertEqual(got, expected)
+
+        self.assertRaises(ValueError, GeoBoxEncoder.decode_many, np.array(['eag', 'ea']))
+        self.assertRaises(ValueError, GeoBoxEncoder.decode_many, np.array(['gag']))
+
+    @unittest.skipIf(np is None, 'numpy not installed')
+    def test14_haversine_batch(self):
+        lats = np.array([p[0] for p in self.points])
+        lngs = np.array([p[1] for p in self.points])
+        origin = (45.0, 179.5)
+        distances = GeoBoxEncoder.haversine_many(origin, lats, lngs)
+        matrix = GeoBoxEncoder.haversine_matrix(lats[:50], lngs[:50], lats, lngs, chunk_size=1000)
+        for i, latLng in enumerate(self.points):
+            self.assertAlmostEqual(distances[i], GeoBoxEncoder.haversine(origin, latLng), places=4)
+        for i in range(50):
+            self.assertAlmostEqual(matrix[i, 7], GeoBoxEncoder.haversine(self.points[i], self.points[7]), places=4)
+
+        for radius in (1000.0, 500000.0, 5000000.0):
+            indices, within = GeoBoxEncoder.within_distance(origin, lats, lngs, radius)
+            self.assertEqual(indices.tolist(), np.flatnonzero(distances <= radius).tolist())
+            self.assertTrue((within <= radius).all())
+
+    def test15_neighbors(self):
+        geobox_id = GeoBoxEncoder.encode(10.0, 10.0)
+        center = GeoBoxEncoder.decode(geobox_id)
+        spacing = 180 / (2.0 ** (len(geobox_id) - 1))
+        offsets = dict((direction, (lat, lng)) for direction, lat, lng in GeoBoxEncoder.NEIGHBORS)
+        neighbors = GeoBoxEncoder.neighbors(geobox_id)
+        self.assertEqual(len(neighbors), 8)
+        for direction, neighbor in neighbors:
+            lat, lng = offsets[direction]
+            expected = GeoBoxEncoder.encode(center[0] + lat * spacing, center[1] + lng * spacing, len(geobox_id))
+            self.assertEqual(neighbor, expected)
+
+        # Wrap around the 180 meridian, nothing north of the pole
+        corner = dict(GeoBoxEncoder.neighbors(GeoBoxEncoder.encode(89.99, 179.99, 5)))
+        self.assertEqual(sorted(corner), ['E', 'S', 'SE', 'SW', 'W'])
+        self.assertEqual(corner['E'], GeoBoxEncoder.encode(89.99, -179.99, 5))
+        self.assertEqual(GeoBoxEncoder.neighbors('e', bearing=False), set(['w']))
+
+    @unittest.skipIf(np is None, 'numpy not installed')
+    def test16_neighbors_batch(self):
+        ids = [GeoBoxEncoder.encode(lat, lng) for lat, lng in self.points]
+        result = GeoBoxEncoder.neighbors_many(np.array(ids))
+        codes = GeoBoxEncoder.neighbors_many(GeoBoxEncoder.ids_to_codes(np.array(ids)), len(ids[0]), codes=True)
+        for i, geobox_id in enumerate(ids):
+            expected = dict(GeoBoxEncoder.neighbors(geobox_id))
+            for k, (direction, _, _) in enumerate(GeoBoxEncoder.NEIGHBORS):
+                if direction in expected:
+                    self.assertEqual(result[i, k].decode('ascii'), expected[direction])
+                    self.assertEqual(int(codes[i, k]), GeoBoxEncoder.id_to_code(expected[direction]))
+                else:
+                    self.assertEqual(result[i, k], b'')
+                    self.assertEqual(int(codes[i, k]), GeoBoxEncoder.NO_CODE)
+
+    def test17_cover(self):
+        rnd = random.Random(2013)
+        for lat, lng, radius, max_cells in ((41.9, 12.5, 1000, 16), (0.0, 179.99, 20000, 8), (89.9, 10.0, 30000, 16)):
+            cells = GeoBoxEncoder.cover_circle(lat, lng, radius, max_cells)
+            self.assertTrue(len(cells) <= max_cells)
+            for _ in range(500):
+                point = (lat + rnd.uniform(-0.3, 0.3), (lng + rnd.uniform(-2, 2) + 180) % 360 - 180)
+                if point[0] <= 90 and GeoBoxEncoder.haversine((lat, lng), point) <= radius:
+                    geobox_id = GeoBoxEncoder.encode(point[0], point[1], GeoBoxEncoder.MAX_PRECISION)
+                    self.assertTrue(any(geobox_id.startswith(c) for c in cells), "%s not covered by %s" % (geobox_id, cells))
+
+        for latLng_SW, latLng_NE in (((41.0, 12.0), (42.0, 13.0)), ((-10.0, 170.0), (10.0, -170.0)), ((0.0, -0.5), (0.1, 0.0))):
+            cells = GeoBoxEncoder.cover_bbox(latLng_SW, latLng_NE, 8)
+            self.assertTrue(len(cells) <= 8)
+            width = (latLng_NE[1] - latLng_SW[1]) % 360
+            for _ in range(500):
+                lat = rnd.choice([latLng_SW[0], latLng_NE[0], rnd.uniform(latLng_SW[0], latLng_NE[0])])
+                lng = (latLng_SW[1] + rnd.choice([0, width, rnd.uniform(0, width)]) + 180) % 360 - 180
+                geobox_id = GeoBoxEncoder.encode(lat, lng, GeoBoxEncoder.MAX_PRECISION)
+                self.assertTrue(any(geobox_id.startswith(c) for c in cells), "%s not covered by %s" % (geobox_id, cells))
+
+        # At least one cell per hemisphere when the area straddles them
+        self.assertEqual(GeoBoxEncoder.cover_circle(0.0, 179.99, 20000, 1), ['e', 'w'])
+        self.assertEqual(GeoBoxEncoder.cover_circle(0.0, 0.0, 1000, 1), ['e', 'w'])
+        self.assertEqual(GeoBoxEncoder.cover_bbox((-10.0, 170.0), (10.0, -170.0), 1), ['e', 'w'])
+        self.assertEqual(len(GeoBoxEncoder.cover_circle(41.9, 12.5, 1000, 1)), 1)
+
+        self.assertEqual(GeoBoxEncoder.prefix_range('wa', 3), (4, 7))
+
+    def test18_hilbert(self):
+        for precision in (1, 2, 5, 18, 32):
+            for lat, lng in self.points:
+                morton = GeoBoxEncoder.encode_int(lat, lng, precision)
+                hilbert = GeoBoxEncoder.encode_int(lat, lng, precision, curve='hilbert')
+                self.assertEqual(hilbert >> (2 * (precision - 1)), morton >> (2 * (precision - 1)))
+                self.assertEqual(GeoBoxEncoder.to_curve(morton, precision), hilbert)
+                self.assertEqual(GeoBoxEncoder.from_curve(hilbert, precision), morton)
+                self.assertEqual(GeoBoxEncoder.code_bounds(hilbert, precision, 'hilbert'),
+                                 GeoBoxEncoder.code_bounds(morton, precision))
+                prefix = GeoBoxEncoder.code_to_id(morton, precision)[:max(precision // 2, 1)]
+                lowest, highest = GeoBoxEncoder.prefix_range(prefix, precision, 'hilbert')
+                self.assertTrue(lowest <= hilbert <= highest)
+
+        # Consecutive codes of a hemisphere are neighbor boxes
+        cells = [GeoBoxEncoder.cell_indices(GeoBoxEncoder.from_curve(code, 5), 5) for code in range(256, 512)]
+        for (lng_a, lat_a), (lng_b, lat_b) in zip(cells, cells[1:]):
+            self.assertEqual(abs(lng_a - lng_b) + abs(lat_a - lat_b), 1)
+
+        prefixes = GeoBoxEncoder.cover_circle(51.48, 0.0, 20000.0, 16)
+        for curve in GeoBoxEncoder.CURVES:
+            ranges = GeoBoxEncoder.prefix_ranges(prefixes, curve=curve)
+            self.assertTrue(len(ranges) <= len(prefixes))
+            for prefix in prefixes:
+                lowest, highest = GeoBoxEncoder.prefix_range(prefix, curve=curve)
+                self.assertTrue(any(lo <= lowest and highest <= hi for lo, hi in ranges))
+        self.assertRaises(ValueError, GeoBoxEncoder.encode_int, 0.0, 0.0, 5, 'peano')
+
+    @unittest.skipIf(np is None, 'numpy not installed')
+    def test19_hilbert_batch(self):
+        lats = np.array([p[0] for p in self.points])
+        lngs = np.array([p[1] for p in self.points])
+        for precision in (1, 18, 32):
+            codes = GeoBoxEncoder.encode_many(lats, lngs, precision, codes=True, curve='hilbert')
+            self.assertEqual(codes.tolist(), [GeoBoxEncoder.encode_int(lat, lng, precision, 'hilbert')
+                                              for lat, lng in self.points])
+            morton = GeoBoxEncoder.encode_many(lats, lngs, precision, codes=True)
+            self.assertTrue((GeoBoxEncoder.from_curve_many(codes, precision) == morton).all())
+            self.assertTrue((GeoBoxEncoder.to_curve_many(morton, precision) == codes).all())
+            self.assertTrue((GeoBoxEncoder.decode_many(codes, precision, curve='hilbert')[0] ==
+                             GeoBoxEncoder.decode_many(morton, precision)[0]).all())
+        self.assertRaises(ValueError, GeoBoxEncoder.encode_many, lats, lngs, 5, False, 'hilbert')
+
+
+class GeoPointTestCase(unittest.TestCase):
+    def test10_lazy_box(self):
+        g = GeoPoint(latitude=41.87643118161227, longitude=12.481563961993402)
+        self.assertEqual(g.gcode, 'eagacagacctggaaaga')
+        self.assertEqual(GeoPoint(latitude=1.0, longitude=2.0, build_box=False).box, None)
+        self.assertTrue(g.box is g.box)
+        self.assertTrue(g.neighbors() is g.neighbors())
+
+    def test11_box_corners_match_encode(self):
+        # Corners are derived from the cell indices, check them against encode
+        rnd = random.Random(2013)
+        points = [(rnd.uniform(-90, 90), rnd.uniform(-180, 180)) for _ in range(500)]
+        points.extend([(89.9, -0.1), (-89.9, 0.1), (0.1, -179.9), (-0.1, 179.9)])
+        for lat, lng in points:
+            for precision in (1, 2, 18, 32):
+                g = GeoPoint(latitude=lat, longitude=lng, precision=precision)
+                for name, corner in g.box.items():
+                    expected = GeoBoxEncoder.encode(corner.latitude, corner.longitude, precision)
+                    self.assertEqual(corner.gcode, expected, "Expect box['%s'] of %s to match.  Expected %s; got %s" % (name, g.gcode, expected, corner.gcode))
+
+    def test12_pickle(self):
+        points = [GeoPoint(1, 2), GeoPoint(41.87643118161227, 12.481563961993402, precision=24),
+                  GeoPoint(geobox_id='etca'), GeoPoint(1, 2, build_box=False)]
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            for g in points:
+                copy = pickle.loads(pickle.dumps(g, protocol))
+                self.assertEqual((copy.latitude, copy.longitude, copy.precision, copy.gcode),
+                                 (g.latitude, g.longitude, g.precision, g.gcode))
+                self.assertEqual(copy.box is None, g.box is None)
+        self.assertEqual(pickle.loads(pickle.dumps(GeoPoint(1, 2))).box['SW'].gcode, GeoPoint(1, 2).box['SW'].gcode)
+
+
+class CacheTestCase(unittest.TestCase):
+    def tearDown(self):
+        geobox.disable_cache()
+
+    def test10_lru(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'evictions': 1, 'size': 2, 'maxsize': 2})
+        self.assertRaises(ValueError, LRUCache, 0)
+
+    def test11_threads(self):
+        cache = LRUCache(50)
+
+        def work():
+            for i in range(2000):
+                cache.get_or_compute(i % 100, lambda: i % 100)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = cache.stats()
+        self.assertEqual(stats['hits'] + stats['misses'], 8000)
+        self.assertEqual(stats['size'], 50)
+
+    def test12_encoder_cache(self):
+        geobox_id = GeoBoxEncoder.encode(41.87643118161227, 12.481563961993402)
+        expected = GeoBoxEncoder.neighbors(geobox_id)
+        expected_SW = GeoPoint(geobox_id=geobox_id).box['SW'].gcode
+        self.assertEqual(GeoBoxEncoder.cache, None)
+
+        cache = geobox.enable_cache(100)
+        for _ in range(3):
+            g = GeoPoint(geobox_id=geobox_id)
+            self.assertEqual(g.box['SW'].gcode, expected_SW)
+            self.assertEqual(GeoBoxEncoder.neighbors(geobox_id), expected)
+        GeoBoxEncoder.neighbors(geobox_id).clear()
+        self.assertEqual(GeoBoxEncoder.neighbors(geobox_id), expected)
+        stats = cache.stats()
+        self.assertTrue(stats['hits'] >= 6 and stats['misses'] == 3)
+
+        class OwnEncoder(GeoBoxEncoder):
+            pass
+        OwnEncoder.disable_cache()
+        OwnEncoder.decode(geobox_id)
+        self.assertEqual(cache.stats()['hits'], stats['hits'])
+
+
+class MetricsTestCase(unittest.TestCase):
+    def tearDown(self):
+        geobox.disable_metrics()
+        geobox.disable_cache()
+
+    def test10_histogram(self):
+        metrics = Metrics(buckets=(10, 100))
+        for seconds in (0.000005, 0.000005, 0.00005, 0.5):
+            metrics.record('op', seconds)
+        stats = metrics.snapshot()['op']
+        self.assertEqual(stats['count'], 4)
+        self.assertEqual(stats['histogram'], [[10, 2], [100, 1], [None, 1]])
+        self.assertEqual(stats['max'], 0.5)
+        self.assertEqual((stats['p50'], stats['p99']), (10, None))
+        self.assertAlmostEqual(stats['mean'], 0.50006 / 4)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test11_hot_paths(self):
+        self.assertEqual(GeoBoxEncoder.metrics, None)
+        calls = []
+        metrics = geobox.enable_metrics(sink=lambda name, seconds: calls.append(name))
+        geobox_id = GeoBoxEncoder.encode(41.87643118161227, 12.481563961993402)
+        point = GeoPoint(geobox_id=geobox_id)
+        point.box
+        point.neighbors()
+        point.distance_from(GeoPoint(0.0, 0.0, build_box=False))
+        stats = metrics.snapshot()
+        self.assertEqual(stats['encode']['count'], 2)
+        self.assertEqual(stats['decode']['count'], 1)
+        self.assertEqual(stats['neighbors']['count'], 1)
+        self.assertEqual(stats['build_box']['count'], 1 + len(point.neighbors()))
+        self.assertEqual(stats['distance']['count'], 1)
+        self.assertEqual(sorted(set(calls)), sorted(stats))
+        self.assertEqual(len(calls), sum(s['count'] for s in stats.values()))
+        for name in stats:
+            self.assertEqual(sum(hits for _, hits in stats[name]['histogram']), stats[name]['count'])
+
+        # Cached results are still counted
+        geobox.enable_cache(100)
+        for _ in range(3):
+            GeoBoxEncoder.decode(geobox_id)
+        self.assertEqual(metrics.snapshot()['decode']['count'], 4)
+
+        geobox.disable_metrics()
+        GeoBoxEncoder.encode(0.0, 0.0)
+        self.assertEqual(metrics.snapshot()['encode']['count'], 2)
+
+    def test12_plain_methods(self):
+        # With metrics off the encoder runs its plain methods
+        plain = dict((method, getattr(GeoBoxEncoder, method).__func__) for method, _ in GeoBoxEncoder.METERED)
+        geobox.enable_metrics()
+        self.assertTrue(GeoBoxEncoder.encode.__func__ is not plain['encode'])
+
+        class OwnEncoder(GeoBoxEncoder):
+            pass
+        OwnEncoder.disable_metrics()
+        own = OwnEncoder.enable_metrics()
+        OwnEncoder.haversine((0.0, 0.0), (1.0, 1.0))
+        self.assertEqual(own.snapshot()['distance']['count'], 1)
+        self.assertFalse('distance' in GeoBoxEncoder.metrics.snapshot())
+        OwnEncoder.disable_metrics()
+        self.assertEqual(OwnEncoder.decode('etca'), GeoBoxEncoder.decode('etca'))
+
+        geobox.disable_metrics()
+        for method, function in plain.items():
+            self.assertTrue(getattr(GeoBoxEncoder, method).__func__ is function)
+            self.assertFalse(hasattr(getattr(OwnEncoder, method).__func__, 'plain'))
+
+
+@unittest.skipIf(np is None, 'numpy not installed')
+class GeoIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        rnd = np.random.RandomState(2013)
+        # Half spread over the world, half clustered around Milan
+        self.lats = np.concatenate((rnd.uniform(-90, 90, 5000), rnd.normal(45.46, 0.2, 5000)))
+        self.lngs = np.concatenate((rnd.uniform(-180, 180, 5000), rnd.normal(9.19, 0.2, 5000)))
+        self.index = GeoIndex(self.lats, self.lngs)
+
+    def test10_within_radius(self):
+        for latLng in ((45.46, 9.19), (0.0, 179.99), (89.99, 0.0)):
+            distances = GeoBoxEncoder.haversine_many(latLng, self.lats, self.lngs)
+            for radius in (1000.0, 20000.0, 500000.0):
+                ids, within = self.index.within_radius(latLng[0], latLng[1], radius)
+                self.assertEqual(sorted(ids.tolist()), np.flatnonzero(distances <= radius).tolist())
+                self.assertTrue((np.diff(within) >= 0).all())
+
+    def test11_k_nearest(self):
+        for latLng in ((45.46, 9.19), (0.0, 179.99), (89.99, 0.0), (-30.0, -60.0)):
+            distances = np.sort(GeoBoxEncoder.haversine_many(latLng, self.lats, self.lngs))
+            for k in (1, 10, 200):
+                ids, nearest = self.index.k_nearest(latLng[0], latLng[1], k)
+                self.assertEqual(len(ids), k)
+                self.assertTrue(np.allclose(nearest, distances[:k]))
+
+    def test12_insert_delete(self):
+        self.index.insert(45.46, 9.19, -1)
+        self.assertEqual(len(self.index), 10001)
+        self.assertEqual(self.index.k_nearest(45.46, 9.19, 1)[0].tolist(), [-1])
+        self.assertEqual(self.index.delete([-1, 0]), 2)
+        self.assertEqual(len(self.index), 9999)
+        prefix_slice = self.index.prefix_slice(GeoBoxEncoder.encode(45.46, 9.19, 6))
+        self.assertTrue(prefix_slice.stop - prefix_slice.start > 4000)
+
+
+@unittest.skipIf(np is None, 'numpy not installed')
+class GeoPointArrayTestCase(unittest.TestCase):
+    def setUp(self):
+        rnd = np.random.RandomState(2013)
+        self.lats = rnd.uniform(-90, 90, 500)
+        self.lngs = rnd.uniform(-180, 180, 500)
+        self.points = GeoPointArray.from_coordinates(self.lats, self.lngs, 12)
+
+    def test10_rows(self):
+        ids = self.points.gcode()
+        for i in (0, 17, 499, -1):
+            point = GeoPoint(self.lats[i], self.lngs[i], precision=12)
+            view = self.points[i]
+            self.assertEqual(view.gcode, point.gcode)
+            self.assertEqual(ids[i].decode(), point.gcode)
+            self.assertEqual(view.latlng, point.latlng)
+            self.assertEqual(view.box['NE'].gcode, point.box['NE'].gcode)
+        self.assertEqual(self.points.nbytes, 25 * len(self.points))
+        self.assertEqual(len(self.points[10:20]), 10)
+        self.assertEqual(len(self.points[self.points.latitudes > 0]), int((self.lats > 0).sum()))
+        self.assertEqual(self.points[[3, 4]][1].gcode, self.points[4].gcode)
+
+    def test11_vectorized(self):
+        point = self.points[42]
+        distances = self.points.distance_from(point)
+        self.assertEqual(distances[42], 0.0)
+        self.assertAlmostEqual(distances[7], point.distance_from(self.points[7]), 6)
+        neighbors = self.points.neighbors()
+        self.assertEqual(set(n.decode() for n in neighbors[42] if n), set(point.neighbors()))
+        latLng_SW, latLng_NE = self.points.bounds()
+        self.assertEqual((latLng_SW[0][42], latLng_SW[1][42]), point._latLng_SW)
+        self.assertEqual((latLng_NE[0][42], latLng_NE[1][42]), point._latLng_NE)
+
+    def test12_ids_and_sort(self):
+        ids = ['etca', 'w', 'wtacgatcgccg', GeoBoxEncoder.encode(45.46, 9.19, 8)]
+        points = GeoPointArray.from_ids(ids)
+        self.assertEqual(points.precisions.tolist(), [4, 1, 12, 8])
+        for i, geobox_id in enumerate(ids):
+            self.assertEqual(points[i].latlng, GeoPoint(geobox_id=geobox_id).latlng)
+        self.assertEqual([p.gcode for p in points], ids)
+        self.assertEqual(GeoPointArray.from_ids(points.codes[2:3], 12)[0].gcode, ids[2])
+
+        points.sort()
+        self.assertEqual([p.gcode for p in points], sorted(ids, key=lambda i: GeoBoxEncoder.id_to_code(i) << 2 * (32 - len(i))))
+        self.points.sort()
+        self.assertTrue((np.diff(self.points.codes.astype(np.float64)) >= 0).all())
+
+
+class SerializeTestCase(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2013)
+        self.points = [GeoPoint(rnd.uniform(-90, 90), rnd.uniform(-180, 180), precision=10) for _ in range(300)]
+        self.points.append(GeoPoint(89.99, 0.5, precision=3))
+
+    def test10_encoder(self):
+        point = self.points[0]
+        record = json.loads(json.dumps(point, cls=GeoPointEncoder))
+        self.assertEqual(record, {'geobox_id': point.gcode, 'latitude': point.latitude, 'longitude': point.longitude})
+        self.assertEqual(json.loads(serialize.dumps(point)), record)
+
+    def test11_box_neighbors(self):
+        text = serialize.dumps(self.points, box=True, neighbors=True)
+        records = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual(len(records), len(self.points))
+        self.assertEqual(json.loads(serialize.dumps(self.points, True, True, ndjson=False)), records)
+        for point, record in zip(self.points[-2:], records[-2:]):
+            self.assertEqual(record['geobox_id'], point.gcode)
+            for corner in ('SW', 'SE', 'NE', 'NW'):
+                self.assertEqual(tuple(record['box'][corner]), point.box[corner].latlng)
+            self.assertEqual(sorted(record['neighbors']), sorted(point.neighbors()))
+        self.assertEqual(len(records[-1]['neighbors']), 5)
+
+    @unittest.skipIf(np is None, 'numpy not installed')
+    def test12_columns(self):
+        array = GeoPointArray.from_coordinates(
+            [p.latitude for p in self.points], [p.longitude for p in self.points], 10)
+        array = GeoPointArray.concatenate((array[:-1], GeoPointArray.from_coordinates([89.99], [0.5], 3)))
+        for options in ((False, False), (True, False), (False, True)):
+            self.assertEqual(serialize.dumps(array, *options), serialize.dumps(self.points, *options))
+        chunks = list(serialize.iter_ndjson(array, chunk_size=100))
+        self.assertEqual(len(chunks), 4)
+
+        loaded = serialize.load(''.join(chunks), chunk_size=64)
+        self.assertEqual(loaded.codes.tolist(), array.codes.tolist())
+        self.assertEqual(loaded.precisions.tolist(), array.precisions.tolist())
+        self.assertEqual(loaded.latitudes.tolist(), array.latitudes.tolist())
+        points = serialize.load(serialize.dumps(array, ndjson=False), columnar=False)
+        self.assertEqual([p.latlng for p in points], [p.latlng for p in self.points])
+        self.assertEqual(points[0].box['NE'].gcode, self.points[0].box['NE'].gcode)
+
+    def test13_non_finite(self):
+        def strict(constant):
+            raise ValueError("%s is not JSON" % constant)
+        points = [GeoPoint(float('nan'), 2.5, precision=10), GeoPoint(1.5, float('inf'), precision=10), self.points[0]]
+        for ndjson in (True, False):
+            text = serialize.dumps(points, box=True, ndjson=ndjson)
+            json.loads('[' + ','.join(text.splitlines()) + ']' if ndjson else text, parse_constant=strict)
+            loaded = serialize.load(text, columnar=False)
+            self.assertTrue(math.isnan(loaded[0].latitude) and math.isnan(loaded[1].longitude))
+            self.assertEqual([p.gcode for p in loaded], [p.gcode for p in points])
+            self.assertEqual(loaded[2].latlng, points[2].latlng)
+        if np is not None:
+            array = GeoPointArray.from_coordinates([0.5, float('-inf')], [float('nan'), 2.5], 10)
+            text = serialize.dumps(array)
+            self.assertEqual(text.count('null'), 2)
+            self.assertTrue(np.isnan(serialize.load(text).latitudes[1]))
+
+    def test14_long_ids(self):
+        point = GeoPoint(45.46, 9.19, precision=40)
+        loaded = serialize.load(serialize.dumps(point), columnar=False)[0]
+        self.assertEqual(loaded.gcode, point.gcode)
+        self.assertEqual(loaded.latlng, point.latlng)
+        self.assertEqual(loaded.box['NE'].gcode, point.box['NE'].gcode)
+
+
+@unittest.skipIf(np is None, 'numpy not installed')
+class SpatialJoinTestCase(unittest.TestCase):
+    def setUp(self):
+        rnd = np.random.RandomState(2013)
+        # Spread over the world, near the north pole and across the 180 meridian
+        def points():
+            lats = np.concatenate((rnd.uniform(-90, 90, 800), rnd.uniform(86, 90, 200), rnd.uniform(-5, 5, 200)))
+            lngs = np.concatenate((rnd.uniform(-180, 180, 800), rnd.uniform(-180, 180, 200),
+                                   rnd.choice([-179.995, 179.995], 200) + rnd.uniform(-0.005, 0.005, 200)))
+            return lats, lngs
+        self.left, self.right = points(), points()
+        self.distances = GeoBoxEncoder.haversine_matrix(self.left[0], self.left[1], self.right[0], self.right[1])
+
+    def join(self, radius, **kwargs):
+        chunks = list(geobox.spatial_join(self.left[0], self.left[1], self.right[0], self.right[1], radius, **kwargs))
+        left = np.concatenate([c[0] for c in chunks]) if chunks else np.empty(0, dtype=np.intp)
+        right = np.concatenate([c[1] for c in chunks]) if chunks else np.empty(0, dtype=np.intp)
+        distances = np.concatenate([c[2] for c in chunks]) if chunks else np.empty(0)
+        self.assertTrue(np.allclose(distances, self.distances[left, right]))
+        return sorted(zip(left.tolist(), right.tolist()))
+
+    def expected(self, radius):
+        return sorted(zip(*[a.tolist() for a in np.nonzero(self.distances <= radius)]))
+
+    def test10_join(self):
+        for radius in (0.0, 2000.0, 100000.0, 1500000.0):
+            self.assertEqual(self.join(radius, processes=1, max_pairs=4096), self.expected(radius))
+
+    def test11_processes(self):
+        self.assertEqual(self.join(200000.0, processes=2, max_pairs=4096), self.expected(200000.0))
+        self.assertEqual(list(geobox.spatial_join([], [], self.right[0], self.right[1], 1000.0)), [])
+
+    def test12_interleaved(self):
+        # Two joins run in this process each keep their own columns
+        first = geobox.spatial_join(self.left[0], self.left[1], self.right[0], self.right[1], 100000.0,
+                                    processes=1, max_pairs=4096)
+        chunks = [next(first)]
+        other = geobox.spatial_join(self.right[0], self.right[1], self.left[0], self.left[1], 2000.0, processes=1)
+        other_pairs = sorted((r, l) for chunk in other for l, r in zip(chunk[0].tolist(), chunk[1].tolist()))
+        chunks += list(first)
+        pairs = sorted(p for chunk in chunks for p in zip(chunk[0].tolist(), chunk[1].tolist()))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(pairs, self.expected(100000.0))
+        self.assertEqual(other_pairs, self.expected(2000.0))
+
+
+@unittest.skipIf(np is None, 'numpy not installed')
+class CellPyramidTestCase(unittest.TestCase):
+    PRECISIONS = (2, 5, 9, 14)
+
+    def setUp(self):
+        rnd = np.random.RandomState(2013)
+        self.lats = np.concatenate((rnd.uniform(-90, 90, 5000), rnd.normal(45.46, 0.3, 5000)))
+        self.lngs = np.concatenate((rnd.uniform(-180, 180, 5000), rnd.normal(9.19, 0.3, 5000)))
+        self.values = rnd.uniform(0, 10, 10000)
+
+    def assertLevels(self, pyramid, lats, lngs, values):
+        for precision in self.PRECISIONS:
+            ids = GeoBoxEncoder.encode_many(lats, lngs, precision)
+            expected = {}
+            for geobox_id, value in zip(ids.astype(str).tolist(), values.tolist()):
+                count, total, low, high = expected.get(geobox_id, (0, 0.0, value, value))
+                expected[geobox_id] = (count + 1, total + value, min(low, value), max(high, value))
+            level = pyramid.level(precision)
+            self.assertEqual(sorted(pyramid.ids(precision).astype(str).tolist()), sorted(expected))
+            self.assertEqual(level.count.sum(), len(lats))
+            for geobox_id in list(expected)[:50]:
+                count, total, low, high = pyramid.cell(geobox_id)
+                self.assertEqual(count, expected[geobox_id][0])
+                self.assertAlmostEqual(total, expected[geobox_id][1], 6)
+                self.assertEqual((low, high), expected[geobox_id][2:])
+
+    def test10_add_merge(self):
+        pyramid = CellPyramid(self.PRECISIONS)
+        pyramid.add(self.lats[:6000], self.lngs[:6000], self.values[:6000])
+        other = CellPyramid(self.PRECISIONS)
+        other.extend(zip(self.lats[6000:], self.lngs[6000:], self.values[6000:]), chunk_size=1000)
+        pyramid.merge(other)
+        self.assertEqual(len(pyramid), 10000)
+        self.assertLevels(pyramid, self.lats, self.lngs, self.values)
+        self.assertEqual(pyramid.cell('wgggggggg'), None)
+        ids, counts = pyramid.top(9, 3)
+        self.assertEqual(counts.tolist(), sorted(pyramid.level(9).count.tolist())[:-4:-1])
+        self.assertEqual(pyramid.cell(ids[0].decode())[0], counts[0])
+
+    def test11_remove(self):
+        pyramid = CellPyramid(self.PRECISIONS)
+        pyramid.add(self.lats, self.lngs)
+        pyramid.remove(self.lats[:5000], self.lngs[:5000])
+        self.assertLevels(pyramid, self.lats[5000:], self.lngs[5000:], np.ones(5000))
+
+    def test12_capped(self):
+        pyramid = CellPyramid(self.PRECISIONS, max_cells=100, exact_precision=5)
+        pyramid.add(self.lats, self.lngs)
+        self.assertEqual([pyramid.level(p).codes.size for p in self.PRECISIONS], [8, 512, 100, 100])
+        self.assertEqual(pyramid.error[5], 0)
+        for precision in (9, 14):
+            counts = np.unique(GeoBoxEncoder.encode_many(self.lats, self.lngs, precision), return_counts=True)[1]
+            kept = pyramid.level(precision).count
+            # The boxes kept are the most populated ones, with exact counts
+            self.assertEqual(sorted(kept.tolist()), sorted(counts.tolist())[-100:])
+            # A single cap: the largest count dropped
+            self.assertEqual(pyramid.error[precision], sorted(counts.tolist())[-101])
+
+    def test13_dropped_again(self):
+        # A box dropped by every cap: its missing count grows with each one
+        pyramid = CellPyramid((4, 12), max_cells=1, exact_precision=4)
+        lats, lngs = [10.0] * 3 + [20.0] * 5, [10.0] * 3 + [20.0] * 5
+        for _ in range(2):
+            pyramid.add(lats, lngs)
+        self.assertEqual(pyramid.cell(GeoBoxEncoder.encode(10.0, 10.0, 12)), None)
+        self.assertEqual(pyramid.cell(GeoBoxEncoder.encode(20.0, 20.0, 12))[0], 10)
+        self.assertTrue(pyramid.error[12] >= 6)
+        other = CellPyramid((4, 12), max_cells=1, exact_precision=4)
+        other.add(lats, lngs)
+        pyramid.merge(other)
+        self.assertTrue(pyramid.error[12] >= 9)
+
+    def test14_merged_error(self):
+        # Batches of a shifting hot spot, merged into a capped pyramid: boxes
+        # are dropped and come back many times
+        rnd = np.random.RandomState(2013)
+        pyramid = CellPyramid(self.PRECISIONS, max_cells=40, exact_precision=5)
+        lats, lngs = np.empty(0), np.empty(0)
+        for batch in range(30):
+            center = 45.0 + batch % 7 * 0.05
+            batch_lats = np.concatenate((rnd.normal(center, 0.05, 300), rnd.uniform(-90, 90, 100)))
+            batch_lngs = np.concatenate((rnd.normal(9.0, 0.05, 300), rnd.uniform(-180, 180, 100)))
+            other = CellPyramid(self.PRECISIONS, max_cells=40, exact_precision=5)
+            other.add(batch_lats, batch_lngs)
+            pyramid.merge(other)
+            lats, lngs = np.concatenate((lats, batch_lats)), np.concatenate((lngs, batch_lngs))
+            for precision in (9, 14):
+                ids, counts = np.unique(GeoBoxEncoder.encode_many(lats, lngs, precision), return_counts=True)
+                missing = [count - (pyramid.cell(geobox_id) or (0,))[0]
+                           for geobox_id, count in zip(ids.astype(str).tolist(), counts.tolist())]
+                self.assertTrue(min(missing) >= 0)
+                self.assertTrue(max(missing) <= pyramid.error[precision], (batch, precision))
+        self.assertTrue(pyramid.error[9] > 0 and pyramid.error[14] > 0)
+        self.assertTrue(pyramid.error[14] <= len(lats) - pyramid.level(14).count.sum())
+
+
+class PolygonTestCase(unittest.TestCase):
+    def setUp(self):
+        # A wavy zone around Milan with a square hole
+        count = 300
+        self.polygon = []
+        for i in range(count):
+            angle = 2 * math.pi * i / count
+            radius = 0.5 + 0.3 * math.sin(7 * angle)
+            self.polygon.append((45.46 + radius * math.sin(angle), 9.19 + radius * math.cos(angle)))
+        self.hole = [(45.40, 9.10), (45.40, 9.28), (45.52, 9.28), (45.52, 9.10)]
+        self.edges = geometry.polygon_edges(self.polygon, [self.hole])
+        rnd = random.Random(2013)
+        self.points = [(rnd.uniform(44.5, 46.5), rnd.uniform(8.1, 10.3)) for _ in range(3000)]
+
+    def test10_cover(self):
+        interior, boundary = GeoBoxEncoder.cover_polygon(self.polygon, max_cells=200, holes=[self.hole])
+        self.assertTrue(len(interior) + len(boundary) <= 200)
+        self.assertFalse(set(interior) & set(boundary))
+        rnd = random.Random(2013)
+        for cell in interior:
+            latLng_SW, latLng_NE = GeoBoxEncoder.decode(cell, box=True)[1:]
+            for _ in range(10):
+                lat, lng = rnd.uniform(latLng_SW[0], latLng_NE[0]), rnd.uniform(latLng_SW[1], latLng_NE[1])
+                self.assertTrue(geometry.contains(self.edges, lat, lng))
+        for lat, lng in self.points:
+            if geometry.contains(self.edges, lat, lng):
+                geobox_id = GeoBoxEncoder.encode(lat, lng, 32)
+                self.assertTrue(any(geobox_id.startswith(c) for c in interior + boundary))
+        self.assertRaises(ValueError, GeoBoxEncoder.cover_polygon, [(0, 0), (1, 1)])
+
+    def test11_index(self):
+        index = PolygonIndex(self.polygon, [self.hole], max_cells=200)
+        expected = [geometry.contains(self.edges, lat, lng) for lat, lng in self.points]
+        self.assertEqual([index.contains(lat, lng) for lat, lng in self.points], expected)
+        self.assertTrue(any(expected) and not all(expected))
+        self.assertFalse((45.46, 9.19) in index)
+        if np is not None:
+            lats, lngs = np.array(self.points).T
+            self.assertEqual(index.contains_many(lats, lngs).tolist(), expected)
+            self.assertEqual(geometry.contains_many(self.edges, lats, lngs).tolist(), expected)
+
+
+@unittest.skipIf(np is None, 'numpy not installed')
+class GeofenceTestCase(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2013)
+        self.engine = GeofenceEngine(precision=16, dwell=60)
+        self.fences = {}
+        for i in range(100):
+            lat, lng = rnd.uniform(45.0, 46.0), rnd.uniform(9.0, 10.0)
+            if i % 2:
+                radius = rnd.uniform(50, 3000)
+                self.engine.add_circle(i, lat, lng, radius)
+                self.fences[i] = lambda la, ln, c=(lat, lng), r=radius: GeoBoxEncoder.haversine((la, ln), c) <= r
+            else:
+                size = rnd.uniform(0.001, 0.05)
+                self.engine.add_rectangle(i, (lat, lng), (lat + size, lng + 2 * size))
+                self.fences[i] = lambda la, ln, b=(lat, lng, lat + size, lng + 2 * size): (
+                    b[0] <= la <= b[2] and b[1] <= ln <= b[3])
+        self.positions = [[rnd.uniform(45.0, 46.0), rnd.uniform(9.0, 10.0)] for _ in range(200)]
+        self.rnd = rnd
+
+    def inside(self, lat, lng):
+        return set(f for f, contains in self.fences.items() if contains(lat, lng))
+
+    def test10_replay(self):
+        engine = self.engine
+        vehicles = list(range(len(self.positions)))
+        previous = [set() for _ in vehicles]
+        for step in range(30):
+            for position in self.positions:
+                position[0] += self.rnd.gauss(0, 0.001)
+                position[1] += self.rnd.gauss(0, 0.001)
+            lats, lngs = [p[0] for p in self.positions], [p[1] for p in self.positions]
+            events = engine.update(vehicles, lats, lngs, [step * 10.0] * len(vehicles))
+            for v in vehicles:
+                current = self.inside(lats[v], lngs[v])
+                self.assertEqual(engine.inside(v), current)
+                mine = [e for e in events if e.vehicle == v]
+                self.assertEqual(set(e.fence for e in mine if e.kind == 'enter'), current - previous[v])
+                self.assertEqual(set(e.fence for e in mine if e.kind == 'exit'), previous[v] - current)
+                previous[v] = current
+        self.assertTrue(engine.skipped > 0 and engine.evaluated > 0)
+        self.assertEqual(len(engine), len(vehicles))
+
+    def test11_dwell(self):
+        engine = GeofenceEngine(precision=16, dwell=60)
+        engine.add_circle('depot', 45.46, 9.19, 500)
+        engine.add_rectangle('yard', (45.0, 9.0), (45.1, 9.1))
+        kinds = lambda events: [(e.vehicle, e.fence, e.kind, e.timestamp) for e in events]
+        self.assertEqual(kinds(engine.update(['a', 'b'], [45.46, 45.05], [9.19, 9.05], [0, 0])),
+                         [('a', 'depot', 'enter', 0), ('b', 'yard', 'enter', 0)])
+        self.assertEqual(engine.update(['a', 'b'], [45.46, 45.05], [9.19, 9.05], [30, 30]), [])
+        # Dwell once per stay, even for a vehicle skipped in its box
+        self.assertEqual(kinds(engine.update(['a', 'a', 'b'], [45.46, 45.46, 45.05], [9.19, 9.19, 9.05], [60, 70, 90])),
+                         [('a', 'depot', 'dwell', 60), ('b', 'yard', 'dwell', 90)])
+        self.assertEqual(engine.update(['a'], [45.46], [9.19], [200]), [])
+        events = list(engine.process([(['a'], [44.0], [9.0], [210]), (['a'], [45.46], [9.19], [220])]))
+        self.assertEqual(kinds(events), [('a', 'depot', 'exit', 210), ('a', 'depot', 'enter', 220)])
+
+        # A fence added later is seen at the next update, even in the same box
+        engine.add_circle('gate', 45.46, 9.19, 100)
+        self.assertEqual(kinds(engine.update(['a'], [45.46], [9.19], [230])), [('a', 'gate', 'enter', 230)])
+        engine.remove_fence('gate')
+        self.assertEqual(engine.inside('a'), set(['depot']))
+        self.assertEqual(engine.inside('c'), set())
+        self.assertRaises(ValueError, engine.update, ['a'], [45.0, 46.0], [9.0], [0])
+        self.assertRaises(ValueError, engine.add_circle, 'bad', 45.0, 9.0, 0)
+
+
+@unittest.skipIf(np is None or sys.version_info < (3, 7), 'the server needs Python 3.7 and numpy')
+class GeoServerTestCase(unittest.TestCase):
+    # The server loop runs in a thread, the requests are sent over plain sockets
+    def start(self, **kwargs):
+        import asyncio
+        from geobox.server import GeoServer
+        self.asyncio = asyncio
+        self.server = GeoServer(**kwargs)
+        self.batches = []
+
+        def recorded(operation):
+            method = getattr(self.server, operation)
+
+            def many(items, parameter):
+                self.batches.append(len(items))
+                return method(items, parameter)
+            return many
+        for operation in ('_encode_many', '_decode_many'):
+            setattr(self.server, operation, recorded(operation))
+
+        self.loop = asyncio.new_event_loop()
+        listening = self.loop.run_until_complete(self.server.start())
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+        self.client = socket.create_connection(listening.sockets[0].getsockname()[:2])
+        self.responses = self.client.makefile('r')
+
+    def tearDown(self):
+        self.responses.close()
+        self.client.close()
+        self.asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result(10)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def request(self, *requests):
+        self.client.sendall(''.join(json.dumps(r) + '\n' for r in requests).encode('utf-8'))
+        responses = [json.loads(self.responses.readline()) for _ in requests]
+        return dict((r['id'], r) for r in responses)
+
+    def encodes(self, count):
+        return [{'id': i, 'op': 'encode', 'lat': 45.0 + i / 100.0, 'lng': 9.0, 'precision': 12}
+                for i in range(count)]
+
+    def test10_coalesce(self):
+        self.start(window=0.2)
+        responses = self.request(*self.encodes(50))
+        self.assertEqual(self.batches, [50])
+        self.assertEqual(responses[7]['result'], GeoBoxEncoder.encode(45.07, 9.0, 12))
+
+    def test11_max_batch(self):
+        self.start(window=0.2, max_batch=16)
+        self.request(*self.encodes(40))
+        self.assertEqual(self.batches, [16, 16, 8])
+
+    def test12_max_pending(self):
+        self.start(window=0.05, max_pending=8)
+        responses = self.request(*self.encodes(30))
+        self.assertEqual(len(responses), 30)
+        self.assertEqual(sum(self.batches), 30)
+        self.assertEqual(max(self.batches), 8)
+
+    def test13_errors(self):
+        self.start(window=0.01)
+        requests = [{'id': 1, 'op': 'fly'}, {'id': 2, 'op': 'encode', 'lat': 'north', 'lng': 9.0},
+                    {'id': 3, 'op': 'decode', 'geobox_id': 'xy'}, {'id': 4, 'op': 'decode', 'geobox_id': 'ec'},
+                    {'id': 5, 'op': 'neighbors'}]
+        responses = self.request(*requests)
+        for i in (1, 2, 3, 5):
+            self.assertEqual(sorted(responses[i]), ['error', 'id'])
+        self.assertIn('unknown op', responses[1]['error'])
+        self.assertEqual(responses[4]['result'], list(GeoBoxEncoder.decode('ec')))
+        # The bad geobox_id failed on its own, not the batch it was in
+        self.assertEqual(self.batches, [2, 1, 1])
+        self.client.sendall(b'not json\n')
+        self.assertEqual(json.loads(self.responses.readline())['id'], None)
+
+
+@unittest.skipIf(np is None, 'numpy not installed')
+class GeoIndexFileTestCase(unittest.TestCase):
+    def setUp(self):
+        rnd = np.random.RandomState(2013)
+        self.lats = np.concatenate((rnd.uniform(-90, 90, 3000), rnd.normal(51.48, 0.1, 3000)))
+        self.lngs = np.concatenate((rnd.uniform(-180, 180, 3000), rnd.normal(0.0, 0.1, 3000)))
+        self.payloads = [('point %d' % i).encode('ascii') * (i % 3) for i in range(self.lats.size)]
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test10_geocode_keys(self):
+        loc_file = '../../res/location.json'
+        with open(loc_file, 'r') as fh:
+            loc = json.load(fh)
+        keys = storage.signed_geocodes(storage.geocode_keys(
+            [data['lat'] for data in loc.values()], [data['lon'] for data in loc.values()]))
+        self.assertEqual(keys.tolist(), [data['gcode'] for data in loc.values()])
+
+    def test11_streaming_writer_matches_write_index(self):
+        for scheme in ('geobox', 'geocode'):
+            path = os.path.join(self.tmpdir, scheme)
+            storage.write_index(path, self.lats, self.lngs, self.payloads, scheme)
+            merged_path = os.path.join(self.tmpdir, scheme + '.merged')
+            with storage.GeoIndexWriter(merged_path, scheme, run_size=1000) as writer:
+                for start in range(0, self.lats.size, 700):
+                    stop = start + 700
+                    writer.add(self.lats[start:stop], self.lngs[start:stop], self.payloads[start:stop])
+
+            with storage.GeoIndexFile(path) as index:
+                with storage.GeoIndexFile(merged_path) as merged:
+                    self.assertEqual(len(index), self.lats.size)
+                    self.assertTrue((index.keys == merged.keys).all())
+                    self.assertTrue((np.diff(index.keys) >= 0).all())
+                    rows = set((index.latitudes[i], index.longitudes[i], index.payload(i)) for i in range(len(index)))
+                    merged_rows = set((merged.latitudes[i], merged.longitudes[i], merged.payload(i)) for i in range(len(merged)))
+                    self.assertEqual(rows, set(zip(self.lats, self.lngs, self.payloads)))
+                    self.assertEqual(rows, merged_rows)
+
+    def test12_within_radius(self):
+        for scheme in ('geobox', 'geocode'):
+            path = os.path.join(self.tmpdir, scheme)
+            storage.write_index(path, self.lats, self.lngs, scheme=scheme, coord_dtype='f4')
+            with storage.GeoIndexFile(path) as index:
+                lats = index.latitudes.astype(np.float64)
+                lngs = index.longitudes.astype(np.float64)
+                for latLng in ((51.48, 0.0), (51.5, -0.01), (0.0, 179.99)):
+                    for radius in (1000.0, 20000.0):
+                        positions, distances = index.within_radius(latLng[0], latLng[1], radius)
+                        expected = np.flatnonzero(GeoBoxEncoder.haversine_many(latLng, lats, lngs) <= radius)
+                        self.assertEqual(sorted(positions.tolist()), expected.tolist())
+
+@unittest.skipIf(np is None, 'numpy not installed')
+class GeohashTestCase(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2013)
+        self.points = [(rnd.uniform(-180, 180), rnd.uniform(-90, 90)) for _ in range(200)]
+        self.points += [(0.0, 0.0), (-180.0, -90.0), (180.0, 90.0), (-5.6, 42.6)]
+
+    def test10_reference(self):
+        self.assertEqual(str(Geohash((-5.6, 42.6)))[:5], 'ezs42')
+        self.assertEqual(Geohash('ezs42').bbox(), (-5.625, 42.583008, -5.537109, 42.626953))
+        self.assertEqual(str(Geohash((-5.6, 42.6), depth=3)), 'eh')
+        self.assertEqual(str(Geoindex((1, 1), depth=3)), '220000')
+
+    def test11_bits_match_bit_by_bit(self):
+        for depth in (1, 5, 32, 40):
+            for x, y in self.points:
+                xs = Geostring._to_bits((x + 180) / 360.0, depth)
+                ys = Geostring._to_bits((y + 90) / 180.0, depth)
+                bits = ''.join('%d%d' % pair for pair in zip(xs, ys))
+                self.assertEqual(Geostring.bitstring((x, y), depth=depth), bits)
+                hash = Geostring((x, y), depth=depth)
+                for prefix in (1, 7, 2 * depth):
+                    self.assertEqual(hash.bbox(prefix), hash._bits_bbox(bits[:prefix]))
+                if depth % 5 == 0:
+                    hash = Geohash((x, y), depth=depth)
+                    for prefix in (1, 7, 2 * depth // 5):
+                        self.assertEqual(hash.bbox(prefix), hash._bits_bbox(bits[:5 * prefix]))
+
+    @unittest.skipIf(np is None, 'numpy not installed')
+    def test12_batch(self):
+        xs = np.array([p[0] for p in self.points])
+        ys = np.array([p[1] for p in self.points])
+        for cls in (Geostring, Geoindex, Geohash):
+            for depth in (1, 13, 32):
+                hashes = cls.bitstring_many(xs, ys, depth=depth)
+                expected = [str(cls((x, y), depth=depth)) for x, y in self.points]
+                self.assertEqual(hashes.astype(str).tolist(), expected)
+                bounds = cls.bbox_many(hashes)
+                for i, hash in enumerate(expected):
+                    box = tuple(round(float(b[i]), 6) for b in bounds)
+                    self.assertEqual(box, cls(hash).bbox())
+        self.assertRaises(ValueError, Geohash.bbox_many, np.array(['ezs4a']))
+
+    def test13_adjacent(self):
+        self.assertEqual(dict((d, str(h)) for d, h in Geohash('ezs42').neighbors().items()), {
+            'N': 'ezs48', 'NE': 'ezs49', 'E': 'ezs43', 'SE': 'ezs41',
+            'S': 'ezs40', 'SW': 'ezefp', 'W': 'ezefr', 'NW': 'ezefx'})
+        self.assertEqual(sorted(Geohash('u').neighbors()), ['E', 'S', 'SE', 'SW', 'W'])
+        self.assertEqual(str(Geohash('b').adjacent('W')), 'z')
+        self.assertRaises(ValueError, Geohash('ezs42').adjacent, 'X')
+        self.assertRaises(ValueError, Geohash('ezs4a').adjacent, 'N')
+        moves = {'N': (0, 1), 'NE': (1, 1), 'E': (1, 0), 'SE': (1, -1),
+                 'S': (0, -1), 'SW': (-1, -1), 'W': (-1, 0), 'NW': (-1, 1)}
+        for x, y in self.points:
+            for length in (1, 2, 5, 8):
+                hash = Geohash(str(Geohash((x, y)))[:length])
+                minx, miny, maxx, maxy = Geohash._cell_bounds(hash.hash)
+                for direction, (dx, dy) in moves.items():
+                    cy = (miny + maxy) / 2 + dy * (maxy - miny)
+                    cx = ((minx + maxx) / 2 + dx * (maxx - minx) + 180) % 360 - 180
+                    expected = None
+                    if -90 < cy < 90:
+                        expected = str(Geohash((cx, cy)))[:length]
+                    neighbor = hash.adjacent(direction)
+                    self.assertEqual(neighbor and str(neighbor), expected)
+
+    def assertCovers(self, prefixes, points):
+        for x, y in points:
+            hash = str(Geohash((x, y)))
+            self.assertTrue(any(hash.startswith(p) for p in prefixes), (x, y, prefixes))
+
+    def test14_cover_radius(self):
+        rnd = random.Random(2013)
+        for (x, y), radius in [((2.35, 48.85), 1000), ((179.99, -12.5), 20000),
+                               ((-70.0, -89.9), 50000), ((10.0, 0.0), 3000000)]:
+            prefixes = Geohash.cover_radius((x, y), radius, max_cells=16)
+            self.assertTrue(0 < len(prefixes) <= 16, prefixes)
+            points = []
+            while len(points) < 300:
+                lat = rnd.uniform(-90, 90)
+                lng = rnd.uniform(-180, 180)
+                if GeoBoxEncoder.haversine((y, x), (lat, lng)) <= radius:
+                    points.append((lng, lat))
+                else:
+                    # Most random points are far, move them into the circle
+                    f = rnd.random() * radius / GeoBoxEncoder.haversine((y, x), (lat, lng))
+                    points.append((x + (lng - x) * f, y + (lat - y) * f))
+            points = [p for p in points if GeoBoxEncoder.haversine((y, x), (p[1], p[0])) <= radius]
+            self.assertCovers(prefixes, points)
+        self.assertEqual(Geohash.cover_radius((0.0, 0.0), 30000000), [''])
+
+    def test15_cover_bbox(self):
+        rnd = random.Random(2013)
+        for bbox in [(2.2, 48.8, 2.5, 48.9), (170.0, -10.0, -170.0, 10.0), (-180.0, -90.0, 180.0, 90.0)]:
+            prefixes = Geohash.cover_bbox(bbox, max_cells=16)
+            self.assertTrue(0 < len(prefixes) <= 16, prefixes)
+            width = (bbox[2] - bbox[0]) % 360.0 or 360.0
+            points = [((bbox[0] + rnd.uniform(0, width) + 180) % 360 - 180, rnd.uniform(bbox[1], bbox[3]))
+                      for _ in range(300)]
+            self.assertCovers(prefixes, points + [(bbox[0], bbox[1])])
+
+
+class TranscodeTestCase(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2013)
+        self.points = [(rnd.uniform(-90, 90), rnd.uniform(-180, 180)) for _ in range(300)]
+
+    def test10_round_trips(self):
+        for lat, lng in self.points:
+            for precision in (1, 2, 9, 32):
+                geobox_id = GeoBoxEncoder.encode(lat, lng, precision)
+                self.assertEqual(transcode.to_geobox(transcode.from_geobox(geobox_id)), geobox_id)
+                code = GeoBoxEncoder.encode_int(lat, lng, precision)
+                self.assertEqual(transcode.to_geobox(transcode.from_geobox(code, precision), code=True), code)
+            for depth in (0, 7, 32):
+                for curve in ('morton', 'hilbert'):
+                    code = Geocode(lng, lat, depth, curve).gcode()
+                    self.assertEqual(transcode.to_geocode(transcode.from_geocode(code, depth, curve), curve=curve), code)
+            for length in (1, 2, 8, 13):
+                geohash = str(Geohash((lng, lat)))[:length]
+                self.assertEqual(transcode.to_geohash(transcode.from_geohash(geohash)), geohash)
+
+    def test11_matches_encoders(self):
+        # Random points are not on a cell edge, where the encoders differ
+        for lat, lng in self.points:
+            for precision in (3, 8, 17, 32):
+                cell = transcode.from_geobox(GeoBoxEncoder.encode(lat, lng, precision))
+                depth = precision - 1
+                self.assertEqual(transcode.to_geocode(cell), Geocode(lng, lat, depth).gcode())
+                self.assertEqual(transcode.to_geocode(cell, 2, 'hilbert'), Geocode(lng, lat, 2, 'hilbert').gcode())
+                length = (2 * precision - 1) // 5
+                self.assertEqual(transcode.to_geohash(cell), str(Geohash((lng, lat)))[:length])
+            cell = transcode.from_geocode(Geocode(lng, lat).gcode())
+            self.assertEqual(transcode.to_geobox(cell), GeoBoxEncoder.encode(lat, lng, 32))
+            self.assertEqual(transcode.to_geohash(cell), str(Geohash((lng, lat)))[:12])
+            for length in (1, 5, 13):
+                cell = transcode.from_geohash(str(Geohash((lng, lat)))[:length])
+                precision = (5 * length + 1) // 2
+                self.assertEqual(transcode.to_geobox(cell), GeoBoxEncoder.encode(lat, lng, min(precision, 32)))
+                self.assertEqual(transcode.to_geocode(cell), Geocode(lng, lat, 5 * length // 2).gcode())
+
+    def test12_errors(self):
+        cell = transcode.from_geohash('9q')
+        self.assertEqual(cell, transcode.Cell(5, 22, 5, 5))
+        self.assertRaises(ValueError, transcode.to_geohash, cell, 3)
+        self.assertRaises(ValueError, transcode.to_geobox, cell, 7)
+        self.assertRaises(ValueError, transcode.to_geocode, cell, 6)
+        self.assertRaises(ValueError, transcode.from_geohash, '9a')
+        self.assertRaises(ValueError, transcode.from_geocode, 0, 33)
+        self.assertEqual(transcode.to_geobox(cell, 2), 'wa')
+
+    @unittest.skipIf(np is None, 'numpy not installed')
+    def test13_batch(self):
+        lats = np.array([p[0] for p in self.points])
+        lngs = np.array([p[1] for p in self.points])
+        ids = GeoBoxEncoder.encode_many(lats, lngs, 32)
+        cells = transcode.from_geobox_many(ids)
+        self.assertEqual(transcode.to_geobox_many(cells).tolist(), ids.tolist())
+        codes = GeoBoxEncoder.ids_to_codes(ids)
+        self.assertEqual(transcode.to_geobox_many(transcode.from_geobox_many(codes, 32), codes=True).tolist(),
+                         codes.tolist())
+        for curve in ('morton', 'hilbert'):
+            geocodes = transcode.to_geocode_many(cells, curve=curve)
+            self.assertEqual(geocodes.dtype, np.int64)
+            expected = [transcode.to_geocode(transcode.from_geobox(i), curve=curve) for i in ids.astype(str)]
+            self.assertEqual(geocodes.tolist(), expected)
+            back = transcode.to_geocode_many(transcode.from_geocode_many(geocodes, 31, curve), curve=curve)
+            self.assertEqual(back.tolist(), expected)
+        for length in (1, 12, 13):
+            geohashes = np.array([str(Geohash((lng, lat)))[:length] for lat, lng in self.points])
+            cells = transcode.from_geohash_many(geohashes)
+            self.assertEqual(transcode.to_geohash_many(cells).astype(str).tolist(), geohashes.tolist())
+            expected = [transcode.to_geobox(transcode.from_geohash(h)) for h in geohashes]
+            self.assertEqual(transcode.to_geobox_many(cells).astype(str).tolist(), expected)
+        self.assertRaises(ValueError, transcode.from_geohash_many, np.array(['9q', '9']))
+
+
+class CliTestCase(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2013)
+        self.points = [(rnd.uniform(-90, 90), rnd.uniform(-180, 180)) for _ in range(200)]
+        self.points += [(51.48, 0.0), (0.0, 0.0), (-90.0, -180.0), (45.0, 90.0), (0.0, -180.0)]
+        self.lats = np.array([p[0] for p in self.points])
+        self.lngs = np.array([p[1] for p in self.points])
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test10_geocode_many(self):
+        for depth in (32, 20):
+            codes = cli.geocode_many(self.lats, self.lngs, depth)
+            self.assertEqual(codes.tolist(), [Geocode(lng, lat, depth).gcode() for lat, lng in self.points])
+
+    def test11_geohash_many(self):
+        for length in (12, 9, 1):
+            hashes = cli.geohash_many(self.lats, self.lngs, length).astype(str)
+            self.assertEqual(hashes.tolist(), [str(Geohash((lng, lat)))[:length] for lat, lng in self.points])
+        # Out of range coordinates are truncated and masked like Geostring does
+        points = [(95.0, 200.0), (-95.0, -200.0), (90.0, 180.0), (-135.5, 370.25)]
+        lats, lngs = np.array(points).T
+        self.assertEqual(cli.geohash_many(lats, lngs).astype(str).tolist(),
+                         [str(Geohash((lng, lat)))[:12] for lat, lng in points])
+        self.assertEqual(cli.geohash_many([95.0], [200.0]).astype(str).tolist(), ['02yhrn5x1g8c'])
+
+    def test12_main_keeps_row_order(self):
+        source = os.path.join(self.tmpdir, 'points.csv')
+        with open(source, 'w') as fh:
+            fh.write('name,Latitude,Lng\n')
+            for i, (lat, lng) in enumerate(self.points):
+                fh.write('p%d,%r,%r\n' % (i, lat, lng))
+            fh.write('bad,,3\n')
+
+        target = os.path.join(self.tmpdir, 'out.csv')
+        for workers in (1, 3):
+            self.assertEqual(cli.main([source, '-o', target, '-w', str(workers), '-c', '7', '-q']), 0)
+            with open(target) as fh:
+                lines = fh.read().splitlines()
+            self.assertEqual(lines[0], 'name,Latitude,Lng,geobox')
+            self.assertEqual(lines[-1], 'bad,,3,')
+            expected = ['p%d,%r,%r,%s' % (i, lat, lng, GeoBoxEncoder.encode(lat, lng))
+                        for i, (lat, lng) in enumerate(self.points)]
+            self.assertEqual(lines[1:-1], expected)
+
+    def test13_main_ndjson(self):
+        source = os.path.join(self.tmpdir, 'points.ndjson')
+        with open(source, 'w') as fh:
+            for lat, lng in self.points:
+                fh.write(json.dumps({'lat': lat, 'lon': lng}) + '\n')
+        target = os.path.join(self.tmpdir, 'out.ndjson')
+        self.assertEqual(cli.main([source, '-o', target, '-f', 'geohash', '-p', '7', '--field', 'hash', '-q']), 0)
+        with open(target) as fh:
+            hashes = [json.loads(line)['hash'] for line in fh]
+        self.assertEqual(hashes, [str(Geohash((lng, lat)))[:7] for lat, lng in self.points])
+
+
 # =================================================================
 # Run
 if __name__ == '__main__':